@@ -4,10 +4,18 @@ Receives processing jobs from Make.com and executes face-swap pipeline
 """
 
 import os
+import json
 import yaml
 import logging
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from process import process_video_job
+from job_queue import JobQueue, ACTIVE_STATES, DEFAULT_MAX_ATTEMPTS
+from timeline import parse_windows, TimelineError
+from input_cache import configure_input_cache, input_cache_stats
+from model_server import start_model_server, model_server_health
+from webhooks import configure_webhooks, webhook_stats
+from result_index import configure_result_index, result_index_stats
+import metrics
 import traceback
 
 # Configure logging
@@ -38,26 +46,97 @@ def load_config():
 
 CONFIG = load_config()
 
+def run_job(record_id, payload):
+    """Queue runner: one process_video_job on a worker slot"""
+    return process_video_job(
+        record_id=record_id,
+        video_url=payload['video_url'],
+        avatar_url=payload['avatar_url'],
+        config=CONFIG,
+        webhook_url=payload.get('webhook_url'),
+        timeline=payload.get('timeline')
+    )
+
+JOBS = None
+
+def create_app():
+    """
+    Start caches, webhook outbox, result index, model server and job queue,
+    then return the app
+
+    Called from __main__ or as a WSGI app factory (gunicorn 'app:create_app()'),
+    never at import: nothing here may run twice in one container.
+    """
+    global JOBS
+    if not CONFIG or JOBS is not None:
+        return app
+
+    configure_input_cache(CONFIG)
+    configure_webhooks(CONFIG)
+    configure_result_index(CONFIG)
+    # Load Wan2.2 once at container start (no-op unless processing.model_server.enabled)
+    start_model_server(CONFIG.get('processing', {}))
+
+    queue_config = CONFIG.get('queue') or {}
+    JOBS = JobQueue(
+        queue_config.get('journal_path', '/runpod-volume/jobs.sqlite3'),
+        run_job,
+        slots=queue_config.get('gpu_slots', 1),
+        max_attempts=queue_config.get('max_attempts', DEFAULT_MAX_ATTEMPTS)
+    ).start()
+    return app
+
+# Longest a client may hold a request open waiting for a result
+MAX_WAIT_SECONDS = 1800
+
+def requested_wait():
+    """?wait=<seconds> opts a request into long-polling"""
+    try:
+        return min(max(float(request.args.get('wait', 0)), 0), MAX_WAIT_SECONDS)
+    except ValueError:
+        return 0
+
+def job_response(job):
+    """Finished jobs answer like the old synchronous endpoint, others with 202"""
+    if job['status'] in ACTIVE_STATES:
+        return jsonify(job), 202
+    return jsonify(job['result'] or {'status': 'failed', 'error': job['error']}), 200
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint for Runpod"""
     return jsonify({
         'status': 'healthy',
         'service': 'ugc-faceswapper-v1',
-        'config_loaded': CONFIG is not None
+        'config_loaded': CONFIG is not None,
+        'model_server': model_server_health(),
+        'input_cache': input_cache_stats(),
+        'webhooks': webhook_stats(),
+        'result_index': result_index_stats()
     }), 200
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Per-stage histograms in Prometheus text format"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 @app.route('/process', methods=['POST'])
 def process():
     """
-    Main processing endpoint
+    Main processing endpoint - queues the job and returns 202 immediately
     Expects JSON payload:
     {
         "record_id": "recXXXXXXXXXX",
         "video_url": "https://...",
         "avatar_url": "https://...",
-        "webhook_url": "https://hook.make.com/..."
+        "webhook_url": "https://hook.make.com/...",
+        "priority": 0,
+        "timeline": [{"start": 0, "end": 5, "mode": "swap"}, ...]  (optional)
     }
+
+    Add ?wait=<seconds> to block until the job finishes (old behaviour,
+    returns the result with 200) or the wait expires (202 + job status).
+    Progress can be followed at /jobs/<record_id> or /jobs/<record_id>/events.
     """
     if not CONFIG:
         return jsonify({
@@ -85,32 +164,52 @@ def process():
                 'message': f'Missing required fields: {", ".join(missing_fields)}'
             }), 400
 
-        logger.info(f"Starting processing for record: {data['record_id']}")
+        if data.get('timeline') is not None:
+            try:
+                parse_windows(data['timeline'])
+            except TimelineError as e:
+                return jsonify({'status': 'error', 'message': str(e)}), 400
+
+        priority = data.get('priority')
+        try:
+            priority = int(priority) if priority is not None else 0
+        except (TypeError, ValueError):
+            return jsonify({
+                'status': 'error',
+                'message': f"priority must be an integer, got {priority!r}"
+            }), 400
 
         # Extract data
         record_id = data['record_id']
-        video_url = data['video_url']
-        avatar_url = data['avatar_url']
         webhook_url = data.get('webhook_url') or CONFIG.get('webhook', {}).get('completion_url')
 
         if not webhook_url:
             logger.warning("No webhook URL provided, skipping callback")
 
-        # Process video (this runs synchronously)
-        result = process_video_job(
-            record_id=record_id,
-            video_url=video_url,
-            avatar_url=avatar_url,
-            config=CONFIG,
-            webhook_url=webhook_url
+        job, created = JOBS.submit(
+            record_id,
+            {
+                'video_url': data['video_url'],
+                'avatar_url': data['avatar_url'],
+                'webhook_url': webhook_url,
+                'timeline': data.get('timeline')
+            },
+            priority=priority
         )
+        logger.info(f"{'Queued' if created else 'Already queued'} record: {record_id}")
 
-        if result['status'] == 'success':
-            logger.info(f"Processing completed successfully for record: {record_id}")
-            return jsonify(result), 200
-        else:
-            logger.error(f"Processing failed for record: {record_id} - {result.get('error')}")
-            return jsonify(result), 200  # Still return 200 so Runpod doesn't retry
+        wait = requested_wait()
+        if wait:
+            return job_response(JOBS.wait(record_id, wait))
+
+        return jsonify({
+            'status': 'accepted' if created else 'duplicate',
+            'job_id': record_id,
+            'job_status': job['status'],
+            'position': job.get('position'),
+            'eta_seconds': job.get('eta_seconds'),
+            'status_url': f'/jobs/{record_id}'
+        }), 202
 
     except Exception as e:
         error_msg = f"Unexpected error: {str(e)}"
@@ -122,6 +221,53 @@ def process():
             'traceback': traceback.format_exc()
         }), 500
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Job status; ?wait=<seconds> long-polls until it finishes"""
+    if not JOBS:
+        return jsonify({'status': 'error', 'message': 'Configuration not loaded'}), 500
+
+    wait = requested_wait()
+    job = JOBS.wait(job_id, wait) if wait else JOBS.get(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'message': f'Unknown job: {job_id}'}), 404
+    return job_response(job) if wait else (jsonify(job), 200)
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancel a job that has not started yet (running jobs finish)"""
+    if not JOBS:
+        return jsonify({'status': 'error', 'message': 'Configuration not loaded'}), 500
+
+    job, cancelled = JOBS.cancel(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'message': f'Unknown job: {job_id}'}), 404
+    if not cancelled:
+        return jsonify({
+            'status': 'error',
+            'message': f"Job {job_id} is {job['status']}, only queued jobs can be cancelled"
+        }), 409
+    return jsonify(job), 200
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Server-sent events: one `data:` line per status change until the job finishes"""
+    if not JOBS:
+        return jsonify({'status': 'error', 'message': 'Configuration not loaded'}), 500
+    if JOBS.get(job_id) is None:
+        return jsonify({'status': 'error', 'message': f'Unknown job: {job_id}'}), 404
+
+    def stream():
+        job = JOBS.get(job_id)
+        while True:
+            yield f"event: status\ndata: {json.dumps(job)}\n\n"
+            if job is None or job['status'] not in ACTIVE_STATES:
+                return
+            # 15s heartbeat keeps proxies from closing an idle stream
+            job = JOBS.wait(job_id, 15, since_status=job['status'])
+
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
 @app.route('/status', methods=['GET'])
 def status():
     """Status endpoint showing current processing info"""
@@ -130,7 +276,9 @@ def status():
         'version': '1.0.0',
         'model': 'wan2.2-animate-14b',
         'gpu': os.getenv('CUDA_VISIBLE_DEVICES', 'not set'),
-        'config_loaded': CONFIG is not None
+        'config_loaded': CONFIG is not None,
+        'queue': JOBS.stats() if JOBS else None,
+        'jobs': JOBS.list() if JOBS else []
     }), 200
 
 if __name__ == '__main__':
@@ -138,6 +286,8 @@ if __name__ == '__main__':
         logger.error("Cannot start server: Configuration not loaded")
         exit(1)
 
-    # Run Flask with gunicorn in production
-    # For development, use: app.run(host='0.0.0.0', port=8080, debug=False)
-    app.run(host='0.0.0.0', port=8080, debug=False, threaded=False)
+    # Threaded so /health and /status answer while jobs run in the queue.
+    # Keep a single process (e.g. gunicorn --workers 1 --threads 8
+    # 'app:create_app()'): each process would otherwise drain the job
+    # journal on its own.
+    create_app().run(host='0.0.0.0', port=8080, debug=False, threaded=True)
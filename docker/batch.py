@@ -0,0 +1,199 @@
+"""
+UGC Face Swapper - Batch Processing
+One avatar against many source videos: the avatar is downloaded once, the
+next video downloads while the current one generates, and finished videos
+upload while later items run. Each item is a FULL_VIDEO job run step by
+step (metrics, result-index reuse, cleanup as for single jobs). One
+aggregate webhook at the end.
+"""
+
+import os
+import logging
+import tempfile
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from downloader import download_inputs
+from metrics import file_bytes, job_scope, stage
+from engine import (
+    FULL_VIDEO, new_job, release_result, cleanup_job, send_webhook, cleanup_temp_files
+)
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_WORKERS = 2
+
+# FULL_VIDEO steps an item runs on the GPU loop / on the upload pool
+# (downloads are batch-specific, the per-item webhook is replaced by the
+# aggregate one)
+GENERATE_STEPS = ('dedupe', 'prepare', 'generate', 'encode')
+UPLOAD_STEPS = ('upload',)
+
+
+def normalize_items(batch_id, videos):
+    """Accept strings or dicts (either URL naming convention); fill in record ids"""
+    items = []
+    for index, video in enumerate(videos):
+        if isinstance(video, str):
+            video = {'source_video_url': video}
+        items.append({
+            'record_id': video.get('record_id') or f"{batch_id}_{index}",
+            'video_url': video.get('source_video_url') or video.get('video_url')
+        })
+    return items
+
+
+def batch_webhook_payload(batch_id, results):
+    """Aggregate payload; per-item fields match the single-job webhook"""
+    succeeded = sum(1 for r in results if r['status'] == 'success')
+    if succeeded == len(results):
+        status = 'Complete'
+    elif succeeded:
+        status = 'Partial'
+    else:
+        status = '🚩 Failed'
+
+    return {
+        'status': status,
+        'batch_id': batch_id,
+        'total': len(results),
+        'succeeded': succeeded,
+        'failed': len(results) - succeeded,
+        'items': [
+            {
+                'status': 'Complete' if r['status'] == 'success' else '🚩 Failed',
+                'record_id': r['record_id'],
+                'output_url': r.get('output_url', ''),
+                'error_message': r.get('error', '')
+            }
+            for r in results
+        ]
+    }
+
+
+def process_batch(batch_id, avatar_url, videos, config=None, webhook_url=None):
+    """
+    Face-swap one avatar onto every video in `videos`
+
+    Generation stays sequential (one GPU); downloads run one item ahead and
+    uploads run in the background. A failing item doesn't stop the batch.
+
+    Returns:
+        {
+            'status': 'success' | 'partial' | 'failed',
+            'batch_id': ...,
+            'succeeded': n, 'failed': n,
+            'results': [{'record_id', 'status', 'output_url' | 'error'}, ...]
+        }
+    """
+    items = normalize_items(batch_id, videos)
+    results = [{'record_id': item['record_id'], 'status': 'failed', 'error': 'Not processed'} for item in items]
+    temp_dir = tempfile.mkdtemp(prefix=f'faceswap_batch_{batch_id}_')
+    avatar_path = os.path.join(temp_dir, 'avatar.png')
+
+    logger.info(f"=" * 60)
+    logger.info(f"Starting batch {batch_id}: {len(items)} videos")
+    logger.info(f"Avatar URL: {avatar_url}")
+    logger.info(f"=" * 60)
+
+    def fetch_video(index):
+        """Item job with its own temp dir (the avatar is shared) and its video downloaded"""
+        item = items[index]
+        job = new_job(FULL_VIDEO.name, item['record_id'], item['video_url'], avatar_url, config)
+        job['temp_dir'] = tempfile.mkdtemp(prefix=f"item_{index}_", dir=temp_dir)
+        job['process_dir'] = os.path.join(job['temp_dir'], 'wan_process')
+        os.makedirs(job['process_dir'])
+        job['video_path'] = os.path.join(job['temp_dir'], 'input_video.mp4')
+        job['avatar_path'] = avatar_path
+        try:
+            if not item['video_url']:
+                raise Exception("Missing video URL")
+            with job_scope(job['metrics']), stage('download') as timing:
+                download_inputs([(item['video_url'], job['video_path'])], config)
+                timing['bytes'] = file_bytes(job['video_path'])
+        except Exception:
+            cleanup_job(job)
+            raise
+        return job
+
+    def fail_item(job, error):
+        release_result(job, False)
+        return {'record_id': job['job_id'], 'status': 'failed', 'error': str(error), 'metrics': job['metrics']}
+
+    def upload_result(job):
+        try:
+            FULL_VIDEO.run(job, only=UPLOAD_STEPS)
+            release_result(job, True)
+            logger.info(f"Batch {batch_id}: {job['job_id']} uploaded to {job['output_url']}")
+            return {'record_id': job['job_id'], 'status': 'success', 'output_url': job['output_url'],
+                    'metrics': job['metrics']}
+        except Exception as e:
+            return fail_item(job, e)
+        finally:
+            # Keep disk bounded however long the batch is
+            cleanup_job(job)
+
+    try:
+        # Avatar once for the whole batch
+        try:
+            download_inputs([(avatar_url, avatar_path)], config)
+        except Exception as e:
+            for result in results:
+                result['error'] = f"Failed to download avatar: {e}"
+            raise
+
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='batch-download') as downloads, \
+                ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix='batch-upload') as uploads:
+            uploading = []
+            next_video = downloads.submit(fetch_video, 0) if items else None
+
+            for index, item in enumerate(items):
+                current = next_video
+                # Prefetch the next video while this one is on the GPU
+                next_video = downloads.submit(fetch_video, index + 1) if index + 1 < len(items) else None
+
+                job = None
+                try:
+                    job = current.result()
+                    logger.info(f"Batch {batch_id}: item {index + 1}/{len(items)} ({item['record_id']})")
+                    # Reuses an identical earlier output when indexed, else runs the model
+                    FULL_VIDEO.run(job, only=GENERATE_STEPS)
+                except Exception as e:
+                    logger.error(f"Batch {batch_id}: {item['record_id']} failed: {e}")
+                    if job is None:
+                        results[index] = {'record_id': item['record_id'], 'status': 'failed', 'error': str(e)}
+                    else:
+                        results[index] = fail_item(job, e)
+                        cleanup_job(job)
+                    continue
+                uploading.append((index, uploads.submit(upload_result, job)))
+
+            for index, future in uploading:
+                results[index] = future.result()
+
+    except Exception as e:
+        logger.error(f"Batch {batch_id} aborted: {e}\n{traceback.format_exc()}")
+
+    finally:
+        cleanup_temp_files(temp_dir)
+
+    payload = batch_webhook_payload(batch_id, results)
+    if webhook_url:
+        send_webhook(webhook_url, payload)
+
+    logger.info(f"Batch {batch_id} finished: {payload['succeeded']}/{payload['total']} succeeded")
+
+    if payload['succeeded'] == payload['total']:
+        status = 'success'
+    elif payload['succeeded']:
+        status = 'partial'
+    else:
+        status = 'failed'
+
+    return {
+        'status': status,
+        'batch_id': batch_id,
+        'succeeded': payload['succeeded'],
+        'failed': payload['failed'],
+        'results': results
+    }
@@ -0,0 +1,81 @@
+"""
+UGC Face Swapper - Face Detection Microbenchmark
+Compares the old per-call path (new CascadeClassifier, one frame at a time)
+against the shared FaceDetector on frame batches. Both paths get the same
+already-decoded frames, so image decode is not part of either timing.
+
+    python bench_face_detect.py [--image face.jpg] [--frames 64] [--workers 4]
+
+Without --image a synthetic frame is used (no faces, so it measures the
+full cascade scan).
+"""
+
+import os
+import time
+import argparse
+
+import cv2
+import numpy as np
+
+from face_detector import FaceDetector
+
+
+def legacy_detect(img):
+    """The pre-service utils.detect_face_in_image body, minus the cv2.imread"""
+    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(100, 100))
+    return len(faces) > 0
+
+
+def make_frames(args):
+    if args.image:
+        frame = cv2.imread(args.image)
+        if frame is None:
+            raise SystemExit(f"Cannot read {args.image}")
+    else:
+        width, height = (int(v) for v in args.size.split('x'))
+        rng = np.random.default_rng(0)
+        frame = cv2.GaussianBlur(rng.integers(0, 255, (height, width, 3), dtype=np.uint8), (9, 9), 0)
+    return np.stack([frame] * args.frames)
+
+
+def timed(label, count, fn):
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<32} {elapsed * 1000:8.1f} ms  {count / elapsed:8.1f} frames/s")
+    return elapsed, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--image', help='frame to detect on (default: synthetic)')
+    parser.add_argument('--size', default='1280x720', help='synthetic frame size')
+    parser.add_argument('--frames', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4)
+    args = parser.parse_args()
+
+    frames = make_frames(args)
+    print(f"{args.frames} frames of {frames.shape[2]}x{frames.shape[1]}, {args.workers} workers\n")
+
+    legacy, legacy_found = timed('per-call (old utils path)', len(frames),
+                                 lambda: [legacy_detect(frame) for frame in frames])
+
+    single = FaceDetector(workers=1)
+    single.detect_batch(frames[:1])  # build the pool thread's cascade
+    one_thread, _ = timed('FaceDetector, 1 thread', len(frames), lambda: single.detect_batch(frames))
+    single.close()
+
+    pooled = FaceDetector(workers=args.workers)
+    pooled.detect_batch(frames[:args.workers])  # build the per-thread cascades
+    many, results = timed(f'FaceDetector, {args.workers} threads', len(frames), lambda: pooled.detect_batch(frames))
+    pooled.close()
+
+    found = sum(len(boxes) > 0 for boxes, _ in results)
+    print(f"\nfaces found: old {sum(legacy_found)}/{len(frames)}, service {found}/{len(frames)}")
+    print(f"speedup vs old path: {legacy / one_thread:.2f}x (1 thread), {legacy / many:.2f}x ({args.workers} threads)")
+
+
+if __name__ == '__main__':
+    main()
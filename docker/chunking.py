@@ -0,0 +1,217 @@
+"""
+UGC Face Swapper - Chunked Long-Video Mode
+Splits a long clip into fixed-length windows that overlap by a few frames,
+runs each window through the generator as its own unit (a failed chunk is
+retried alone), then streams the results back together with a linear
+crossfade over each overlap. Only one chunk is extracted or generated at a
+time and stitching holds at most `overlap_frames` frames in memory, so
+memory use does not grow with the input length.
+"""
+
+import os
+import time
+import shutil
+import logging
+import subprocess
+
+import cv2
+
+from media_probe import probe
+from model_worker import resolve_loader
+from metrics import stage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    'enabled': False,
+    'min_duration': 20,         # only clips longer than this (seconds) are chunked
+    'chunk_seconds': 10,        # window length handed to one generate call
+    'overlap_frames': 8,        # frames shared by neighbouring windows (crossfaded)
+    'retries': 2,               # extra attempts per chunk
+    'generator': None,          # "module:callable" override, e.g. "chunking:copy_generator"
+    'crf': 18,
+    'preset': 'veryfast'
+}
+
+
+class ChunkingError(Exception):
+    pass
+
+
+def get_settings(processing_config):
+    """Merge processing.chunking over the defaults"""
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update(processing_config.get('chunking') or {})
+    return settings
+
+
+def should_chunk(video_path, settings):
+    """True when chunking is enabled and the clip is long enough to need it"""
+    return bool(settings['enabled']) and probe(video_path).duration > settings['min_duration']
+
+
+def plan_chunks(total_frames, chunk_frames, overlap):
+    """
+    [(start_frame, end_frame)] windows covering total_frames
+
+    Neighbours share `overlap` frames. A short remainder is folded into the
+    last window instead of becoming a tiny chunk of its own.
+    """
+    if chunk_frames <= 2 * overlap:
+        raise ChunkingError(f"Chunk of {chunk_frames} frames is too short for {overlap} frames of overlap")
+
+    chunks = []
+    start = 0
+    while True:
+        end = min(start + chunk_frames, total_frames)
+        if total_frames - end + overlap < chunk_frames // 2:
+            end = total_frames
+        chunks.append((start, end))
+        if end >= total_frames:
+            return chunks
+        start = end - overlap
+
+
+def copy_generator(chunk_path, output_path):
+    """Stand-in for the model: returns the chunk's frames unchanged"""
+    shutil.copyfile(chunk_path, output_path)
+    return output_path
+
+
+def _encode_args(settings):
+    return ['-c:v', 'libx264', '-preset', settings['preset'], '-crf', str(settings['crf']), '-pix_fmt', 'yuv420p']
+
+
+def extract_chunk(video_path, start, end, fps, output_path, settings):
+    """Frames [start, end) of video_path as a silent clip (decodes only from the nearest keyframe)"""
+    cmd = ['ffmpeg', '-v', 'error', '-ss', f"{start / fps:.6f}", '-i', video_path,
+           '-frames:v', str(end - start), '-an'] + _encode_args(settings) + ['-y', output_path]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise ChunkingError(f"Extracting frames {start}-{end} failed: {result.stderr[-2000:]}")
+    return output_path
+
+
+def _generate_chunk(generator, chunk_path, output_path, retries):
+    """Run one chunk through the generator, retrying it alone on failure"""
+    for attempt in range(retries + 1):
+        try:
+            result = generator(chunk_path, output_path) or output_path
+            if not os.path.exists(result) or os.path.getsize(result) == 0:
+                raise ChunkingError(f"Generator produced no output for {chunk_path}")
+            return result, attempt
+        except Exception as e:
+            if attempt == retries:
+                raise ChunkingError(f"Chunk {os.path.basename(chunk_path)} failed after {attempt + 1} attempts: {e}")
+            logger.warning(f"Chunk {os.path.basename(chunk_path)} attempt {attempt + 1} failed, retrying: {e}")
+
+
+def _frames(path, count, size):
+    """
+    Exactly `count` BGR frames of `size` from path
+
+    Models sometimes drop or add a frame or two; short clips repeat their
+    last frame, long ones are cut.
+    """
+    cap = cv2.VideoCapture(str(path))
+    if not cap.isOpened():
+        raise ChunkingError(f"Cannot open generated chunk {path}")
+    last = None
+    try:
+        for _ in range(count):
+            ok, frame = cap.read()
+            if ok:
+                if (frame.shape[1], frame.shape[0]) != size:
+                    frame = cv2.resize(frame, size, interpolation=cv2.INTER_LANCZOS4)
+                last = frame
+            elif last is None:
+                raise ChunkingError(f"Generated chunk {path} has no frames")
+            yield last
+    finally:
+        cap.release()
+
+
+def stitch(outputs, chunks, source, output_path, settings):
+    """
+    Stream the generated chunks into output_path with the source's audio
+
+    The frames two windows share are blended linearly from the earlier
+    chunk into the later one; only those frames are ever held in memory.
+    """
+    size = source.display_size
+    cmd = ['ffmpeg', '-v', 'error',
+           '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{size[0]}x{size[1]}', '-r', f'{source.fps:.6f}', '-i', '-']
+    if source.has_audio:
+        cmd += ['-i', source.path, '-map', '0:v', '-map', '1:a:0', '-c:a', 'copy']
+    cmd += _encode_args(settings) + ['-t', f'{source.duration:.6f}', '-y', output_path]
+
+    writer = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        pending = []
+        for index, (path, (start, end)) in enumerate(zip(outputs, chunks)):
+            count = end - start
+            tail_len = end - chunks[index + 1][0] if index + 1 < len(chunks) else 0
+            tail = []
+            for offset, frame in enumerate(_frames(path, count, size)):
+                if offset < len(pending):
+                    weight = (offset + 1) / (len(pending) + 1)
+                    frame = cv2.addWeighted(pending[offset], 1 - weight, frame, weight, 0)
+                if offset >= count - tail_len:
+                    tail.append(frame)
+                else:
+                    writer.stdin.write(frame.tobytes())
+            pending = tail
+        writer.stdin.close()
+    except BrokenPipeError:
+        pass
+    finally:
+        stderr = writer.stderr.read().decode(errors='replace')
+        writer.wait()
+    if writer.returncode != 0:
+        raise ChunkingError(f"Stitching failed: {stderr[-2000:]}")
+    return output_path
+
+
+def run_chunked(video_path, output_path, generator, work_dir, settings):
+    """
+    Generate video_path chunk by chunk into output_path
+
+    generator(chunk_path, output_path) -> path of the generated clip (same
+    frames, any size); settings['generator'] overrides it. Chunk inputs are
+    deleted as soon as they've been generated. Returns a report dict.
+    """
+    started = time.time()
+    if settings.get('generator'):
+        generator = resolve_loader(settings['generator'])
+
+    source = probe(video_path)
+    total_frames = source.frame_count or int(round(source.duration * source.fps))
+    chunk_frames = int(round(settings['chunk_seconds'] * source.fps))
+    chunks = plan_chunks(total_frames, chunk_frames, int(settings['overlap_frames']))
+    logger.info(
+        f"Chunked mode: {total_frames} frames in {len(chunks)} chunks of ~{chunk_frames} "
+        f"with {settings['overlap_frames']} frames overlap"
+    )
+
+    os.makedirs(work_dir, exist_ok=True)
+    outputs, retried = [], 0
+    for index, (start, end) in enumerate(chunks):
+        chunk_path = os.path.join(work_dir, f'chunk_{index:04d}.mp4')
+        result_path = os.path.join(work_dir, f'chunk_{index:04d}_out.mp4')
+        extract_chunk(video_path, start, end, source.fps, chunk_path, settings)
+        result, attempts = _generate_chunk(generator, chunk_path, result_path, int(settings['retries']))
+        os.remove(chunk_path)
+        outputs.append(result)
+        retried += attempts
+        logger.info(f"Chunk {index + 1}/{len(chunks)} (frames {start}-{end}) done")
+
+    with stage('stitch'):
+        stitch(outputs, chunks, source, output_path, settings)
+    report = {
+        'chunks': len(chunks),
+        'retries': retried,
+        'overlap_frames': int(settings['overlap_frames']),
+        'seconds': round(time.time() - started, 2)
+    }
+    logger.info(f"Chunked generation complete: {report}")
+    return report
@@ -0,0 +1,135 @@
+"""
+UGC Face Swapper - Disk Cache
+Directory-per-entry cache with LRU eviction by total size. Safe to share
+between processes and workers on the same (network) volume: entries are
+published with an atomic rename and recency is the entry's mtime.
+"""
+
+import os
+import shutil
+import logging
+import threading
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+
+def _dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class DiskCache:
+    """
+    key -> directory of files, evicting least-recently-used entries once
+    the cache grows past max_bytes
+    """
+
+    def __init__(self, root, max_bytes, name='cache'):
+        self.root = root
+        self.max_bytes = int(max_bytes)
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _entry(self, key):
+        return os.path.join(self.root, key)
+
+    def get(self, key):
+        """Return the entry directory for key (marking it recently used), or None"""
+        path = self._entry(key)
+        if os.path.isdir(path):
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            with self._lock:
+                self.hits += 1
+            return path
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, files, link=False):
+        """
+        Store {name: source_path} under key and return the entry directory
+
+        Files are copied, or hardlinked when link=True and source and cache
+        share a filesystem. If another worker published the key first, its
+        entry wins.
+        """
+        path = self._entry(key)
+        if os.path.isdir(path):
+            return path
+
+        staging = tempfile.mkdtemp(prefix=f'.{key}.', dir=self.root)
+        try:
+            for name, source in files.items():
+                target = os.path.join(staging, name)
+                if link:
+                    try:
+                        os.link(source, target)
+                        continue
+                    except OSError:
+                        pass
+                shutil.copy2(source, target)
+            os.rename(staging, path)
+        except OSError:
+            # Lost the publish race (or the copy failed) - keep whatever is there
+            shutil.rmtree(staging, ignore_errors=True)
+            if not os.path.isdir(path):
+                raise
+        self.evict()
+        return path
+
+    def remove(self, key):
+        """Drop an entry (e.g. once it is known to be stale)"""
+        shutil.rmtree(self._entry(key), ignore_errors=True)
+
+    def entries(self):
+        """[(mtime, size, path)] for every published entry"""
+        result = []
+        for name in os.listdir(self.root):
+            if name.startswith('.'):
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                result.append((os.path.getmtime(path), _dir_size(path), path))
+            except OSError:
+                pass
+        return result
+
+    def evict(self):
+        """Remove least-recently-used entries until the cache fits in max_bytes"""
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            with self._lock:
+                self.evictions += 1
+            logger.info(f"{self.name}: evicted {os.path.basename(path)} ({size} bytes)")
+
+    def stats(self):
+        entries = self.entries()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': len(entries),
+            'bytes': sum(size for _, size, _ in entries),
+            'max_bytes': self.max_bytes
+        }
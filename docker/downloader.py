@@ -0,0 +1,509 @@
+"""
+UGC Face Swapper - Shared Downloader
+Streams inputs straight to disk: concurrent HTTP Range requests into a
+preallocated file for large videos, single stream otherwise, resuming from
+the last written byte after transient errors. S3 URLs in our own bucket
+(s3://, virtual-hosted or path-style) are read with the shared boto3 client
+through parallel ranged GetObject calls instead of public HTTPS.
+"""
+
+import os
+import re
+import time
+import logging
+import threading
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit, unquote, parse_qsl
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from botocore.exceptions import BotoCoreError, ClientError
+
+from storage import get_s3_client
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    'timeout': 30,                      # seconds, per connect/read
+    'retries': 5,                       # per stream/part, resumes where it stopped
+    'backoff': 1.0,                     # seconds, doubled per retry
+    'chunk_size': 1024 * 1024,          # bytes read per iteration
+    'connections': 8,                   # concurrent Range requests per file
+    'part_size': 8 * 1024 * 1024,       # bytes per Range request
+    'range_threshold': 16 * 1024 * 1024, # files smaller than this use one stream
+    's3_direct': True,                  # GetObject for S3 URLs in our buckets
+    's3_buckets': [],                   # buckets read directly besides storage.s3_bucket
+    'presign_expiry': 3600              # seconds, for s3:// URLs fetched over HTTPS
+}
+
+# Presigned / temporary-credential URLs already carry their own auth
+SIGNED_QUERY_PARAMS = ('x-amz-signature', 'signature', 'x-amz-credential')
+
+# 4xx responses worth retrying; any other client error (403/404 from an
+# expired presigned URL, ...) fails the download straight away
+RETRY_STATUSES = (408, 425, 429)
+
+# S3 error codes worth retrying whatever their status; other S3 client
+# errors (AccessDenied, NoSuchKey, PreconditionFailed, ...) fail straight away
+S3_RETRY_CODES = ('InternalError', 'ServiceUnavailable', 'SlowDown', 'Throttling', 'ThrottlingException',
+                  'RequestTimeout', 'RequestLimitExceeded')
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+class DownloadError(Exception):
+    pass
+
+
+def get_settings(config=None):
+    """Merge the optional `download` config section over the defaults"""
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update((config or {}).get('download') or {})
+    return settings
+
+
+def get_session(settings=None):
+    """
+    Return the process-wide pooled session for settings['connections']
+
+    Shared by every download and thread so keep-alive connections are
+    actually reused: urllib3's pool is thread-safe, and cookies are refused
+    so no per-response state lands on the shared session.
+    """
+    size = int((settings or DEFAULT_SETTINGS)['connections'])
+    with _sessions_lock:
+        session = _sessions.get(size)
+        if session is None:
+            session = requests.Session()
+            session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[size] = session
+    return session
+
+
+def probe_url(url, settings):
+    """
+    Return (size, accepts_ranges) for url
+
+    Uses a 1-byte ranged GET rather than HEAD: presigned URLs are signed per
+    method, so HEAD is often rejected where GET works.
+    """
+    response = get_session(settings).get(url, headers={'Range': 'bytes=0-0'}, stream=True,
+                                         timeout=settings['timeout'])
+    try:
+        response.raise_for_status()
+        if response.status_code == 206:
+            response.content  # the 1 byte, so the connection goes back to the pool
+            total = response.headers.get('Content-Range', '').rsplit('/', 1)[-1]
+            if total.isdigit():
+                return int(total), True
+            return None, False
+        length = response.headers.get('Content-Length', '')
+        return (int(length) if length.isdigit() else None), False
+    finally:
+        response.close()
+
+
+def _retry_delay(settings, attempt):
+    return settings['backoff'] * (2 ** (attempt - 1))
+
+
+def _permanent(error):
+    """True for client errors that no retry will fix"""
+    response = getattr(error, 'response', None)
+    status = getattr(response, 'status_code', None)
+    return status is not None and 400 <= status < 500 and status not in RETRY_STATUSES
+
+
+def _s3_retryable(error):
+    """True for S3 errors a retry can fix: 5xx, throttling and timeouts"""
+    status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode') or 0
+    code = error.response.get('Error', {}).get('Code')
+    return status >= 500 or status in RETRY_STATUSES or code in S3_RETRY_CODES
+
+
+def _fetch_range(url, fd, start, end, settings):
+    """Fetch bytes [start, end] into fd at the same offsets, resuming on error"""
+    offset = start
+    attempt = 0
+
+    while offset <= end:
+        try:
+            response = get_session(settings).get(
+                url,
+                headers={'Range': f'bytes={offset}-{end}'},
+                stream=True,
+                timeout=settings['timeout']
+            )
+            with response:
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise DownloadError(f"Range request returned HTTP {response.status_code}")
+                for chunk in response.iter_content(chunk_size=settings['chunk_size']):
+                    os.pwrite(fd, chunk, offset)
+                    offset += len(chunk)
+            if offset <= end:
+                raise DownloadError(f"Connection closed at byte {offset} of part ending {end}")
+
+        except (requests.RequestException, DownloadError) as e:
+            if _permanent(e):
+                raise DownloadError(f"Part {start}-{end} failed: {e}")
+            attempt += 1
+            if attempt > settings['retries']:
+                raise DownloadError(f"Part {start}-{end} failed after {settings['retries']} retries: {e}")
+            delay = _retry_delay(settings, attempt)
+            logger.warning(f"Part {start}-{end} interrupted at {offset} ({e}), resuming in {delay:.1f}s")
+            time.sleep(delay)
+
+    return end - start + 1
+
+
+def _download_ranged(source, output_path, size, settings, fetch_range=_fetch_range):
+    """
+    Split into part_size Range requests spread over `connections` threads
+
+    fetch_range(source, fd, start, end, settings) fetches one part; source
+    is the URL for HTTP and an S3Source for GetObject.
+    """
+    parts = [
+        (start, min(start + settings['part_size'], size) - 1)
+        for start in range(0, size, settings['part_size'])
+    ]
+
+    fd = os.open(output_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        # Preallocate so parts can land out of order without sparse growth
+        if hasattr(os, 'posix_fallocate'):
+            os.posix_fallocate(fd, 0, size)
+        else:
+            os.ftruncate(fd, size)
+
+        workers = min(settings['connections'], len(parts))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='download') as pool:
+            futures = [pool.submit(fetch_range, source, fd, start, end, settings) for start, end in parts]
+            written = sum(future.result() for future in futures)
+    finally:
+        os.close(fd)
+
+    return written, workers
+
+
+def _download_stream(url, output_path, size, accepts_ranges, settings, response=None):
+    """
+    Single stream; resumes with a Range request if the server allows it
+
+    response is an already-open 200 for url whose body is read first
+    instead of issuing a new GET.
+    """
+    written = 0
+    attempt = 0
+
+    with open(output_path, 'wb') as f:
+        while True:
+            headers = {'Range': f'bytes={written}-'} if written and accepts_ranges else {}
+            try:
+                if response is None:
+                    response = get_session(settings).get(url, headers=headers, stream=True,
+                                                          timeout=settings['timeout'])
+                with response:
+                    response.raise_for_status()
+                    if written and response.status_code != 206:
+                        # Server restarted from zero - discard what we had
+                        f.seek(0)
+                        f.truncate()
+                        written = 0
+                    for chunk in response.iter_content(chunk_size=settings['chunk_size']):
+                        f.write(chunk)
+                        written += len(chunk)
+                if size is not None and written < size:
+                    raise DownloadError(f"Connection closed at byte {written} of {size}")
+                return written
+
+            except (requests.RequestException, DownloadError) as e:
+                response = None
+                if _permanent(e):
+                    raise DownloadError(f"Download failed: {e}")
+                attempt += 1
+                if attempt > settings['retries']:
+                    raise DownloadError(f"Download failed after {settings['retries']} retries: {e}")
+                if not accepts_ranges:
+                    f.seek(0)
+                    f.truncate()
+                    written = 0
+                delay = _retry_delay(settings, attempt)
+                logger.warning(f"Download interrupted at byte {written} ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+
+# ============================================
+# S3 SOURCES
+# ============================================
+
+S3_HOST = re.compile(r'^(?:(?P<bucket>.+?)\.)?s3(?:[.-][a-z0-9-]+)*\.amazonaws\.com(?:\.cn)?$')
+
+
+def parse_s3_url(url, endpoint_url=None):
+    """
+    GetObject params ({'Bucket', 'Key'[, 'VersionId']}) for an S3 URL, else None
+
+    Understands s3://bucket/key, virtual-hosted
+    https://bucket.s3.<region>.amazonaws.com/key, path-style
+    https://s3.<region>.amazonaws.com/bucket/key and, with endpoint_url,
+    <endpoint_url>/bucket/key (moto, MinIO). Any signature in the query is
+    ignored - direct reads sign with our own credentials.
+    """
+    parts = urlsplit(url)
+    if parts.scheme == 's3':
+        bucket, key = parts.netloc, parts.path.lstrip('/')
+    elif parts.scheme in ('http', 'https'):
+        endpoint = (endpoint_url or '').rstrip('/')
+        match = S3_HOST.match(parts.hostname or '')
+        if endpoint and url.startswith(endpoint + '/'):
+            bucket, _, key = unquote(urlsplit(url[len(endpoint):]).path).lstrip('/').partition('/')
+        elif match and match.group('bucket'):
+            bucket, key = match.group('bucket'), unquote(parts.path).lstrip('/')
+        elif match:
+            bucket, _, key = unquote(parts.path).lstrip('/').partition('/')
+        else:
+            return None
+    else:
+        return None
+
+    if not bucket or not key:
+        return None
+    params = {'Bucket': bucket, 'Key': key}
+    version = dict(parse_qsl(parts.query)).get('versionId')
+    if version:
+        params['VersionId'] = version
+    return params
+
+
+def _s3_location(url, config):
+    """(params, direct) - params from parse_s3_url, direct if we GetObject it ourselves"""
+    settings = get_settings(config)
+    s3_config = (config or {}).get('storage') or {}
+    params = parse_s3_url(url, s3_config.get('s3_endpoint_url'))
+    if params is None:
+        return None, False
+    buckets = set(settings['s3_buckets'] or ()) | {s3_config.get('s3_bucket')}
+    return params, bool(settings['s3_direct']) and params['Bucket'] in buckets
+
+
+def direct_s3_params(url, config=None):
+    """GetObject params when url is read straight from S3 (our buckets), else None"""
+    params, direct = _s3_location(url, config)
+    return params if direct else None
+
+
+def http_url(url, config=None):
+    """
+    URL to fetch over HTTP(S): s3:// URLs become presigned GET URLs (signed
+    with the storage credentials), anything else is returned as is
+    """
+    if urlsplit(url).scheme != 's3':
+        return url
+    params = parse_s3_url(url)
+    if params is None:
+        raise DownloadError(f"Malformed S3 URL: {url}")
+    s3_config = (config or {}).get('storage') or {}
+    return get_s3_client(s3_config).generate_presigned_url(
+        'get_object', Params=params, ExpiresIn=int(get_settings(config)['presign_expiry'])
+    )
+
+
+def _fetch_s3_range(source, fd, start, end, settings):
+    """
+    GetObject bytes [start, end] into fd, resuming on error
+
+    IfMatch pins every part to the ETag seen up front, so an object
+    overwritten mid-download fails instead of yielding a mixed file.
+    5xx/throttling errors are retried; other ClientErrors are raised as is.
+    """
+    client, params, etag = source
+    offset = start
+    attempt = 0
+
+    while offset <= end:
+        try:
+            response = client.get_object(Range=f'bytes={offset}-{end}', IfMatch=etag, **params)
+            body = response['Body']
+            try:
+                for chunk in body.iter_chunks(chunk_size=settings['chunk_size']):
+                    os.pwrite(fd, chunk, offset)
+                    offset += len(chunk)
+            finally:
+                body.close()
+            if offset <= end:
+                raise DownloadError(f"Stream closed at byte {offset} of part ending {end}")
+
+        except (BotoCoreError, ClientError, DownloadError) as e:
+            if isinstance(e, ClientError) and not _s3_retryable(e):
+                raise
+            attempt += 1
+            if attempt > settings['retries']:
+                raise DownloadError(f"Part {start}-{end} failed after {settings['retries']} retries: {e}")
+            delay = _retry_delay(settings, attempt)
+            logger.warning(f"Part {start}-{end} interrupted at {offset} ({e}), resuming in {delay:.1f}s")
+            time.sleep(delay)
+
+    return end - start + 1
+
+
+def _download_s3(params, output_path, settings, s3_config):
+    """Ranged GetObject download with the shared client; returns (written, connections, mode)"""
+    client = get_s3_client(s3_config)
+    head = client.head_object(**params)
+    size = head['ContentLength']
+
+    if size == 0:
+        open(output_path, 'wb').close()
+        return 0, 1, 's3-stream'
+
+    source = (client, params, head['ETag'])
+    if size >= settings['range_threshold']:
+        written, connections = _download_ranged(source, output_path, size, settings, _fetch_s3_range)
+        return written, connections, 's3-ranged'
+    written, connections = _download_ranged(
+        source, output_path, size, dict(settings, part_size=size), _fetch_s3_range
+    )
+    return written, connections, 's3-stream'
+
+
+# ============================================
+# FETCH
+# ============================================
+
+def fetch(url, output_path, config=None):
+    """
+    Download url to output_path
+
+    S3 URLs in our buckets go through GetObject (falling back to HTTPS if
+    that is refused), other s3:// URLs through a presigned URL, the rest
+    over HTTP(S).
+
+    Returns stats dict (bytes, seconds, mbps, mode, connections).
+    Raises DownloadError on failure.
+    """
+    settings = get_settings(config)
+    start = time.time()
+    written = None
+
+    params = direct_s3_params(url, config)
+    if params is not None:
+        try:
+            written, connections, mode = _download_s3(
+                params, output_path, settings, (config or {}).get('storage') or {}
+            )
+        except (BotoCoreError, ClientError) as e:
+            if urlsplit(url).scheme == 's3':
+                raise DownloadError(f"Could not read s3://{params['Bucket']}/{params['Key']}: {e}")
+            logger.warning(f"Direct S3 read of {url} failed ({e}), falling back to HTTPS")
+
+    if written is None:
+        try:
+            source_url = http_url(url, config)
+        except (BotoCoreError, ClientError) as e:
+            raise DownloadError(f"Could not presign {url}: {e}")
+
+        try:
+            size, accepts_ranges = probe_url(source_url, settings)
+        except requests.RequestException as e:
+            raise DownloadError(f"Could not reach {url}: {e}")
+
+        if accepts_ranges and size and size >= settings['range_threshold']:
+            written, connections = _download_ranged(source_url, output_path, size, settings)
+            mode = 'ranged'
+        else:
+            written = _download_stream(source_url, output_path, size, accepts_ranges, settings)
+            connections = 1
+            mode = 'stream'
+
+    return _finish(url, output_path, written, mode, connections, start)
+
+
+def fetch_response(url, response, output_path, config=None):
+    """
+    fetch() for a GET of url already answered with 200 (body unread)
+
+    Streams that body rather than asking again; a file large enough for
+    Range requests is handed to the parallel ranged download instead, with
+    the size taken from this response (no probe). Takes ownership of
+    response. Same stats/errors as fetch.
+    """
+    settings = get_settings(config)
+    start = time.time()
+    source_url = response.url or url
+
+    length = response.headers.get('Content-Length', '')
+    size = int(length) if length.isdigit() else None
+    accepts_ranges = response.headers.get('Accept-Ranges', '').lower() == 'bytes'
+
+    if accepts_ranges and size and size >= settings['range_threshold']:
+        response.close()
+        written, connections = _download_ranged(source_url, output_path, size, settings)
+        mode = 'ranged'
+    else:
+        written = _download_stream(source_url, output_path, size, accepts_ranges, settings, response=response)
+        connections = 1
+        mode = 'stream'
+
+    return _finish(url, output_path, written, mode, connections, start)
+
+
+def _finish(url, output_path, written, mode, connections, start):
+    """Stats dict + throughput log line for a finished download"""
+    elapsed = max(time.time() - start, 1e-6)
+    stats = {
+        'url': url,
+        'path': output_path,
+        'bytes': written,
+        'seconds': round(elapsed, 3),
+        'mbps': round(written * 8 / elapsed / 1e6, 2),
+        'mode': mode,
+        'connections': connections
+    }
+    logger.info(
+        f"Downloaded {written} bytes to {output_path} in {elapsed:.2f}s "
+        f"({stats['mbps']} Mbit/s, {mode}, {connections} connection(s))"
+    )
+    return stats
+
+
+def download_file(url, output_path, config=None):
+    """Download file from URL to local path, returns True on success"""
+    try:
+        logger.info(f"Downloading from {url}")
+        fetch(url, output_path, config)
+        return True
+    except Exception as e:
+        logger.error(f"Download failed: {e}")
+        return False
+
+
+def download_inputs(downloads, config=None):
+    """
+    Download several (url, output_path) pairs in parallel
+
+    Goes through the input cache when one is configured. Returns
+    {output_path: stats}. Raises DownloadError naming the first input that
+    failed.
+    """
+    from input_cache import get_input_cache  # input_cache builds on this module
+
+    cache = get_input_cache()
+    fetcher = cache.fetch if cache is not None else fetch
+
+    with ThreadPoolExecutor(max_workers=len(downloads), thread_name_prefix='inputs') as pool:
+        futures = [(url, path, pool.submit(fetcher, url, path, config)) for url, path in downloads]
+
+        stats = {}
+        for url, path, future in futures:
+            try:
+                stats[path] = future.result()
+            except Exception as e:
+                raise DownloadError(f"Failed to download {os.path.basename(path)}: {e}")
+    return stats
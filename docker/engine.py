@@ -0,0 +1,873 @@
+"""
+UGC Face Swapper - Pipeline Engine
+One engine behind both processing modes. A job is a context dict handed
+through a stage graph - a list of steps, each fn(job) -> job. "Full video"
+(one Wan2.2 pass, or overlapping chunks for long clips) and "segmented"
+(timeline windows swapped in parallel and stitched back) are two graphs
+built from the same steps, so download, model invocation, upload, webhooks
+and cleanup exist once. A graph runs inline for a single job, or as a
+pipeline.StagePipeline so jobs overlap across stages.
+"""
+
+import os
+import queue
+import shutil
+import logging
+import tempfile
+import threading
+import functools
+import traceback
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import webhooks
+import chunking
+import face_scan
+import normalize
+from model_server import get_model_server
+from downloader import download_inputs
+from storage import upload_to_s3, upload_growing_file, copy_object, object_info, object_key
+from segmenter import cut_segments
+from stitcher import stitch
+from pipeline import Stage, StagePipeline
+from subprocess_runner import run_streaming
+from job_queue import update_progress
+from metrics import file_bytes, job_scope, stage
+from result_index import get_result_index, result_key
+from media_probe import probe
+from timeline import SWAP, job_timeline, swap_seconds
+
+logger = logging.getLogger(__name__)
+
+# Wan2.2 preprocess_data.py settings
+PREPROCESS_PARAMS = {
+    'resolution_area': (1280, 720),
+    'iterations': 3,
+    'k': 7,
+    'w_len': 1,
+    'h_len': 1
+}
+
+# Where the Wan2.2 checkout is looked for without processing.wan_path / WAN_PATH
+WAN_LOCATIONS = ['/app/Wan2.2', '/workspace/Wan2.2', '/opt/Wan2.2']
+
+DEFAULT_MODEL_PATH = '/runpod-volume/models/Wan2.2-Animate-14B'
+
+
+# ============================================
+# SHARED HELPERS
+# ============================================
+
+def send_webhook(webhook_url, payload):
+    """Send completion webhook to Make.com (outbox-backed when configured)"""
+    return webhooks.send_webhook(webhook_url, payload)
+
+
+def cleanup_temp_files(temp_dir):
+    """Delete temporary processing files"""
+    try:
+        shutil.rmtree(temp_dir)
+        logger.info(f"Cleaned up temp directory: {temp_dir}")
+    except Exception as e:
+        logger.warning(f"Cleanup failed: {e}")
+
+
+def resolve_job_config(config=None):
+    """Return (s3_config, model_path), falling back to env vars without a config"""
+    if config:
+        s3_config = config.get('storage', {})
+        model_path = config.get('processing', {}).get('model_path') or os.environ.get('MODEL_PATH', DEFAULT_MODEL_PATH)
+    else:
+        # Fallback to environment variables
+        s3_config = {
+            's3_access_key': os.environ.get('AWS_ACCESS_KEY_ID'),
+            's3_secret_key': os.environ.get('AWS_SECRET_ACCESS_KEY'),
+            's3_region': os.environ.get('AWS_REGION', 'eu-north-1'),
+            's3_bucket': os.environ.get('S3_BUCKET', 'faceswap-outputs-kasparas'),
+            's3_output_prefix': os.environ.get('S3_OUTPUT_PREFIX', 'outputs/'),
+            's3_endpoint_url': os.environ.get('S3_ENDPOINT_URL')
+        }
+        model_path = os.environ.get('MODEL_PATH', DEFAULT_MODEL_PATH)
+
+    return s3_config, model_path
+
+
+class DeviceSlots:
+    """
+    Fixed budget of GPU slots shared by concurrent face-swaps
+
+    Each slot is a CUDA_VISIBLE_DEVICES value (None = inherit the
+    container's). Listing the same device twice lets two swaps share a GPU.
+    """
+
+    def __init__(self, devices):
+        self.size = len(devices)
+        self._free = queue.Queue()
+        for device in devices:
+            self._free.put(device)
+
+    @classmethod
+    def from_config(cls, processing_config):
+        devices = processing_config.get('gpu_devices') or []
+        if devices:
+            return cls([str(d) for d in devices])
+        return cls([None] * max(1, int(processing_config.get('gpu_slots', 1))))
+
+    @contextmanager
+    def acquire(self):
+        device = self._free.get()
+        try:
+            yield device
+        finally:
+            self._free.put(device)
+
+
+_device_slots = {}
+_device_slots_lock = threading.Lock()
+
+
+def get_device_slots(processing_config):
+    """
+    Return the process-wide DeviceSlots for this gpu_devices/gpu_slots setting
+
+    Shared so concurrent jobs (queue workers, pipeline stages) draw from
+    one budget instead of each getting the full set of GPUs.
+    """
+    devices = tuple(str(d) for d in processing_config.get('gpu_devices') or ())
+    key = devices or int(processing_config.get('gpu_slots', 1))
+    with _device_slots_lock:
+        slots = _device_slots.get(key)
+        if slots is None:
+            slots = _device_slots[key] = DeviceSlots.from_config(processing_config)
+    return slots
+
+
+# ============================================
+# MODEL INVOCATION
+# ============================================
+
+def find_wan(processing_config):
+    """Wan2.2 checkout: processing.wan_path, else $WAN_PATH, else the first of WAN_LOCATIONS that exists"""
+    configured = processing_config.get('wan_path') or os.environ.get('WAN_PATH')
+    for location in ([configured] if configured else WAN_LOCATIONS):
+        if os.path.exists(location):
+            return location
+    raise Exception("Wan2.2 not found. Please ensure it's cloned in /workspace or /app (or set WAN_PATH)")
+
+
+def run_wan_subprocesses(video_path, avatar_path, process_dir, model_path, processing_config=None, device=None,
+                         params=PREPROCESS_PARAMS, keep_fps=False, progress=None):
+    """
+    Run Wan2.2 preprocess + generate as one-off subprocesses (no model server)
+
+    Output is streamed to the log (last lines kept for errors) and parsed
+    into progress(**fields). device pins both to a CUDA_VISIBLE_DEVICES
+    value; processing.preprocess_timeout / generate_timeout are soft
+    timeouts (SIGTERM, then SIGKILL after a grace period).
+    """
+    processing_config = processing_config or {}
+    python_bin = processing_config.get('wan_python', 'python3')
+    wan_path = find_wan(processing_config)
+    env = os.environ.copy()
+    if device is not None:
+        env['CUDA_VISIBLE_DEVICES'] = device
+
+    # Step 1: Preprocessing
+    logger.info(f"Running Wan2.2 preprocessing ({wan_path})...")
+    preprocess_cmd = [
+        python_bin, f'{wan_path}/wan/modules/animate/preprocess/preprocess_data.py',
+        '--ckpt_path', f'{model_path}/process_checkpoint',
+        '--video_path', video_path,
+        '--refer_path', avatar_path,
+        '--save_path', process_dir,
+        '--resolution_area', *[str(v) for v in params['resolution_area']],
+        '--iterations', str(params['iterations']),
+        '--k', str(params['k']),
+        '--w_len', str(params['w_len']),
+        '--h_len', str(params['h_len']),
+        '--replace_flag'  # CRITICAL: Enables face replacement mode
+    ]
+    if keep_fps:
+        # Input is already at the normalized fps - don't let Wan resample it
+        preprocess_cmd += ['--fps', '-1']
+
+    with stage('preprocess'):
+        run_streaming(
+            preprocess_cmd, label='preprocess', env=env,
+            soft_timeout=processing_config.get('preprocess_timeout', 300), progress=progress
+        )
+
+    # Step 2: Generation (face-swap)
+    logger.info("Running Wan2.2 generation (face-swap)...")
+    generate_cmd = [
+        python_bin, f'{wan_path}/generate.py',
+        '--task', 'animate-14B',
+        '--ckpt_dir', model_path,
+        '--src_root_path', process_dir,
+        '--refert_num', '1',
+        '--replace_flag',  # Face replacement mode
+        '--use_relighting_lora'  # Better lighting match
+    ]
+
+    with stage('generate'):
+        run_streaming(
+            generate_cmd, label='generate', env=env,
+            soft_timeout=processing_config.get('generate_timeout', 600), progress=progress
+        )
+
+
+def prepare_model_input(video_path, process_dir, processing_config=None):
+    """
+    CPU side of a pass: normalize video_path for the model when configured
+
+    Returns (model_input, plan, normalize_settings, params); plan is None
+    when the model sees video_path as is.
+    """
+    normalize_settings = normalize.get_settings(processing_config or {}, PREPROCESS_PARAMS)
+    params = normalize.preprocess_params(PREPROCESS_PARAMS, normalize_settings)
+    plan = None
+    model_input = video_path
+    if normalize_settings['enabled']:
+        with stage('normalize'):
+            plan = normalize.prepare(video_path, os.path.join(process_dir, 'normalized_input.mp4'), normalize_settings)
+        model_input = plan['input']
+    return model_input, plan, normalize_settings, params
+
+
+def find_output_video(process_dir, inputs=()):
+    """The video Wan2.2 wrote into process_dir (an 'output' mp4, else any mp4 that isn't an input)"""
+    files = sorted(file for file in os.listdir(process_dir) if file.endswith('.mp4'))
+    candidates = [file for file in files if 'output' in file.lower()] or files
+    for file in candidates:
+        path = os.path.join(process_dir, file)
+        if path not in inputs:
+            return path
+    logger.error(f"Directory contents: {os.listdir(process_dir)}")
+    raise Exception("Generated output video not found in processing directory")
+
+
+def generate_on_model(video_path, model_input, avatar_path, process_dir, model_path, params, processing_config=None,
+                      device=None, keep_fps=False, progress=None):
+    """
+    GPU side of a pass: Wan2.2 preprocess + generate over model_input
+
+    progress(**fields) receives the CLIs' parsed step/percent output.
+    Returns the path of the generated video; raises on failure.
+    """
+    server = get_model_server()
+    if server:
+        # Model already resident - no interpreter startup or checkpoint load.
+        # One GPU, so the device slot is not applied here.
+        logger.info("Running Wan2.2 preprocessing (model server)...")
+        with stage('preprocess'):
+            server.preprocess(
+                video_path=model_input,
+                refer_path=avatar_path,
+                save_path=process_dir,
+                replace_flag=True,
+                keep_fps=keep_fps,
+                **params
+            )
+        logger.info("Running Wan2.2 generation (model server)...")
+        with stage('generate'):
+            server.generate(
+                src_root_path=process_dir,
+                save_file=os.path.join(process_dir, 'output.mp4'),
+                refert_num=1,
+                replace_flag=True
+            )
+    else:
+        run_wan_subprocesses(
+            model_input, avatar_path, process_dir, model_path, processing_config, device,
+            params=params, keep_fps=keep_fps, progress=progress
+        )
+
+    logger.info("Generation completed successfully")
+
+    output_video = find_output_video(process_dir, inputs=(video_path, model_input))
+    if os.path.getsize(output_video) == 0:
+        raise Exception("Generated output video is empty (0 bytes)")
+    return output_video
+
+
+def restore_output(output_video, plan, process_dir, normalize_settings):
+    """CPU side after generation: back to the source size/fps with its audio (no-op without a plan)"""
+    if not plan:
+        return output_video
+    with stage('restore'):
+        return normalize.restore(
+            output_video, plan, os.path.join(process_dir, 'restored_output.mp4'), normalize_settings
+        )
+
+
+def swap_single_pass(video_path, avatar_path, process_dir, model_path, processing_config=None, device=None,
+                     keep_fps=False, progress=None):
+    """
+    One Wan2.2 preprocess + generate over video_path inside process_dir
+
+    keep_fps generates at the source frame rate (always the case when the
+    input was normalised). Returns the path of the generated video; raises
+    on failure.
+    """
+    model_input, plan, normalize_settings, params = prepare_model_input(video_path, process_dir, processing_config)
+    output_video = generate_on_model(
+        video_path, model_input, avatar_path, process_dir, model_path, params, processing_config,
+        device=device, keep_fps=keep_fps or plan is not None, progress=progress
+    )
+    return restore_output(output_video, plan, process_dir, normalize_settings)
+
+
+def swap_chunked(video_path, avatar_path, process_dir, model_path, processing_config, chunk_settings, device=None,
+                 progress=None):
+    """Long clip through the model in overlapping chunks (see chunking); returns the stitched video"""
+    def generate_chunk(chunk_path, chunk_output):
+        chunk_dir = os.path.splitext(chunk_output)[0] + '_wan'
+        os.makedirs(chunk_dir, exist_ok=True)
+        # Chunks must come back at the source frame rate, otherwise the
+        # overlap/crossfade frame counts no longer line up
+        generated = swap_single_pass(
+            chunk_path, avatar_path, chunk_dir, model_path, processing_config, device=device, keep_fps=True,
+            progress=functools.partial(progress, chunk=os.path.basename(chunk_path)) if progress else None
+        )
+        shutil.move(generated, chunk_output)
+        shutil.rmtree(chunk_dir, ignore_errors=True)
+        return chunk_output
+
+    output_video = os.path.join(process_dir, 'chunked_output.mp4')
+    chunking.run_chunked(video_path, output_video, generate_chunk, os.path.join(process_dir, 'chunks'), chunk_settings)
+    return output_video
+
+
+def face_swap_full_video(video_path, avatar_path, job_id, model_path, processing_config=None, process_dir=None):
+    """
+    Face-swap the ENTIRE video: one Wan2.2 pass, or overlapping chunks for
+    long clips when processing.chunking is enabled
+
+    Works in process_dir (default /tmp/wan_process_<job_id>, removed again
+    if the swap fails). Returns the path of the face-swapped video, or None
+    if it failed.
+    """
+    own_dir = process_dir is None
+    process_dir = process_dir or f"/tmp/wan_process_{job_id}"
+    try:
+        logger.info(f"Starting Wan2.2 face-swap for job {job_id}: {video_path} with {avatar_path}")
+        os.makedirs(process_dir, exist_ok=True)
+
+        processing_config = processing_config or {}
+        progress = functools.partial(update_progress, job_id)
+        chunk_settings = chunking.get_settings(processing_config)
+        if chunking.should_chunk(video_path, chunk_settings):
+            output_video = swap_chunked(
+                video_path, avatar_path, process_dir, model_path, processing_config, chunk_settings,
+                progress=progress
+            )
+        else:
+            output_video = swap_single_pass(
+                video_path, avatar_path, process_dir, model_path, processing_config, progress=progress
+            )
+
+        logger.info(f"Face-swap complete! Output: {output_video} ({os.path.getsize(output_video)} bytes)")
+        return output_video
+
+    except Exception as e:
+        logger.error(f"Face-swap failed: {e}\n{traceback.format_exc()}")
+        if own_dir:
+            shutil.rmtree(process_dir, ignore_errors=True)
+        return None
+
+
+# ============================================
+# STAGE GRAPHS
+# ============================================
+
+class Step:
+    """
+    One node of a stage graph: fn(job) -> job, plus its default pipeline
+    sizing. Only `always` steps run for a job whose output was reused.
+    """
+
+    def __init__(self, name, fn, workers=1, queue_size=2, always=False):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.queue_size = queue_size
+        self.always = always
+
+
+class StageGraph:
+    """
+    Ordered steps a job goes through
+
+    Every step runs inside the job's metrics scope, so stage() timings land
+    in job['metrics'] whichever thread runs it; once a job has reused an
+    earlier output (job['reused']) the remaining steps are skipped up to the
+    `always` ones. run() executes the steps in the calling thread;
+    build_pipeline() turns them into a StagePipeline.
+    """
+
+    def __init__(self, name, steps):
+        self.name = name
+        self.steps = list(steps)
+
+    @staticmethod
+    def _call(step, job):
+        if job.get('reused') and not step.always:
+            return job
+        with job_scope(job['metrics']):
+            return step.fn(job)
+
+    def run(self, job, only=None):
+        """Steps in order in the calling thread; only restricts them to those names"""
+        for step in self.steps:
+            if only is None or step.name in only:
+                job = self._call(step, job)
+        return job
+
+    def build_pipeline(self, overrides=None):
+        """
+        StagePipeline over these steps (not started); overrides maps a step
+        name to {'workers', 'queue_size'}
+        """
+        overrides = overrides or {}
+        stages = []
+        for step in self.steps:
+            settings = overrides.get(step.name) or {}
+            stages.append(Stage(
+                step.name, functools.partial(self._call, step),
+                workers=settings.get('workers', step.workers),
+                queue_size=settings.get('queue_size', step.queue_size)
+            ))
+        return StagePipeline(stages, name=self.name)
+
+
+def new_job(mode, job_id, video_url, avatar_url, config=None, webhook_url=None, **options):
+    """Job context for the graph named mode; options (e.g. timeline) are read by the steps"""
+    return {
+        'mode': mode,
+        'job_id': job_id,
+        'video_url': video_url,
+        'avatar_url': avatar_url,
+        'config': config or {},
+        'processing': (config or {}).get('processing') or {},
+        'webhook_url': webhook_url,
+        'options': options,
+        'metrics': {}
+    }
+
+
+def webhook_payload(job, output_url='', error_message=''):
+    return {
+        'status': '🚩 Failed' if error_message else 'Complete',
+        'record_id': job['job_id'],
+        'output_url': output_url,
+        'error_message': error_message,
+        'metrics': job['metrics']
+    }
+
+
+def release_result(job, succeeded):
+    """Record a finished output in the result index and wake jobs coalesced onto it"""
+    key = job.pop('result_key', None)
+    index = get_result_index()
+    if key is None or index is None:
+        return
+    try:
+        if succeeded:
+            s3_config, _ = resolve_job_config(job['config'])
+            key_name = object_key(job['job_id'], s3_config)
+            info = object_info(key_name, s3_config) or {}
+            index.put(key, job['job_id'], key_name, job['output_url'], info.get('etag'), info.get('size'))
+    except Exception as e:
+        logger.warning(f"Could not record result of job {job['job_id']}: {e}")
+    finally:
+        index.release(key, succeeded)
+
+
+def cleanup_job(job):
+    if job.get('temp_dir') and os.path.exists(job['temp_dir']):
+        cleanup_temp_files(job['temp_dir'])
+
+
+def fail_job(job, error):
+    """Failure webhook + cleanup; the failed result dict"""
+    error_msg = str(error)
+    logger.error(f"FAILED! Job {job['job_id']} error: {error_msg}")
+    release_result(job, False)
+    if job['webhook_url']:
+        with stage('webhook', job['metrics']):
+            send_webhook(job['webhook_url'], webhook_payload(job, error_message=error_msg))
+    cleanup_job(job)
+    return {
+        'status': 'failed',
+        'error': error_msg,
+        'metrics': job['metrics']
+    }
+
+
+def run_job(graph, job_id, video_url, avatar_url, config=None, webhook_url=None, **options):
+    """
+    One job through graph in the calling thread
+
+    Returns {'status': 'success', 'output_url', 'metrics'} or
+    {'status': 'failed', 'error', 'metrics'}; the completion webhook (if
+    any) carries the same outcome.
+    """
+    job = new_job(graph.name, job_id, video_url, avatar_url, config, webhook_url, **options)
+    logger.info(f"Starting {graph.name} job {job_id}: video {video_url}, avatar {avatar_url}")
+    try:
+        return graph.run(job)
+    except Exception as e:
+        logger.error(f"Job {job_id} failed:\n{traceback.format_exc()}")
+        return fail_job(job, e)
+
+
+def run_job_pipelined(pipeline, job_id, video_url, avatar_url, config=None, webhook_url=None, **options):
+    """run_job through a started StagePipeline; blocks until this job is done"""
+    job = new_job(pipeline.name, job_id, video_url, avatar_url, config, webhook_url, **options)
+    try:
+        return pipeline.run(job)
+    except Exception as e:
+        return fail_job(job, e)
+
+
+# ============================================
+# STEPS (shared)
+# ============================================
+
+def fetch_inputs(job):
+    """Temp dir + video and avatar downloaded in parallel"""
+    job['temp_dir'] = tempfile.mkdtemp(prefix=f"faceswap_{job['job_id']}_")
+    job['process_dir'] = os.path.join(job['temp_dir'], 'wan_process')
+    os.makedirs(job['process_dir'])
+    job['video_path'] = os.path.join(job['temp_dir'], 'input_video.mp4')
+    job['avatar_path'] = os.path.join(job['temp_dir'], 'avatar.png')
+    with stage('download') as timing:
+        download_inputs([(job['video_url'], job['video_path']), (job['avatar_url'], job['avatar_path'])],
+                        job['config'])
+        timing['bytes'] = file_bytes(job['video_path'], job['avatar_path'])
+    return job
+
+
+def _reuse(entry, job):
+    """URL of a stored output for this job: copied to its own key (cache.result_copy, default) or shared"""
+    s3_config, _ = resolve_job_config(job['config'])
+    if (job['config'].get('cache') or {}).get('result_copy', True):
+        return copy_object(entry['object_key'], job['job_id'], s3_config, entry['etag'])
+    info = object_info(entry['object_key'], s3_config)
+    if info is None or (entry['etag'] and info['etag'] != entry['etag']):
+        return None
+    return entry['url']
+
+
+def reuse_result(job):
+    """
+    Skip the model when these exact inputs + settings were already processed
+
+    With the result index configured, a stored output is reused (the rest
+    of the graph is skipped up to the webhook). Otherwise the job claims
+    its key; jobs arriving with the same key meanwhile wait here for it and
+    then reuse its output (or run themselves if it failed).
+    """
+    index = get_result_index()
+    if index is None:
+        return job
+    with stage('hash'):
+        key = result_key(
+            job['video_path'], job['avatar_path'], job['mode'], PREPROCESS_PARAMS, job['processing'],
+            {'timeline': job['options'].get('timeline')}
+        )
+
+    while True:
+        entry = index.get(key)
+        if entry:
+            output_url = _reuse(entry, job)
+            if output_url:
+                index.hit(key)
+                job['output_url'] = output_url
+                job['reused'] = True
+                job['metrics']['reused'] = {'job_id': entry['job_id'], 'object_key': entry['object_key']}
+                logger.info(f"Job {job['job_id']}: identical to job {entry['job_id']}, reusing its output")
+                return job
+            logger.info(f"Stored output of job {entry['job_id']} is gone or changed, dropping it")
+            index.forget(key)
+
+        leader, future = index.claim(key)
+        if leader:
+            if index.get(key):
+                # Another job finished this key between the lookup and the claim
+                index.release(key, True)
+                continue
+            job['result_key'] = key
+            return job
+        logger.info(f"Job {job['job_id']}: same inputs as a running job, waiting for it")
+        with stage('coalesce'):
+            future.result()
+
+
+def upload_output(job):
+    """S3 upload of job['output_path'] (skipped when a streaming upload already produced output_url)"""
+    if not job.get('output_url'):
+        s3_config, _ = resolve_job_config(job['config'])
+        with stage('upload') as timing:
+            job['output_url'] = upload_to_s3(job['output_path'], job['job_id'], s3_config, job['metrics'])
+            timing['bytes'] = file_bytes(job['output_path'])
+    if not job['output_url']:
+        raise Exception("S3 upload failed")
+    return job
+
+
+def finish_job(job):
+    """Result index entry, success webhook + cleanup; the job's result dict"""
+    release_result(job, True)
+    if job['webhook_url']:
+        with stage('webhook'):
+            send_webhook(job['webhook_url'], webhook_payload(job, output_url=job['output_url']))
+    cleanup_job(job)
+    logger.info(f"SUCCESS! Job {job['job_id']} completed: {job['output_url']}")
+    return {
+        'status': 'success',
+        'output_url': job['output_url'],
+        'metrics': job['metrics']
+    }
+
+
+# ============================================
+# STEPS (full video)
+# ============================================
+
+def prepare_full(job):
+    """Chunked or single pass; a single pass is normalized here, chunks normalize themselves"""
+    job['chunk_settings'] = chunking.get_settings(job['processing'])
+    job['chunked'] = chunking.should_chunk(job['video_path'], job['chunk_settings'])
+    if not job['chunked']:
+        job['model_input'], job['plan'], job['normalize_settings'], job['params'] = prepare_model_input(
+            job['video_path'], job['process_dir'], job['processing']
+        )
+    return job
+
+
+def generate_full(job):
+    """On one of the process-wide GPU slots, whoever runs the step (pipeline stage, batch loop, queue worker)"""
+    _, model_path = resolve_job_config(job['config'])
+    progress = functools.partial(update_progress, job['job_id'])
+    with get_device_slots(job['processing']).acquire() as device:
+        if job['chunked']:
+            job['output_path'] = swap_chunked(
+                job['video_path'], job['avatar_path'], job['process_dir'], model_path, job['processing'],
+                job['chunk_settings'], device=device, progress=progress
+            )
+        else:
+            job['output_path'] = generate_on_model(
+                job['video_path'], job['model_input'], job['avatar_path'], job['process_dir'], model_path,
+                job['params'], job['processing'], device=device, keep_fps=job['plan'] is not None,
+                progress=progress
+            )
+    return job
+
+
+def encode_full(job):
+    if not job['chunked']:
+        job['output_path'] = restore_output(
+            job['output_path'], job['plan'], job['process_dir'], job['normalize_settings']
+        )
+    return job
+
+
+# ============================================
+# STEPS (segmented)
+# ============================================
+
+def segment_video(video_path, timeline, work_name='chunks'):
+    """
+    Cut the video into the timeline's windows (one demux pass, exact cuts)
+    Returns list of segment file paths in the order of timeline
+    """
+    windows = [(name, start, end) for name, start, end, _ in timeline]
+    output_dir = os.path.dirname(str(video_path))
+    outputs = cut_segments(str(video_path), windows, output_dir, os.path.join(output_dir, work_name))
+    segments = [outputs[name] for name, _, _ in windows]
+    logger.info(f"Video segmented into {len(segments)} parts")
+    return segments
+
+
+def plan_segments(job):
+    """
+    Timeline (per job, else processing.timeline, else the legacy segments)
+    validated against the probed duration, narrowed to on-screen faces with
+    processing.face_scan (report in metrics['face_scan']); only the swap
+    windows are cut here, passthrough is cut while they are on the GPU
+    (job['segments'] holds None for those until swap_segments)
+    """
+    processing = job['processing']
+    info = probe(job['video_path'])
+    windows = job_timeline(processing, job['options'].get('timeline'), info.duration)
+    scan_settings = face_scan.get_settings(processing)
+    if scan_settings['enabled']:
+        with stage('face_scan'):
+            windows, report = face_scan.restrict_to_faces(job['video_path'], windows, info.duration, scan_settings)
+        job['metrics']['face_scan'] = report
+    logger.info(
+        f"Timeline: {len(windows)} windows, swapping {swap_seconds(windows):.1f}s "
+        f"of {info.duration:.1f}s"
+    )
+
+    swaps = [window for window in windows if window[3] == SWAP]
+    try:
+        with stage('segment'):
+            cut = iter(segment_video(job['video_path'], swaps, 'chunks_swap') if swaps else ())
+    except Exception as e:
+        raise Exception(f"Video segmentation failed: {e}")
+    job['segments'] = [next(cut) if mode == SWAP else None for _, _, _, mode in windows]
+    job['windows'] = windows
+    return job
+
+
+def prepare_passthrough(job):
+    """
+    Cut the passthrough windows and probe them for the stitcher (probes are
+    memoized, so its copy/conform checks don't reopen the files); returns
+    [(index, segment path)]
+    """
+    indexes = [index for index, window in enumerate(job['windows']) if window[3] != SWAP]
+    if not indexes:
+        return []
+    try:
+        with stage('segment'):
+            segments = segment_video(
+                job['video_path'], [job['windows'][index] for index in indexes], 'chunks_passthrough'
+            )
+            for path in [job['video_path']] + segments:
+                probe(path)
+    except Exception as e:
+        raise Exception(f"Video segmentation failed: {e}")
+    return list(zip(indexes, segments))
+
+
+def swap_segment(segment_path, avatar_path, model_path, processing_config, device=None, progress=None):
+    """Face-swap one segment into <segment>_swapped.mp4 (back at its size/fps, with its audio)"""
+    logger.info(f"Face-swapping segment: {segment_path}")
+    output_path = segment_path.replace('.mp4', '_swapped.mp4')
+    # Keep the work dir next to the segment so concurrent swaps never collide
+    process_dir = os.path.join(os.path.dirname(segment_path), f"wan_process_{os.path.basename(segment_path)}")
+    os.makedirs(process_dir, exist_ok=True)
+    generated = swap_single_pass(segment_path, avatar_path, process_dir, model_path, processing_config,
+                                 device=device, progress=progress)
+    shutil.move(generated, output_path)
+    shutil.rmtree(process_dir, ignore_errors=True)
+    return output_path
+
+
+def swap_segments(job):
+    """
+    Face-swap the swap windows in parallel, in a worker pool sized by
+    min(swap_workers, GPU slots), while the passthrough windows are cut
+    beside them; job['segments'] ends up complete, in playback order
+    """
+    processing = job['processing']
+    _, model_path = resolve_job_config(job['config'])
+    slots = get_device_slots(processing)
+    workers = max(1, min(int(processing.get('swap_workers', 2)), slots.size))
+    progress = functools.partial(update_progress, job['job_id'])
+
+    def run_swap(segment_path, name):
+        with slots.acquire() as device:
+            return swap_segment(segment_path, job['avatar_path'], model_path, processing, device,
+                                progress=functools.partial(progress, segment=name))
+
+    segments = job['segments']
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix='passthrough') as side, \
+            ThreadPoolExecutor(max_workers=workers, thread_name_prefix='faceswap') as pool:
+        # CPU/disk work, so it doesn't take a swap worker or a GPU slot
+        passthrough = side.submit(contextvars.copy_context().run, prepare_passthrough, job)
+        futures = {}
+        for index, (name, start, end, mode) in enumerate(job['windows']):
+            if mode != SWAP:
+                continue
+            logger.info(f"Face-swapping segment {name} ({start}-{end}s)")
+            futures[index] = (name, pool.submit(contextvars.copy_context().run, run_swap, segments[index], name))
+
+        for index, (name, future) in futures.items():
+            try:
+                segments[index] = future.result()
+            except Exception as e:
+                raise Exception(f"Face-swap failed on segment {name}: {e}")
+
+        for index, path in passthrough.result():
+            segments[index] = path
+
+    logger.info(f"Video segmented and swapped ({len(futures)} swaps, {workers} workers)")
+    return job
+
+
+def stitch_segments(segment_paths, output_path, fragmented=False, audio_source=None, durations=None,
+                    metrics=None):
+    """
+    Combine video segments into a single video
+
+    Segments matching the source are stream-copied, the rest conformed
+    (see stitcher); audio_source's audio is remuxed over the whole
+    timeline. fragmented writes append-only fragmented MP4 so the file can
+    be uploaded while it is still being written. The stitch report goes
+    into metrics['stitch'].
+    """
+    logger.info(f"Stitching {len(segment_paths)} segments")
+    try:
+        with stage('stitch', metrics) as timing:
+            report = stitch(segment_paths, output_path, audio_source, durations, fragmented)
+            timing['bytes'] = file_bytes(output_path)
+    except Exception as e:
+        raise Exception(f"Video stitching failed: {e}")
+    if metrics is not None:
+        metrics['stitch'] = report
+    logger.info(f"Video stitched successfully: {output_path}")
+    return output_path
+
+
+def stitch_output(job):
+    """
+    Stitch the segments back over the source audio; with
+    storage.stream_upload the upload runs while the final mux is written
+    """
+    job['output_path'] = os.path.join(job['temp_dir'], 'final_output.mp4')
+    durations = [end - start for _, start, end, _ in job['windows']]
+    args = (job['segments'], job['output_path'])
+    s3_config, _ = resolve_job_config(job['config'])
+
+    if s3_config.get('stream_upload'):
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='stitch') as pool, stage('upload') as timing:
+            writer = pool.submit(stitch_segments, *args, True, job['video_path'], durations, job['metrics'])
+            job['output_url'] = upload_growing_file(job['output_path'], job['job_id'], s3_config, writer,
+                                                    job['metrics'])
+            timing['bytes'] = file_bytes(job['output_path'])
+        writer.result()
+    else:
+        stitch_segments(*args, audio_source=job['video_path'], durations=durations, metrics=job['metrics'])
+    return job
+
+
+# ============================================
+# GRAPHS
+# ============================================
+
+FULL_VIDEO = StageGraph('full-video', [
+    Step('fetch', fetch_inputs, workers=2, queue_size=4),       # I/O: download video + avatar
+    Step('dedupe', reuse_result, workers=2, queue_size=4),      # CPU: hash inputs, reuse/coalesce
+    Step('prepare', prepare_full, workers=1, queue_size=2),     # CPU: probe, normalize
+    Step('generate', generate_full, workers=1, queue_size=2),   # GPU: Wan2.2 preprocess + generate
+    Step('encode', encode_full, workers=1, queue_size=2),       # CPU: restore size/fps/audio
+    Step('upload', upload_output, workers=2, queue_size=4),     # I/O: S3 upload
+    Step('notify', finish_job, workers=1, queue_size=4, always=True)   # index, webhook, cleanup
+])
+
+SEGMENTED = StageGraph('segmented', [
+    Step('fetch', fetch_inputs, workers=2, queue_size=4),
+    Step('dedupe', reuse_result, workers=2, queue_size=4),
+    Step('segment', plan_segments, workers=1, queue_size=2),    # CPU: timeline, face scan, cut
+    Step('generate', swap_segments, workers=1, queue_size=2),   # GPU: swap windows (slots inside)
+    Step('stitch', stitch_output, workers=1, queue_size=2),     # CPU: conform + mux (+ streaming upload)
+    Step('upload', upload_output, workers=2, queue_size=4),
+    Step('notify', finish_job, workers=1, queue_size=4, always=True)
+])
+
+GRAPHS = {graph.name: graph for graph in (FULL_VIDEO, SEGMENTED)}
@@ -0,0 +1,232 @@
+"""
+UGC Face Swapper - Face Detection Service
+One detector object per configuration, shared by the whole process: the
+backend (Haar cascades, an OpenCV DNN, or any "module:callable" factory) is
+built once per worker thread and frame batches fan out over a thread pool -
+OpenCV releases the GIL while detecting. Returns boxes and confidences, not
+just a yes/no.
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from model_worker import resolve_loader
+
+logger = logging.getLogger(__name__)
+
+FACE_CASCADE = 'haarcascade_frontalface_default.xml'
+
+# BGR -> luma (ITU-R BT.601), applied to a whole batch at once
+BGR_WEIGHTS = np.array([0.114, 0.587, 0.299], dtype=np.float32)
+
+NO_FACES = (np.zeros((0, 4), dtype=np.int32), np.zeros(0, dtype=np.float32))
+
+
+def load_face_cascade(name=FACE_CASCADE):
+    """Load one of OpenCV's bundled Haar cascades"""
+    cascade = cv2.CascadeClassifier(cv2.data.haarcascades + name)
+    if cascade.empty():
+        raise ValueError(f"Could not load cascade {name}")
+    return cascade
+
+
+def to_gray(frames):
+    """(N, H, W, 3) BGR batch -> (N, H, W) uint8 in one vectorized pass"""
+    frames = np.asarray(frames)
+    if frames.ndim == 3:
+        return frames
+    return (frames @ BGR_WEIGHTS).astype(np.uint8)
+
+
+# ============================================
+# BACKENDS
+# ============================================
+
+class HaarBackend:
+    """
+    Haar cascades on grayscale frames
+
+    Confidence is the cascade's final-stage level weight from
+    detectMultiScale3; with several cascades the union of boxes is returned.
+    """
+
+    grayscale = True
+
+    def __init__(self, cascades=(FACE_CASCADE,), scale_factor=1.1, min_neighbors=5, min_size=(100, 100)):
+        self.cascades = [load_face_cascade(name) for name in cascades]
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.min_size = tuple(min_size)
+
+    def detect(self, frame):
+        boxes, confidences = [], []
+        for cascade in self.cascades:
+            rects, _, weights = cascade.detectMultiScale3(
+                frame,
+                scaleFactor=self.scale_factor,
+                minNeighbors=self.min_neighbors,
+                minSize=self.min_size,
+                outputRejectLevels=True
+            )
+            if len(rects):
+                boxes.append(np.asarray(rects, dtype=np.int32).reshape(-1, 4))
+                confidences.append(np.asarray(weights, dtype=np.float32).reshape(-1))
+        if not boxes:
+            return NO_FACES
+        return np.concatenate(boxes), np.concatenate(confidences)
+
+
+class DnnBackend:
+    """
+    OpenCV DNN face detector (e.g. the res10 300x300 SSD)
+
+    model/config are anything cv2.dnn.readNet accepts.
+    """
+
+    grayscale = False
+
+    def __init__(self, model, config='', threshold=0.5, input_size=(300, 300), mean=(104.0, 177.0, 123.0)):
+        self.net = cv2.dnn.readNet(model, config)
+        self.threshold = threshold
+        self.input_size = tuple(input_size)
+        self.mean = mean
+
+    def detect(self, frame):
+        height, width = frame.shape[:2]
+        self.net.setInput(cv2.dnn.blobFromImage(frame, 1.0, self.input_size, self.mean))
+        detections = self.net.forward().reshape(-1, 7)
+        detections = detections[detections[:, 2] >= self.threshold]
+        if not len(detections):
+            return NO_FACES
+        corners = detections[:, 3:7] * np.array([width, height, width, height], dtype=np.float32)
+        boxes = np.column_stack([corners[:, :2], corners[:, 2:] - corners[:, :2]]).astype(np.int32)
+        return boxes, detections[:, 2].astype(np.float32)
+
+
+BACKENDS = {'haar': HaarBackend, 'dnn': DnnBackend}
+
+
+# ============================================
+# SERVICE
+# ============================================
+
+class FaceDetector:
+    """
+    Thread-pooled face detection over frame batches or whole videos
+
+    backend is 'haar', 'dnn' or a "module:callable" factory returning an
+    object with detect(frame) -> (boxes (K, 4) x/y/w/h, confidences (K,))
+    and a `grayscale` flag. Each pool thread builds its own backend once
+    (cascades aren't safe to share between threads).
+    """
+
+    def __init__(self, backend='haar', workers=4, **backend_kwargs):
+        self.factory = BACKENDS.get(backend) or resolve_loader(backend)
+        self.backend_kwargs = backend_kwargs
+        self.workers = max(1, int(workers))
+        self._local = threading.local()
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='face-detect')
+        self.grayscale = getattr(self._backend(), 'grayscale', True)
+
+    def _backend(self):
+        backend = getattr(self._local, 'backend', None)
+        if backend is None:
+            backend = self._local.backend = self.factory(**self.backend_kwargs)
+        return backend
+
+    def detect(self, frame):
+        """(boxes, confidences) for one frame (BGR or gray)"""
+        if self.grayscale and frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return self._backend().detect(frame)
+
+    def detect_batch(self, frames):
+        """
+        Detect on a batch - (N, H, W) gray, (N, H, W, 3) BGR or a list of frames
+
+        Returns [(boxes, confidences)] in input order.
+        """
+        if isinstance(frames, np.ndarray) and self.grayscale:
+            frames = to_gray(frames)
+        return list(self._pool.map(self.detect, frames))
+
+    def detect_video(self, video_path, stride=1, width=None, batch=32):
+        """
+        Sample every `stride`-th frame (optionally downscaled to `width`)
+
+        Returns (times, detections): times (N,) seconds and one
+        (boxes, confidences) per sampled frame, in the downscaled frame's
+        coordinates.
+        """
+        all_times, detections = [], []
+        for times, frames in sample_frames(video_path, stride, width, batch):
+            all_times.append(times)
+            detections.extend(self.detect_batch(frames))
+        times = np.concatenate(all_times) if all_times else np.zeros(0)
+        return times, detections
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+
+def sample_frames(video_path, stride=1, width=None, batch=32):
+    """
+    Yield (times, frames) batches: times is (N,) seconds, frames is an
+    (N, h, w, 3) BGR array. Skipped frames are only grabbed, never decoded
+    to images.
+    """
+    cap = cv2.VideoCapture(str(video_path))
+    if not cap.isOpened():
+        raise ValueError(f"Cannot open video file {video_path}")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+
+    times, frames = [], []
+    index = 0
+    try:
+        while True:
+            if index % stride:
+                if not cap.grab():
+                    break
+                index += 1
+                continue
+
+            ok, frame = cap.read()
+            if not ok:
+                break
+            if width and frame.shape[1] != width:
+                height = round(frame.shape[0] * width / frame.shape[1])
+                frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+            frames.append(frame)
+            times.append(index / fps)
+            index += 1
+
+            if len(frames) == batch:
+                yield np.array(times), np.stack(frames)
+                times, frames = [], []
+
+        if frames:
+            yield np.array(times), np.stack(frames)
+    finally:
+        cap.release()
+
+
+# ============================================
+# SHARED INSTANCES
+# ============================================
+
+_detectors = {}
+_detectors_lock = threading.Lock()
+
+
+def get_face_detector(backend='haar', workers=4, **backend_kwargs):
+    """Process-wide detector per configuration (built on first use)"""
+    key = (backend, workers, repr(sorted(backend_kwargs.items())))
+    with _detectors_lock:
+        detector = _detectors.get(key)
+        if detector is None:
+            detector = _detectors[key] = FaceDetector(backend, workers, **backend_kwargs)
+    return detector
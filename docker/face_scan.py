@@ -0,0 +1,117 @@
+"""
+UGC Face Swapper - Face-Presence Scan
+Fast CPU pre-pass that finds where a face is actually on screen. Frames are
+sampled at a stride, downsampled, converted to grayscale in batches and run
+through the shared face detector; swap windows are then narrowed to the
+face-present ranges so B-roll and turned-away shots never reach the model.
+"""
+
+import time
+import logging
+
+import numpy as np
+
+from face_detector import get_face_detector
+from timeline import build_timeline, intersect_swaps, swap_seconds
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    'enabled': False,
+    'stride': 5,            # sample every Nth frame
+    'width': 320,           # frames are downscaled to this width before detection
+    'min_face': 24,         # px at the downscaled width
+    'min_neighbors': 4,
+    'batch': 32,            # sampled frames converted per vectorized batch
+    'workers': 4,           # detection threads
+    'padding': 0.5,         # seconds kept swapped either side of a face range
+    'min_gap': 1.5,         # shorter no-face gaps stay swapped (not worth a cut)
+    'cascades': ['haarcascade_frontalface_default.xml', 'haarcascade_profileface.xml']
+}
+
+
+def get_settings(processing_config):
+    """Merge processing.face_scan over the defaults"""
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update(processing_config.get('face_scan') or {})
+    return settings
+
+
+def presence_ranges(times, present, interval, duration, padding, min_gap):
+    """
+    Turn per-sample face flags into [(start, end)] face-present ranges
+
+    Each positive sample covers half a sample interval either side, ranges
+    are padded, and gaps shorter than min_gap are closed.
+    """
+    ranges = []
+    for t in times[present].tolist():
+        start = max(0.0, t - interval / 2 - padding)
+        end = min(duration, t + interval / 2 + padding)
+        if ranges and start - ranges[-1][1] < min_gap:
+            ranges[-1] = (ranges[-1][0], max(ranges[-1][1], end))
+        else:
+            ranges.append((start, end))
+    return ranges
+
+
+def scan_faces(video_path, duration, settings):
+    """
+    Sample the video and return face-present ranges
+
+    Returns {'ranges': [(start, end)], 'samples': n, 'face_samples': n,
+    'seconds': scan wall time}.
+    """
+    started = time.time()
+    detector = get_face_detector(
+        workers=settings['workers'],
+        cascades=tuple(settings['cascades']),
+        min_neighbors=settings['min_neighbors'],
+        min_size=(settings['min_face'], settings['min_face'])
+    )
+
+    times, detections = detector.detect_video(
+        video_path, settings['stride'], settings['width'], settings['batch']
+    )
+    present = np.array([len(boxes) > 0 for boxes, _ in detections], dtype=bool)
+    interval = float(np.median(np.diff(times))) if len(times) > 1 else duration
+
+    ranges = presence_ranges(times, present, interval, duration, settings['padding'], settings['min_gap'])
+    return {
+        'ranges': ranges,
+        'samples': int(len(times)),
+        'face_samples': int(present.sum()),
+        'seconds': round(time.time() - started, 2)
+    }
+
+
+def restrict_to_faces(video_path, windows, duration, settings):
+    """
+    Narrow the swap windows of a built timeline to face-present ranges
+
+    Returns (windows, report); report['gpu_work_avoided_pct'] is the share
+    of swap seconds that no longer go to the model. On scan failure the
+    timeline is returned unchanged (everything stays swapped).
+    """
+    before = swap_seconds(windows)
+    try:
+        scan = scan_faces(video_path, duration, settings)
+    except Exception as e:
+        logger.error(f"Face scan failed, swapping full windows: {e}")
+        return windows, {'error': str(e), 'swap_seconds': round(before, 2), 'gpu_work_avoided_pct': 0.0}
+
+    narrowed = build_timeline(intersect_swaps(windows, scan['ranges'], duration), duration)
+    after = swap_seconds(narrowed)
+    report = {
+        'samples': scan['samples'],
+        'face_samples': scan['face_samples'],
+        'scan_seconds': scan['seconds'],
+        'swap_seconds_before': round(before, 2),
+        'swap_seconds': round(after, 2),
+        'gpu_work_avoided_pct': round(100 * (1 - after / before), 1) if before else 0.0
+    }
+    logger.info(
+        f"Face scan: {scan['face_samples']}/{scan['samples']} samples with a face, swapping "
+        f"{after:.1f}s instead of {before:.1f}s ({report['gpu_work_avoided_pct']}% GPU work avoided)"
+    )
+    return narrowed, report
@@ -8,6 +8,11 @@ import os
 import logging
 import traceback
 from process_simple import process_single_video
+from batch import process_batch
+from input_cache import configure_input_cache
+from model_server import start_model_server
+from webhooks import configure_webhooks
+from result_index import configure_result_index
 
 # Configure logging
 logging.basicConfig(
@@ -19,7 +24,9 @@ logger = logging.getLogger(__name__)
 # Configuration - all params come from event or environment variables
 CONFIG = {
     'webhook': {
-        'completion_url': None  # Will use webhook_url from event
+        'completion_url': None,  # Will use webhook_url from event
+        'outbox_path': os.environ.get('WEBHOOK_OUTBOX'),  # e.g. /runpod-volume/webhooks.sqlite3
+        'coalesce_interval': float(os.environ.get('WEBHOOK_COALESCE_SECONDS', 0))
     },
     'processing': {
         'segments': {
@@ -32,14 +39,34 @@ CONFIG = {
             'original_2_start': 20,
             'original_2_end': 30
         },
-        'model_path': os.environ.get('MODEL_PATH', '/runpod-volume/models/Wan2.2-Animate-14B')
+        'model_path': os.environ.get('MODEL_PATH', '/runpod-volume/models/Wan2.2-Animate-14B'),
+        'model_server': {
+            'enabled': os.environ.get('MODEL_SERVER', '0') == '1',
+            'loader': os.environ.get('MODEL_SERVER_LOADER', 'model_server:load_wan_animate')
+        },
+        'normalize': {
+            'enabled': os.environ.get('NORMALIZE', '0') == '1',
+            'fps': float(os.environ.get('NORMALIZE_FPS', 30))
+        },
+        'chunking': {
+            'enabled': os.environ.get('CHUNKED', '0') == '1',
+            'chunk_seconds': float(os.environ.get('CHUNK_SECONDS', 10)),
+            'overlap_frames': int(os.environ.get('CHUNK_OVERLAP_FRAMES', 8))
+        }
+    },
+    'cache': {
+        'input_enabled': os.environ.get('INPUT_CACHE', '1') == '1',
+        'input_max_bytes': int(os.environ.get('INPUT_CACHE_MAX_BYTES', 5 * 1024 ** 3)),
+        'result_enabled': os.environ.get('RESULT_INDEX', '0') == '1',
+        'result_path': os.environ.get('RESULT_INDEX_PATH', '/runpod-volume/cache/results.sqlite3')
     },
     'storage': {
         's3_access_key': os.environ.get('AWS_ACCESS_KEY_ID'),
         's3_secret_key': os.environ.get('AWS_SECRET_ACCESS_KEY'),
         's3_region': os.environ.get('AWS_REGION', 'eu-north-1'),
         's3_bucket': os.environ.get('S3_BUCKET', 'faceswap-outputs-kasparas'),
-        's3_output_prefix': os.environ.get('S3_OUTPUT_PREFIX', 'outputs/')
+        's3_output_prefix': os.environ.get('S3_OUTPUT_PREFIX', 'outputs/'),
+        's3_endpoint_url': os.environ.get('S3_ENDPOINT_URL')  # e.g. a local S3 stand-in
     }
 }
 logger.info("Handler initialized - config comes from event/env vars")
@@ -64,12 +91,26 @@ def handler(event):
         "output_url": "https://s3...",
         "error": "error message if failed"
     }
+
+    Batch form (one avatar, many videos, one aggregate webhook):
+    {
+        "input": {
+            "batch_id": "campaign-42" (optional, defaults to the Runpod job id),
+            "avatar_image_url": "https://...",
+            "videos": [{"record_id": "recXXX", "source_video_url": "https://..."}, ...],
+            "webhook_url": "https://hook.make.com/..."
+        }
+    }
+    Returns per-item results (see batch.process_batch).
     """
 
     try:
         # Extract input data
         input_data = event.get("input", {})
 
+        if "videos" in input_data:
+            return handle_batch(event, input_data)
+
         # Get parameters (support both naming conventions)
         record_id = input_data.get("record_id")
         video_url = input_data.get("source_video_url") or input_data.get("video_url")
@@ -102,14 +143,16 @@ def handler(event):
             return {
                 "status": "success",
                 "output_url": result.get('output_url'),
-                "record_id": record_id
+                "record_id": record_id,
+                "metrics": result.get('metrics')
             }
         else:
             logger.error(f"Processing failed for {record_id}: {result.get('error')}")
             return {
                 "status": "failed",
                 "error": result.get('error'),
-                "record_id": record_id
+                "record_id": record_id,
+                "metrics": result.get('metrics')
             }
 
     except Exception as e:
@@ -122,7 +165,35 @@ def handler(event):
             "traceback": traceback.format_exc()
         }
 
+def handle_batch(event, input_data):
+    """Validate and run the batch input form"""
+    batch_id = input_data.get("batch_id") or event.get("id") or "batch"
+    avatar_url = input_data.get("avatar_image_url") or input_data.get("avatar_url")
+    videos = input_data.get("videos")
+    webhook_url = input_data.get("webhook_url") or CONFIG.get('webhook', {}).get('completion_url')
+
+    if not avatar_url:
+        return {"status": "failed", "error": "Missing avatar URL", "batch_id": batch_id}
+    if not isinstance(videos, list) or not videos:
+        return {"status": "failed", "error": "videos must be a non-empty list", "batch_id": batch_id}
+
+    logger.info(f"Starting batch {batch_id} with {len(videos)} videos")
+    return process_batch(
+        batch_id=batch_id,
+        avatar_url=avatar_url,
+        videos=videos,
+        config=CONFIG,
+        webhook_url=webhook_url
+    )
+
 # Start Runpod serverless worker
 if __name__ == "__main__":
+    # Set up here rather than at import, so nothing that imports this
+    # module starts a second outbox dispatcher
+    configure_input_cache(CONFIG)
+    configure_webhooks(CONFIG)
+    configure_result_index(CONFIG)
+    # Load Wan2.2 once, before the first job arrives
+    start_model_server(CONFIG['processing'])
     logger.info("Starting Runpod serverless worker...")
     runpod.serverless.start({"handler": handler})
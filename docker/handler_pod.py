@@ -3,11 +3,20 @@ FastAPI Handler for Runpod GPU Pods (NOT serverless)
 Runs as persistent HTTP server to receive jobs from Make.com
 """
 
-from fastapi import FastAPI, BackgroundTasks
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
 import logging
 import os
-from process_simple import process_single_video
+from typing import List, Optional
+from process_simple import process_single_video, process_single_video_pipelined, build_pipeline
+from batch import process_batch
+from job_queue import JobQueue
+from input_cache import configure_input_cache, input_cache_stats
+from model_server import start_model_server, model_server_health
+from webhooks import configure_webhooks, webhook_stats
+from result_index import configure_result_index, result_index_stats
+from metrics import render as render_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
 
 # Configure logging
 logging.basicConfig(
@@ -21,14 +30,53 @@ app = FastAPI()
 # Configuration from environment
 CONFIG = {
     'processing': {
-        'model_path': os.environ.get('MODEL_PATH', '/workspace/faceswap-datacenter/models/Wan2.2-Animate-14B')
+        'model_path': os.environ.get('MODEL_PATH', '/workspace/faceswap-datacenter/models/Wan2.2-Animate-14B'),
+        # Model runs on the GPU at once across every job, batch item and pipeline stage
+        'gpu_slots': int(os.environ.get('GPU_SLOTS', 1)),
+        'model_server': {
+            'enabled': os.environ.get('MODEL_SERVER', '0') == '1',
+            'loader': os.environ.get('MODEL_SERVER_LOADER', 'model_server:load_wan_animate')
+        },
+        'normalize': {
+            'enabled': os.environ.get('NORMALIZE', '0') == '1',
+            'fps': float(os.environ.get('NORMALIZE_FPS', 30))
+        },
+        'chunking': {
+            'enabled': os.environ.get('CHUNKED', '0') == '1',
+            'chunk_seconds': float(os.environ.get('CHUNK_SECONDS', 10)),
+            'overlap_frames': int(os.environ.get('CHUNK_OVERLAP_FRAMES', 8))
+        }
+    },
+    'cache': {
+        'input_enabled': os.environ.get('INPUT_CACHE', '1') == '1',
+        'input_max_bytes': int(os.environ.get('INPUT_CACHE_MAX_BYTES', 5 * 1024 ** 3)),
+        'result_enabled': os.environ.get('RESULT_INDEX', '0') == '1',
+        'result_path': os.environ.get('RESULT_INDEX_PATH', '/workspace/faceswap-datacenter/cache/results.sqlite3')
+    },
+    'webhook': {
+        'outbox_path': os.environ.get('WEBHOOK_OUTBOX', '/workspace/faceswap-datacenter/webhooks.sqlite3'),
+        'coalesce_interval': float(os.environ.get('WEBHOOK_COALESCE_SECONDS', 0))
+    },
+    'pipeline': {
+        # Overlap download/preprocess/generate/encode/upload across jobs;
+        # the queue then runs PIPELINE_DEPTH jobs at once, still only GPU_SLOTS of them
+        # (or of the batches among them) generating
+        'enabled': os.environ.get('PIPELINE', '0') == '1',
+        'depth': int(os.environ.get('PIPELINE_DEPTH', 4)),
+        'generate': {'workers': int(os.environ.get('GPU_SLOTS', 1))}
+    },
+    'queue': {
+        'gpu_slots': int(os.environ.get('GPU_SLOTS', 1)),
+        'journal_path': os.environ.get('QUEUE_JOURNAL', '/workspace/faceswap-datacenter/jobs.sqlite3'),
+        'max_attempts': int(os.environ.get('QUEUE_MAX_ATTEMPTS', 3))
     },
     'storage': {
         's3_access_key': os.environ.get('AWS_ACCESS_KEY_ID'),
         's3_secret_key': os.environ.get('AWS_SECRET_ACCESS_KEY'),
         's3_region': os.environ.get('AWS_REGION', 'eu-north-1'),
         's3_bucket': os.environ.get('S3_BUCKET', 'faceswap-outputs-kasparas'),
-        's3_output_prefix': os.environ.get('S3_OUTPUT_PREFIX', 'outputs/')
+        's3_output_prefix': os.environ.get('S3_OUTPUT_PREFIX', 'outputs/'),
+        's3_endpoint_url': os.environ.get('S3_ENDPOINT_URL')  # e.g. a local S3 stand-in
     }
 }
 
@@ -41,24 +89,83 @@ class JobRequest(BaseModel):
     source_video_url: str
     avatar_image_url: str
     webhook_url: str = None
+    priority: int = 0  # higher runs first; FIFO within a priority
 
-def process_job_background(job_id: str, video_url: str, avatar_url: str, webhook_url: str = None):
-    """Background task to process video"""
-    try:
-        logger.info(f"Background processing started for {job_id}")
+class BatchVideo(BaseModel):
+    record_id: Optional[str] = None
+    source_video_url: str
+
+class BatchRequest(BaseModel):
+    batch_id: str
+    avatar_image_url: str
+    videos: List[BatchVideo]
+    webhook_url: str = None
+    priority: int = 0
+
+def process_job_background(job_id: str, payload: dict):
+    """Queue runner: process one video (or one batch) on a GPU slot"""
+    logger.info(f"Processing started for {job_id}")
+    if 'videos' in payload:
+        result = process_batch(
+            batch_id=job_id,
+            avatar_url=payload['avatar_url'],
+            videos=payload['videos'],
+            config=CONFIG,
+            webhook_url=payload.get('webhook_url')
+        )
+        logger.info(f"Batch completed for {job_id}: {result['succeeded']}/{len(result['results'])} succeeded")
+        return result
+
+    if PIPELINE:
+        result = process_single_video_pipelined(
+            PIPELINE,
+            job_id=job_id,
+            video_url=payload['video_url'],
+            avatar_url=payload['avatar_url'],
+            config=CONFIG,
+            webhook_url=payload.get('webhook_url')
+        )
+    else:
         result = process_single_video(
             job_id=job_id,
-            video_url=video_url,
-            avatar_url=avatar_url,
+            video_url=payload['video_url'],
+            avatar_url=payload['avatar_url'],
             config=CONFIG,
-            webhook_url=webhook_url
+            webhook_url=payload.get('webhook_url')
         )
-        logger.info(f"Background processing completed for {job_id}: {result}")
-    except Exception as e:
-        logger.error(f"Background processing failed for {job_id}: {e}")
+    logger.info(f"Processing completed for {job_id}: {result}")
+    return result
+
+PIPELINE = None
+JOBS = None
+
+@app.on_event("startup")
+def load_model():
+    """
+    Set up caches, webhook outbox and result index, load Wan2.2 once (no-op
+    unless MODEL_SERVER=1), then start draining the queue
+
+    Done here rather than at import so nothing runs twice in one pod.
+    """
+    global PIPELINE, JOBS
+    configure_input_cache(CONFIG)
+    configure_webhooks(CONFIG)
+    configure_result_index(CONFIG)
+    start_model_server(CONFIG['processing'])
+
+    PIPELINE = build_pipeline(CONFIG) if CONFIG['pipeline']['enabled'] else None
+    JOBS = JobQueue(
+        CONFIG['queue']['journal_path'],
+        process_job_background,
+        slots=CONFIG['pipeline']['depth'] if PIPELINE else CONFIG['queue']['gpu_slots'],
+        max_attempts=CONFIG['queue']['max_attempts']
+    )
+    if PIPELINE:
+        PIPELINE.start()
+    JOBS.start()
 
 @app.post("/process")
-async def create_job(job: JobRequest, background_tasks: BackgroundTasks):
+async def create_job(job: JobRequest):
     """
     Accept face-swap job from Make.com
 
@@ -67,27 +174,95 @@ async def create_job(job: JobRequest, background_tasks: BackgroundTasks):
         "record_id": "recXXXXX",
         "source_video_url": "https://...",
         "avatar_image_url": "https://...",
-        "webhook_url": "https://hook.make.com/..." (optional)
+        "webhook_url": "https://hook.make.com/..." (optional),
+        "priority": 0 (optional)
     }
 
-    Returns immediately with job accepted status.
-    Processing happens in background, webhook notifies when complete.
+    Returns immediately with the job's queue position and ETA. At most
+    GPU_SLOTS jobs run at once; a record_id that is already queued or
+    running is not queued twice. Webhook notifies when complete.
     """
     logger.info(f"Job received: {job.record_id}")
 
-    # Add to background tasks
-    background_tasks.add_task(
-        process_job_background,
+    queued, created = JOBS.submit(
         job.record_id,
-        job.source_video_url,
-        job.avatar_image_url,
-        job.webhook_url
+        {
+            'video_url': job.source_video_url,
+            'avatar_url': job.avatar_image_url,
+            'webhook_url': job.webhook_url
+        },
+        priority=job.priority
     )
 
     return {
-        "status": "accepted",
+        "status": "accepted" if created else "duplicate",
         "job_id": job.record_id,
-        "message": "Job queued for processing"
+        "job_status": queued['status'],
+        "position": queued.get('position'),
+        "eta_seconds": queued.get('eta_seconds'),
+        "message": "Job queued for processing" if created else "Job already queued or running"
+    }
+
+@app.post("/batch")
+async def create_batch(batch: BatchRequest):
+    """
+    Accept one avatar x many source videos as a single queued job
+
+    The avatar is fetched and preprocessed once, downloads/uploads overlap
+    generation, and one aggregate webhook reports per-item results.
+    Track it at /jobs/{batch_id}.
+    """
+    if not batch.videos:
+        raise HTTPException(status_code=400, detail="videos must not be empty")
+
+    logger.info(f"Batch received: {batch.batch_id} ({len(batch.videos)} videos)")
+
+    queued, created = JOBS.submit(
+        batch.batch_id,
+        {
+            'avatar_url': batch.avatar_image_url,
+            'videos': [video.dict() for video in batch.videos],
+            'webhook_url': batch.webhook_url
+        },
+        priority=batch.priority
+    )
+
+    return {
+        "status": "accepted" if created else "duplicate",
+        "job_id": batch.batch_id,
+        "videos": len(batch.videos),
+        "job_status": queued['status'],
+        "position": queued.get('position'),
+        "eta_seconds": queued.get('eta_seconds')
+    }
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status, result and ETA of one job"""
+    job = JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return job
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a job that has not started yet (running jobs finish)"""
+    job, cancelled = JOBS.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    if not cancelled:
+        raise HTTPException(
+            status_code=409, detail=f"Job {job_id} is {job['status']}, only queued jobs can be cancelled"
+        )
+    return job
+
+@app.get("/queue")
+async def queue_status():
+    """Queue depth, running jobs and estimated drain time"""
+    return {
+        **JOBS.stats(),
+        "pipeline": PIPELINE.stats() if PIPELINE else None,
+        "jobs": JOBS.list()
     }
 
 @app.get("/health")
@@ -96,9 +271,20 @@ async def health():
     return {
         "status": "healthy",
         "model_path": CONFIG['processing']['model_path'],
-        "model_exists": os.path.exists(CONFIG['processing']['model_path'])
+        "model_exists": os.path.exists(CONFIG['processing']['model_path']),
+        "model_server": model_server_health(),
+        "input_cache": input_cache_stats(),
+        "webhooks": webhook_stats(),
+        "result_index": result_index_stats(),
+        "queue": JOBS.stats(),
+        "pipeline": PIPELINE.stats() if PIPELINE else None
     }
 
+@app.get("/metrics")
+async def metrics():
+    """Per-stage histograms in Prometheus text format"""
+    return PlainTextResponse(render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
 @app.get("/")
 async def root():
     """Root endpoint"""
@@ -107,7 +293,11 @@ async def root():
         "version": "1.0",
         "endpoints": {
             "health": "/health",
-            "process": "/process (POST)"
+            "process": "/process (POST)",
+            "batch": "/batch (POST)",
+            "job": "/jobs/{job_id} (GET, DELETE cancels a queued job)",
+            "queue": "/queue",
+            "metrics": "/metrics"
         }
     }
 
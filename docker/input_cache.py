@@ -0,0 +1,231 @@
+"""
+UGC Face Swapper - Input Download Cache
+Keeps downloaded source videos/avatars on local disk keyed by URL and
+revalidates them with a conditional GET (ETag / Last-Modified; a HEAD for
+objects read straight from our S3 bucket), so Make.com retries and reruns
+don't re-download the same inputs. On a change that same GET's body is the
+download. Hits are reflinked or hardlinked into the job dir rather than
+copied.
+"""
+
+import os
+import json
+import fcntl
+import shutil
+import hashlib
+import logging
+import tempfile
+
+import requests
+from botocore.exceptions import BotoCoreError, ClientError
+
+from disk_cache import DiskCache
+from downloader import fetch, fetch_response, get_session, get_settings, direct_s3_params, http_url
+from storage import get_s3_client
+
+logger = logging.getLogger(__name__)
+
+DATA_FILE = 'data'
+META_FILE = 'meta.json'
+
+DEFAULT_DIR = os.path.join(tempfile.gettempdir(), 'faceswap-input-cache')
+DEFAULT_MAX_BYTES = 5 * 1024 ** 3
+
+FICLONE = 0x40049409  # linux/fs.h: _IOW(0x94, 9, int)
+
+_cache = None
+
+
+def url_key(url):
+    return hashlib.sha256(url.encode()).hexdigest()[:40]
+
+
+def place_file(source, target):
+    """
+    Make target a cheap copy of source: reflink, then hardlink, then copy
+
+    Returns the method used.
+    """
+    try:
+        with open(source, 'rb') as src, open(target, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return 'reflink'
+    except OSError:
+        if os.path.exists(target):
+            os.unlink(target)
+    try:
+        os.link(source, target)
+        return 'hardlink'
+    except OSError:
+        shutil.copy2(source, target)
+        return 'copy'
+
+
+def check_url(url, meta, timeout=30):
+    """
+    Conditional GET against the cached validators
+
+    Returns (not_modified, validators, response) where validators are the
+    server's current ETag / Last-Modified. On a change the 200 response is
+    returned open with its body unread, so the miss streams it instead of
+    requesting the file again; the caller must consume or close it.
+    """
+    headers = {}
+    if meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+    if meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta['last_modified']
+
+    response = get_session().get(url, headers=headers, stream=True, timeout=timeout)
+    if response.status_code == 304:
+        response.close()
+        return True, meta, None
+    try:
+        response.raise_for_status()
+    except requests.RequestException:
+        response.close()
+        raise
+
+    validators = {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified')
+    }
+    unchanged = bool(meta) and (
+        (validators['etag'] and validators['etag'] == meta.get('etag')) or
+        (not validators['etag'] and validators['last_modified'] and
+         validators['last_modified'] == meta.get('last_modified'))
+    )
+    if unchanged:
+        # Server ignored the conditional headers but the file is the same
+        response.close()
+        return True, validators, None
+    return False, validators, response
+
+
+def check_s3(params, meta, s3_config):
+    """check_url for objects read with GetObject: HEAD with our credentials"""
+    head = get_s3_client(s3_config).head_object(**params)
+    validators = {
+        'etag': head.get('ETag'),
+        'last_modified': head['LastModified'].isoformat() if head.get('LastModified') else None
+    }
+    unchanged = bool(meta) and bool(validators['etag']) and validators['etag'] == meta.get('etag')
+    return unchanged, validators
+
+
+class InputCache:
+    """URL -> downloaded file, revalidated on every use"""
+
+    def __init__(self, root, max_bytes):
+        self.store = DiskCache(root, max_bytes, name='input-cache')
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def fetch(self, url, output_path, config=None):
+        """
+        Put url's content at output_path, from cache when still valid
+
+        Same contract as downloader.fetch, plus a 'cache' field
+        (hit / miss / uncacheable) in the returned stats.
+        """
+        key = url_key(url)
+        timeout = get_settings(config)['timeout']
+
+        entry = self.store.get(key)
+        meta = {}
+        if entry is not None:
+            try:
+                with open(os.path.join(entry, META_FILE)) as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                meta = {}
+
+        response = None
+        try:
+            params = direct_s3_params(url, config)
+            if params is not None:
+                not_modified, validators = check_s3(params, meta, (config or {}).get('storage') or {})
+            else:
+                not_modified, validators, response = check_url(http_url(url, config), meta, timeout=timeout)
+        except (requests.RequestException, BotoCoreError, ClientError) as e:
+            # Let the real download surface the error (with its retries)
+            logger.warning(f"Conditional GET failed for {url}: {e}")
+            not_modified, validators = False, {}
+
+        if entry is not None and not_modified:
+            try:
+                method = place_file(os.path.join(entry, DATA_FILE), output_path)
+                size = os.path.getsize(output_path)
+                logger.info(f"Input cache hit for {url} ({size} bytes, {method})")
+                self.hits += 1
+                return {
+                    'url': url, 'path': output_path, 'bytes': size, 'seconds': 0.0,
+                    'mbps': 0.0, 'mode': method, 'connections': 0, 'cache': 'hit'
+                }
+            except OSError as e:
+                # Evicted underneath us - fall through to a fresh download
+                logger.warning(f"Input cache entry vanished for {url}: {e}")
+
+        if entry is not None:
+            self.stale += 1
+            self.store.remove(key)
+        self.misses += 1
+
+        if response is not None:
+            stats = fetch_response(url, response, output_path, config)
+        else:
+            stats = fetch(url, output_path, config)
+        if not (validators.get('etag') or validators.get('last_modified')):
+            stats['cache'] = 'uncacheable'
+            return stats
+
+        stats['cache'] = 'miss'
+        staging = tempfile.mkdtemp(prefix='.meta.', dir=self.store.root)
+        try:
+            meta_path = os.path.join(staging, META_FILE)
+            with open(meta_path, 'w') as f:
+                json.dump(dict(validators, url=url, size=stats['bytes']), f)
+            self.store.put(key, {DATA_FILE: output_path, META_FILE: meta_path}, link=True)
+        except OSError as e:
+            logger.warning(f"Input cache store failed for {url}: {e}")
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        return stats
+
+    def stats(self):
+        stats = self.store.stats()
+        lookups = self.hits + self.misses
+        stats.update({
+            'hits': self.hits,
+            'misses': self.misses,
+            'stale': self.stale,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0
+        })
+        return stats
+
+
+def configure_input_cache(config):
+    """Set up the process-wide input cache (cache.input_enabled)"""
+    global _cache
+    cache_config = (config or {}).get('cache') or {}
+    if not cache_config.get('input_enabled'):
+        return None
+    try:
+        _cache = InputCache(
+            cache_config.get('input_dir', DEFAULT_DIR),
+            cache_config.get('input_max_bytes', DEFAULT_MAX_BYTES)
+        )
+        logger.info(f"Input cache at {_cache.store.root} (max {_cache.store.max_bytes} bytes)")
+    except OSError as e:
+        logger.error(f"Input cache disabled: {e}")
+        _cache = None
+    return _cache
+
+
+def get_input_cache():
+    return _cache
+
+
+def input_cache_stats():
+    return _cache.stats() if _cache is not None else {'enabled': False}
@@ -0,0 +1,373 @@
+"""
+UGC Face Swapper - Job Queue
+Bounded-concurrency job queue for the HTTP servers: a fixed number of GPU
+slots, priority then FIFO ordering, dedup by job id, and a SQLite journal
+so queued (and interrupted) jobs survive a restart.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+import traceback
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCESS = 'success'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+ACTIVE_STATES = (QUEUED, RUNNING)
+
+# Used for ETAs until enough jobs have finished to measure
+DEFAULT_JOB_SECONDS = 600
+
+# Runs a job may start before a crash-restart loop gives up on it
+DEFAULT_MAX_ATTEMPTS = 3
+
+# Live progress of running jobs, reported from inside the pipeline. Jobs
+# that don't go through a JobQueue (serverless handler, batch items) are
+# never cleared explicitly, so entries expire once they stop updating and
+# the oldest go first past PROGRESS_MAX_ENTRIES.
+PROGRESS_TTL = 3600
+PROGRESS_MAX_ENTRIES = 1000
+
+_progress = OrderedDict()   # least recently updated first
+_progress_lock = threading.Lock()
+
+
+def _expire_progress(now):
+    while _progress:
+        entry = next(iter(_progress.values()))
+        if len(_progress) <= PROGRESS_MAX_ENTRIES and now - entry['updated_at'] < PROGRESS_TTL:
+            return
+        _progress.popitem(last=False)
+
+
+def update_progress(job_id, **fields):
+    """Merge progress fields (stage, percent, step, total, ...) into a job's status"""
+    now = time.time()
+    with _progress_lock:
+        entry = _progress.pop(job_id, {})
+        entry.update(fields, updated_at=round(now, 1))
+        _progress[job_id] = entry
+        _expire_progress(now)
+
+
+def get_progress(job_id):
+    with _progress_lock:
+        _expire_progress(time.time())
+        entry = _progress.get(job_id)
+        return dict(entry) if entry else None
+
+
+def clear_progress(job_id):
+    with _progress_lock:
+        _progress.pop(job_id, None)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT UNIQUE NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (status, priority DESC, seq);
+"""
+
+
+class JobQueue:
+    """
+    Persistent priority queue drained by `slots` worker threads
+
+    runner(job_id, payload) does the work and returns a result dict; a
+    result whose 'status' is 'success' marks the job succeeded, anything
+    else (or an exception) marks it failed. A job that was running when the
+    process died is re-queued at startup unless it has already been started
+    max_attempts times (it probably took the process down), then it fails.
+    """
+
+    def __init__(self, db_path, runner, slots=1, history=20, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.db_path = db_path
+        self.runner = runner
+        self.slots = max(1, int(slots))
+        self.history = history
+        self.max_attempts = max(1, int(max_attempts))
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)   # workers: new job queued
+        self._changed = threading.Condition(self._lock)  # waiters: a job changed state
+        self._stopping = False
+        self._workers = []
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(SCHEMA)
+
+        # Jobs that were running when the process died go back in line,
+        # unless they have used up their attempts
+        abandoned = self._db.execute(
+            "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE status = ? AND attempts >= ?",
+            (FAILED, f"Interrupted {self.max_attempts} times (process died while running), not retried",
+             time.time(), RUNNING, self.max_attempts)
+        ).rowcount
+        recovered = self._db.execute(
+            "UPDATE jobs SET status = ?, started_at = NULL WHERE status = ?", (QUEUED, RUNNING)
+        ).rowcount
+        pending = self._db.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()[0]
+        logger.info(
+            f"Job queue journal {db_path}: {pending} queued "
+            f"({recovered} recovered, {abandoned} failed after {self.max_attempts} attempts)"
+        )
+
+    # ============================================
+    # LIFECYCLE
+    # ============================================
+
+    def start(self):
+        for index in range(self.slots):
+            worker = threading.Thread(target=self._work, name=f'job-slot-{index}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        return self
+
+    def stop(self, timeout=None):
+        with self._wakeup:
+            self._stopping = True
+            self._wakeup.notify_all()
+        for worker in self._workers:
+            worker.join(timeout)
+
+    # ============================================
+    # SUBMISSION + QUERIES
+    # ============================================
+
+    def submit(self, job_id, payload, priority=0):
+        """
+        Enqueue a job; returns (job, created)
+
+        A job_id that is already queued or running is not enqueued again -
+        the existing job is returned with created=False. A finished job_id
+        is reset and re-run (so is a cancelled one).
+        """
+        now = time.time()
+        with self._wakeup:
+            row = self._db.execute("SELECT status FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is not None and row['status'] in ACTIVE_STATES:
+                return self._describe(job_id), False
+
+            if row is not None:
+                # Re-run of a finished job: back of its priority class
+                self._db.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+            self._db.execute(
+                "INSERT INTO jobs (job_id, priority, status, payload, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, priority, QUEUED, json.dumps(payload), now)
+            )
+            self._wakeup.notify()
+            logger.info(f"Job {job_id} queued (priority {priority})")
+            return self._describe(job_id), True
+
+    def get(self, job_id):
+        """Job status dict, or None if unknown"""
+        with self._lock:
+            return self._describe(job_id)
+
+    def wait(self, job_id, timeout, since_status=None):
+        """
+        Block until the job changes state, then return it (None if unknown)
+
+        Without since_status, waits for the job to finish; with it, returns
+        as soon as the status differs. Returns the current job on timeout.
+        """
+        deadline = time.time() + timeout
+        with self._changed:
+            while True:
+                job = self._describe(job_id)
+                if job is None:
+                    return None
+                if since_status is None and job['status'] not in ACTIVE_STATES:
+                    return job
+                if since_status is not None and job['status'] != since_status:
+                    return job
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return job
+                self._changed.wait(remaining)
+
+    def cancel(self, job_id):
+        """
+        Take a queued job out of line; returns (job, cancelled)
+
+        Running jobs are not interrupted (the model run cannot be stopped
+        cleanly), finished ones are left as they are: both come back with
+        cancelled=False. Returns (None, False) for an unknown job_id.
+        """
+        with self._lock:
+            cancelled = self._db.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE job_id = ? AND status = ?",
+                (CANCELLED, "Cancelled before it started", time.time(), job_id, QUEUED)
+            ).rowcount > 0
+            if cancelled:
+                self._changed.notify_all()
+                logger.info(f"Job {job_id} cancelled")
+            return self._describe(job_id), cancelled
+
+    def list(self, statuses=ACTIVE_STATES):
+        with self._lock:
+            marks = ','.join('?' * len(statuses))
+            rows = self._db.execute(
+                f"SELECT * FROM jobs WHERE status IN ({marks}) ORDER BY status DESC, priority DESC, seq",
+                tuple(statuses)
+            ).fetchall()
+            # One pass for the whole listing: queued rows arrive in line
+            # order, so their position is a running count
+            average = self._average_seconds()
+            remaining = self._remaining_running(average)
+            jobs = []
+            position = 0
+            for row in rows:
+                jobs.append(self._job(row, average, remaining, position))
+                if row['status'] == QUEUED:
+                    position += 1
+            return jobs
+
+    def stats(self):
+        """Queue depth, running count and when the queue is expected to drain"""
+        with self._lock:
+            counts = dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            average = self._average_seconds()
+            queued = counts.get(QUEUED, 0)
+            running = counts.get(RUNNING, 0)
+            return {
+                'slots': self.slots,
+                'queued': queued,
+                'running': running,
+                'succeeded': counts.get(SUCCESS, 0),
+                'failed': counts.get(FAILED, 0),
+                'cancelled': counts.get(CANCELLED, 0),
+                'average_job_seconds': round(average, 1),
+                'drain_eta_seconds': round(self._remaining_running(average) + queued * average / self.slots, 1)
+            }
+
+    # ============================================
+    # INTERNALS (call with self._lock held)
+    # ============================================
+
+    def _average_seconds(self):
+        rows = self._db.execute(
+            "SELECT finished_at - started_at AS took FROM jobs WHERE status IN (?, ?) "
+            "AND started_at IS NOT NULL ORDER BY finished_at DESC LIMIT ?",
+            (SUCCESS, FAILED, self.history)
+        ).fetchall()
+        if not rows:
+            return DEFAULT_JOB_SECONDS
+        return sum(row['took'] for row in rows) / len(rows)
+
+    def _remaining_running(self, average):
+        """Expected seconds of work left on running jobs, spread over all slots"""
+        now = time.time()
+        rows = self._db.execute("SELECT started_at FROM jobs WHERE status = ?", (RUNNING,)).fetchall()
+        remaining = sum(max(0.0, average - (now - row['started_at'])) for row in rows)
+        return remaining / self.slots
+
+    def _position(self, row):
+        """0-based place in line for a queued job"""
+        return self._db.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = ? AND (priority > ? OR (priority = ? AND seq < ?))",
+            (QUEUED, row['priority'], row['priority'], row['seq'])
+        ).fetchone()[0]
+
+    def _describe(self, job_id):
+        row = self._db.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        average = self._average_seconds()
+        if row['status'] == QUEUED:
+            return self._job(row, average, self._remaining_running(average), self._position(row))
+        return self._job(row, average)
+
+    def _job(self, row, average, remaining=0.0, position=0):
+        """Status dict for a jobs row; remaining/position only matter for queued jobs"""
+        job = {
+            'job_id': row['job_id'],
+            'status': row['status'],
+            'priority': row['priority'],
+            'attempts': row['attempts'],
+            'created_at': row['created_at'],
+            'started_at': row['started_at'],
+            'finished_at': row['finished_at'],
+            'result': json.loads(row['result']) if row['result'] else None,
+            'error': row['error']
+        }
+
+        if row['status'] == QUEUED:
+            job['position'] = position
+            job['eta_seconds'] = round(remaining + (position // self.slots + 1) * average, 1)
+        elif row['status'] == RUNNING:
+            job['eta_seconds'] = round(max(0.0, average - (time.time() - row['started_at'])), 1)
+            job['progress'] = get_progress(row['job_id'])
+        return job
+
+    def _claim(self):
+        """Mark the next job running and return (job_id, payload), or None"""
+        row = self._db.execute(
+            "SELECT job_id, payload FROM jobs WHERE status = ? ORDER BY priority DESC, seq LIMIT 1",
+            (QUEUED,)
+        ).fetchone()
+        if row is None:
+            return None
+        self._db.execute(
+            "UPDATE jobs SET status = ?, started_at = ?, attempts = attempts + 1 WHERE job_id = ?",
+            (RUNNING, time.time(), row['job_id'])
+        )
+        self._changed.notify_all()
+        return row['job_id'], json.loads(row['payload'])
+
+    def _finish(self, job_id, status, result=None, error=None):
+        clear_progress(job_id)
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE job_id = ?",
+                (status, json.dumps(result) if result is not None else None, error, time.time(), job_id)
+            )
+            self._changed.notify_all()
+
+    def _work(self):
+        while True:
+            with self._wakeup:
+                claimed = None
+                while not self._stopping:
+                    claimed = self._claim()
+                    if claimed:
+                        break
+                    self._wakeup.wait()
+                if claimed is None:
+                    return
+
+            job_id, payload = claimed
+            logger.info(f"Job {job_id} started on {threading.current_thread().name}")
+            try:
+                result = self.runner(job_id, payload) or {}
+                if result.get('status') == SUCCESS:
+                    self._finish(job_id, SUCCESS, result)
+                else:
+                    self._finish(job_id, FAILED, result, result.get('error'))
+                logger.info(f"Job {job_id} finished: {result.get('status')}")
+            except Exception as e:
+                logger.error(f"Job {job_id} crashed: {e}\n{traceback.format_exc()}")
+                self._finish(job_id, FAILED, error=str(e))
@@ -0,0 +1,239 @@
+"""
+UGC Face Swapper - Media Probe
+One ffprobe run per file (format, streams and video packet flags as JSON),
+parsed into a typed MediaInfo and memoized by path + mtime + size, so every
+pipeline stage shares the same answer instead of reopening the file.
+"""
+
+import os
+import json
+import logging
+import statistics
+import subprocess
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CACHE_ENTRIES = 64
+
+# Frame intervals more than this far from the median count as irregular...
+VFR_TOLERANCE = 0.1
+# ...and a stream is VFR when more than this share of intervals is irregular
+VFR_SHARE = 0.01
+
+
+class MediaProbeError(Exception):
+    pass
+
+
+def _rate(value):
+    """'30000/1001' -> 29.97 (0.0 when unknown)"""
+    try:
+        num, den = str(value).split('/')
+        return float(num) / float(den) if float(den) else 0.0
+    except ValueError:
+        return 0.0
+
+
+def _number(value, cast=float, default=0):
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return default
+
+
+@dataclass(frozen=True)
+class StreamInfo:
+    index: int
+    codec_type: str
+    codec_name: Optional[str]
+    duration: float = 0.0
+    bit_rate: int = 0
+    # video
+    width: int = 0
+    height: int = 0
+    pix_fmt: Optional[str] = None
+    fps: float = 0.0            # average frame rate
+    r_fps: float = 0.0          # container's base rate
+    # audio
+    sample_rate: int = 0
+    channels: int = 0
+    tags: dict = field(default_factory=dict)
+
+
+@dataclass(frozen=True)
+class MediaInfo:
+    path: str
+    size: int
+    mtime: float
+    format_name: str
+    duration: float
+    start_time: float
+    bit_rate: int
+    streams: Tuple[StreamInfo, ...]
+    keyframes: Tuple[float, ...]    # video keyframe times, seconds from start
+    frame_count: int                # video packets (exact, unlike CAP_PROP_FRAME_COUNT)
+    rotation: int                   # display rotation in degrees (0/90/180/270)
+    is_vfr: bool
+
+    @property
+    def video(self):
+        return next((s for s in self.streams if s.codec_type == 'video'), None)
+
+    @property
+    def audio(self):
+        return next((s for s in self.streams if s.codec_type == 'audio'), None)
+
+    @property
+    def has_audio(self):
+        return self.audio is not None
+
+    @property
+    def width(self):
+        return self.video.width if self.video else 0
+
+    @property
+    def height(self):
+        return self.video.height if self.video else 0
+
+    @property
+    def display_size(self):
+        """(width, height) as shown, i.e. after applying rotation"""
+        if self.rotation in (90, 270):
+            return self.height, self.width
+        return self.width, self.height
+
+    @property
+    def fps(self):
+        """Average frame rate, falling back to frames/duration (never 0 for video)"""
+        video = self.video
+        if video is None:
+            return 0.0
+        if video.fps:
+            return video.fps
+        if video.r_fps:
+            return video.r_fps
+        return self.frame_count / self.duration if self.duration else 30.0
+
+
+def _rotation(stream):
+    for side_data in stream.get('side_data_list', []):
+        if 'rotation' in side_data:
+            return int(round(-float(side_data['rotation']))) % 360
+    return _number(stream.get('tags', {}).get('rotate'), int, 0) % 360
+
+
+def _is_vfr(pts_times):
+    if len(pts_times) < 3:
+        return False
+    ordered = sorted(pts_times)
+    intervals = [b - a for a, b in zip(ordered, ordered[1:])]
+    median = statistics.median(intervals)
+    if median <= 0:
+        return False
+    irregular = sum(1 for d in intervals if abs(d - median) > VFR_TOLERANCE * median)
+    return irregular > VFR_SHARE * len(intervals)
+
+
+def _parse(path, stat, data):
+    fmt = data.get('format', {})
+    start_time = _number(fmt.get('start_time'))
+
+    streams = []
+    video_index, rotation = None, 0
+    for stream in data.get('streams', []):
+        info = StreamInfo(
+            index=stream['index'],
+            codec_type=stream.get('codec_type'),
+            codec_name=stream.get('codec_name'),
+            duration=_number(stream.get('duration')),
+            bit_rate=_number(stream.get('bit_rate'), int),
+            width=_number(stream.get('width'), int),
+            height=_number(stream.get('height'), int),
+            pix_fmt=stream.get('pix_fmt'),
+            fps=_rate(stream.get('avg_frame_rate')),
+            r_fps=_rate(stream.get('r_frame_rate')),
+            sample_rate=_number(stream.get('sample_rate'), int),
+            channels=_number(stream.get('channels'), int),
+            tags=stream.get('tags', {})
+        )
+        streams.append(info)
+        if info.codec_type == 'video' and video_index is None:
+            video_index, rotation = info.index, _rotation(stream)
+
+    pts_times, keyframes = [], []
+    for packet in data.get('packets', []):
+        if packet.get('stream_index') != video_index or packet.get('pts_time') in (None, 'N/A'):
+            continue
+        pts = float(packet['pts_time']) - start_time
+        pts_times.append(pts)
+        if 'K' in packet.get('flags', ''):
+            keyframes.append(round(pts, 6))
+
+    duration = _number(fmt.get('duration')) or max((s.duration for s in streams), default=0.0)
+    return MediaInfo(
+        path=path,
+        size=stat.st_size,
+        mtime=stat.st_mtime,
+        format_name=fmt.get('format_name', ''),
+        duration=duration,
+        start_time=start_time,
+        bit_rate=_number(fmt.get('bit_rate'), int),
+        streams=tuple(streams),
+        keyframes=tuple(sorted(set(keyframes))) or (0.0,),
+        frame_count=len(pts_times),
+        rotation=rotation,
+        is_vfr=_is_vfr(pts_times)
+    )
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def probe(path):
+    """
+    MediaInfo for path, from cache when the file hasn't changed
+
+    Raises MediaProbeError if the file is missing or ffprobe can't read it.
+    """
+    path = os.path.abspath(str(path))
+    try:
+        stat = os.stat(path)
+    except OSError as e:
+        raise MediaProbeError(f"Cannot probe {path}: {e}")
+    key = (path, stat.st_mtime_ns, stat.st_size)
+
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    cmd = [
+        'ffprobe', '-v', 'error', '-of', 'json',
+        '-show_format', '-show_streams',
+        '-show_entries', 'packet=stream_index,pts_time,flags',
+        path
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise MediaProbeError(f"ffprobe failed on {path}: {result.stderr.strip()[-1000:]}")
+    try:
+        info = _parse(path, stat, json.loads(result.stdout))
+    except (ValueError, KeyError) as e:
+        raise MediaProbeError(f"Unreadable ffprobe output for {path}: {e}")
+
+    logger.info(
+        f"Probed {os.path.basename(path)}: {info.width}x{info.height} {info.fps:.2f}fps "
+        f"{info.duration:.2f}s, {len(info.keyframes)} keyframes, rotation {info.rotation}, "
+        f"{'VFR' if info.is_vfr else 'CFR'}, {'audio' if info.has_audio else 'no audio'}"
+    )
+
+    with _cache_lock:
+        _cache[key] = info
+        while len(_cache) > CACHE_ENTRIES:
+            _cache.popitem(last=False)
+    return info
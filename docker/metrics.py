@@ -0,0 +1,287 @@
+"""
+UGC Face Swapper - Stage Metrics
+Times every pipeline stage (download, preprocess, generate, stitch, upload,
+webhook, ...) and records wall time, bytes moved, peak RSS, child-process
+CPU time and GPU-seconds. Each stage feeds process-wide histograms served in
+Prometheus text format at /metrics, plus a per-job summary that goes into
+the job result and the completion webhook.
+
+No client library needed: the exposition format is written directly.
+GPU-seconds come from NVML when pynvml is installed and are skipped
+otherwise.
+"""
+
+import os
+import time
+import logging
+import resource
+import threading
+import contextvars
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pynvml
+except ImportError:  # no GPU telemetry on this host
+    pynvml = None
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+SECONDS_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 2400)
+BYTES_BUCKETS = (1e5, 1e6, 1e7, 5e7, 1e8, 5e8, 1e9, 5e9, 1e10)
+
+# RSS/GPU sampling interval while a stage runs
+SAMPLE_INTERVAL = 0.5
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+# ============================================
+# HISTOGRAMS + EXPOSITION
+# ============================================
+
+def _format(value):
+    return '+Inf' if value == float('inf') else repr(float(value))
+
+
+class Histogram:
+    """Cumulative-bucket histogram with one `stage` label"""
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._series = {}    # stage -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, stage, value):
+        with self._lock:
+            series = self._series.setdefault(stage, [0] * len(self.buckets) + [0.0, 0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for stage, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f'{self.name}_bucket{{stage="{stage}",le="{_format(bound)}"}} {count}')
+                lines.append(f'{self.name}_sum{{stage="{stage}"}} {series[-2]:.6f}')
+                lines.append(f'{self.name}_count{{stage="{stage}"}} {series[-1]}')
+        return '\n'.join(lines)
+
+
+STAGE_SECONDS = Histogram('faceswap_stage_seconds', 'Wall time per pipeline stage', SECONDS_BUCKETS)
+STAGE_BYTES = Histogram('faceswap_stage_bytes', 'Bytes moved per pipeline stage', BYTES_BUCKETS)
+STAGE_PEAK_RSS = Histogram('faceswap_stage_peak_rss_bytes',
+                           'Peak resident memory of the worker and its children during a stage', BYTES_BUCKETS)
+STAGE_CHILD_CPU = Histogram('faceswap_stage_child_cpu_seconds',
+                            'CPU time of child processes reaped during a stage', SECONDS_BUCKETS)
+STAGE_GPU_SECONDS = Histogram('faceswap_stage_gpu_seconds',
+                              'GPU busy time (utilization x wall time, summed over devices) per stage',
+                              SECONDS_BUCKETS)
+
+HISTOGRAMS = (STAGE_SECONDS, STAGE_BYTES, STAGE_PEAK_RSS, STAGE_CHILD_CPU, STAGE_GPU_SECONDS)
+
+_failures = {}
+_failures_lock = threading.Lock()
+
+
+def render():
+    """Everything recorded so far, in Prometheus text exposition format"""
+    parts = [histogram.render() for histogram in HISTOGRAMS]
+    lines = ['# HELP faceswap_stage_failures_total Stages that raised',
+             '# TYPE faceswap_stage_failures_total counter']
+    with _failures_lock:
+        for stage, count in sorted(_failures.items()):
+            lines.append(f'faceswap_stage_failures_total{{stage="{stage}"}} {count}')
+    parts.append('\n'.join(lines))
+    return '\n'.join(parts) + '\n'
+
+
+# ============================================
+# SAMPLING (RSS of the process tree, GPU utilization)
+# ============================================
+
+def _tree_rss(root_pid):
+    """Resident bytes of root_pid and all its descendants (Linux /proc)"""
+    children = {}
+    rss = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        pid = int(entry)
+        children.setdefault(int(fields[1]), []).append(pid)
+        rss[pid] = int(fields[21]) * PAGE_SIZE
+
+    total, stack = 0, [root_pid]
+    while stack:
+        pid = stack.pop()
+        total += rss.get(pid, 0)
+        stack.extend(children.get(pid, ()))
+    return total
+
+
+_nvml_ready = None
+_nvml_lock = threading.Lock()
+
+
+def _gpu_handles():
+    global _nvml_ready
+    if pynvml is None:
+        return []
+    with _nvml_lock:
+        if _nvml_ready is None:
+            try:
+                pynvml.nvmlInit()
+                _nvml_ready = [pynvml.nvmlDeviceGetHandleByIndex(i) for i in range(pynvml.nvmlDeviceGetCount())]
+            except Exception as e:
+                logger.info(f"GPU metrics unavailable: {e}")
+                _nvml_ready = []
+    return _nvml_ready
+
+
+class _Sampler:
+    """Background sampling of tree RSS and GPU utilization while a stage runs"""
+
+    def __init__(self):
+        self.peak_rss = 0
+        self.gpu_seconds = 0.0 if _gpu_handles() else None
+        self._stop = threading.Event()
+        self._has_proc = os.path.isdir('/proc')
+        self._thread = threading.Thread(target=self._run, name='metrics-sampler', daemon=True)
+
+    def _sample(self, elapsed):
+        if self._has_proc:
+            try:
+                self.peak_rss = max(self.peak_rss, _tree_rss(os.getpid()))
+            except OSError:
+                self._has_proc = False
+        if self.gpu_seconds is not None and elapsed:
+            try:
+                busy = sum(pynvml.nvmlDeviceGetUtilizationRates(handle).gpu for handle in _gpu_handles())
+                self.gpu_seconds += busy / 100.0 * elapsed
+            except Exception:
+                self.gpu_seconds = None
+
+    def _run(self):
+        last = time.time()
+        self._sample(0)
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            now = time.time()
+            self._sample(now - last)
+            last = now
+        self._sample(time.time() - last)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        if not self._has_proc:
+            # Fall back to the high-water marks the kernel keeps (KiB on Linux)
+            self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            child_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            self.peak_rss = max(self_rss, child_rss) * 1024
+
+
+# ============================================
+# STAGES
+# ============================================
+
+_job_metrics = contextvars.ContextVar('faceswap_job_metrics', default=None)
+
+
+@contextmanager
+def job_scope(job_metrics):
+    """Stages entered in this context (and contexts copied from it) report into job_metrics"""
+    token = _job_metrics.set(job_metrics)
+    try:
+        yield job_metrics
+    finally:
+        _job_metrics.reset(token)
+
+
+def _children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+@contextmanager
+def stage(name, job_metrics=None):
+    """
+    Time one stage; yields a dict where the body can set 'bytes'
+
+    Results go to the histograms and into job_metrics['stages'][name]
+    (default: the job_scope in effect). A stage entered more than once per
+    job (e.g. one generate per segment) accumulates: seconds, bytes and
+    CPU/GPU time add up, peak RSS is the maximum. Child CPU time counts
+    every child reaped meanwhile, so it is shared between stages running
+    concurrently.
+    """
+    if job_metrics is None:
+        job_metrics = _job_metrics.get()
+    record = {'bytes': None}
+    started, cpu_before = time.time(), _children_cpu()
+    failed = False
+    try:
+        with _Sampler() as sampler:
+            yield record
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        seconds = time.time() - started
+        child_cpu = max(0.0, _children_cpu() - cpu_before)
+        STAGE_SECONDS.observe(name, seconds)
+        STAGE_CHILD_CPU.observe(name, child_cpu)
+        if sampler.peak_rss:
+            STAGE_PEAK_RSS.observe(name, sampler.peak_rss)
+        if record['bytes'] is not None:
+            STAGE_BYTES.observe(name, record['bytes'])
+        if sampler.gpu_seconds is not None:
+            STAGE_GPU_SECONDS.observe(name, sampler.gpu_seconds)
+        if failed:
+            with _failures_lock:
+                _failures[name] = _failures.get(name, 0) + 1
+
+        if job_metrics is not None:
+            _accumulate(job_metrics.setdefault('stages', {}), name, {
+                'seconds': seconds,
+                'bytes': record['bytes'],
+                'peak_rss_bytes': sampler.peak_rss or None,
+                'child_cpu_seconds': child_cpu,
+                'gpu_seconds': sampler.gpu_seconds
+            })
+
+
+_stages_lock = threading.Lock()
+
+
+def _accumulate(stages, name, values):
+    with _stages_lock:
+        entry = stages.setdefault(name, {'runs': 0})
+        entry['runs'] += 1
+        for key, value in values.items():
+            if value is None:
+                entry.setdefault(key, None)
+            elif key == 'peak_rss_bytes':
+                entry[key] = max(entry.get(key) or 0, int(value))
+            else:
+                entry[key] = round((entry.get(key) or 0) + value, 3)
+
+
+def file_bytes(*paths):
+    """Total size of the paths that exist"""
+    return sum(os.path.getsize(path) for path in paths if path and os.path.exists(path))
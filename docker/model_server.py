@@ -0,0 +1,388 @@
+"""
+UGC Face Swapper - Persistent Wan2.2 Model Server
+Loads Wan2.2-Animate once per container and serves preprocess/generate
+requests over a multiprocessing pipe, instead of paying interpreter startup,
+imports and a 14B checkpoint load on every job. The worker is a separate
+interpreter running model_worker.py.
+
+The model loader is pluggable ("module:callable" returning an object with
+preprocess(**kwargs) and generate(**kwargs)), so the worker can run on CPU
+with a fake model.
+"""
+
+import os
+import sys
+import time
+import logging
+import threading
+import subprocess
+import multiprocessing
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOADER = 'model_server:load_wan_animate'
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model_worker.py')
+
+# preprocess_data.py --fps default: Wan resamples to this unless told -1 (keep)
+WAN_DEFAULT_FPS = 30
+
+
+# ============================================
+# DEFAULT MODEL (Wan2.2-Animate, in-process)
+# ============================================
+
+class WanAnimateModel:
+    """
+    In-process equivalent of preprocess_data.py + generate.py --task animate-14B
+
+    Both pipelines are built once; each request only runs inference.
+    """
+
+    def __init__(self, model_path, wan_path='/app/Wan2.2', device_id=0):
+        preprocess_dir = os.path.join(wan_path, 'wan/modules/animate/preprocess')
+        for path in (wan_path, preprocess_dir):
+            if path not in sys.path:
+                sys.path.insert(0, path)
+
+        import wan
+        from wan.configs import WAN_CONFIGS
+        from wan.utils.utils import save_video
+        from process_pipepline import ProcessPipeline
+
+        self.model_path = model_path
+        self.cfg = WAN_CONFIGS['animate-14B']
+        self._save_video = save_video
+
+        ckpt_path = os.path.join(model_path, 'process_checkpoint')
+        logger.info(f"Loading Wan2.2 preprocess pipeline from {ckpt_path}")
+        self._preprocess = ProcessPipeline(
+            det_checkpoint_path=os.path.join(ckpt_path, 'det/yolov10m.onnx'),
+            pose2d_checkpoint_path=os.path.join(ckpt_path, 'pose2d/vitpose_h_wholebody.onnx'),
+            sam_checkpoint_path=os.path.join(ckpt_path, 'sam2/sam2_hiera_large.pt'),
+            flux_kontext_path=None
+        )
+
+        logger.info(f"Loading Wan2.2-Animate-14B from {model_path}")
+        self._animate = wan.WanAnimate(
+            config=self.cfg,
+            checkpoint_dir=model_path,
+            device_id=device_id,
+            rank=0,
+            use_relighting_lora=True
+        )
+
+    def warmup(self):
+        """Initialise the CUDA context so the first job doesn't pay for it"""
+        import torch
+        if torch.cuda.is_available():
+            x = torch.randn(256, 256, device='cuda')
+            (x @ x).sum().item()
+            torch.cuda.synchronize()
+
+    def preprocess(self, video_path, refer_path, save_path, resolution_area=(1280, 720),
+                   iterations=3, k=7, w_len=1, h_len=1, replace_flag=True, keep_fps=False):
+        os.makedirs(save_path, exist_ok=True)
+        self._preprocess(
+            video_path=video_path,
+            refer_image_path=refer_path,
+            output_path=save_path,
+            resolution_area=list(resolution_area),
+            fps=-1 if keep_fps else WAN_DEFAULT_FPS,
+            iterations=iterations,
+            k=k,
+            w_len=w_len,
+            h_len=h_len,
+            retarget_flag=False,
+            use_flux=False,
+            replace_flag=replace_flag
+        )
+        return save_path
+
+    def generate(self, src_root_path, save_file, refert_num=1, replace_flag=True, seed=-1):
+        video = self._animate.generate(
+            src_root_path=src_root_path,
+            replace_flag=replace_flag,
+            refert_num=refert_num,
+            clip_len=self.cfg.frame_num,
+            shift=self.cfg.sample_shift,
+            sample_solver='unipc',
+            sampling_steps=self.cfg.sample_steps,
+            guide_scale=self.cfg.sample_guide_scale,
+            seed=seed,
+            offload_model=True
+        )
+        self._save_video(
+            tensor=video[None],
+            save_file=save_file,
+            fps=self.cfg.sample_fps,
+            nrow=1,
+            normalize=True,
+            value_range=(-1, 1)
+        )
+        return save_file
+
+
+def load_wan_animate(model_path, wan_path='/app/Wan2.2', **kwargs):
+    """Default loader: the real Wan2.2-Animate-14B model"""
+    return WanAnimateModel(model_path, wan_path=wan_path, **kwargs)
+
+
+# ============================================
+# PARENT-SIDE HANDLE
+# ============================================
+
+class ModelServerError(Exception):
+    pass
+
+
+class ModelServer:
+    """
+    Parent-side handle on the long-lived model worker
+
+    Requests are serialised (one GPU, one model). If the worker dies or a
+    request times out, the worker is killed before the lock is released (so
+    a late reply can never reach the next caller), respawned in the
+    background, and the failing request raises ModelServerError.
+    """
+
+    def __init__(self, loader=DEFAULT_LOADER, loader_kwargs=None,
+                 startup_timeout=900, request_timeout=900, monitor_interval=5):
+        self.loader = loader
+        self.loader_kwargs = loader_kwargs or {}
+        self.startup_timeout = startup_timeout
+        self.request_timeout = request_timeout
+        self.monitor_interval = monitor_interval
+
+        self._lock = threading.Lock()
+        self._process = None
+        self._conn = None
+        self._stopping = False
+        self._monitor = None
+
+        self.state = 'stopped'
+        self.started_at = None
+        self.restarts = 0
+        self.requests_served = 0
+        self.requests_failed = 0
+        self.last_error = None
+
+    def start(self):
+        """Spawn the worker and block until the model is loaded and warm"""
+        with self._lock:
+            self._spawn()
+        if self._monitor is None:
+            self._monitor = threading.Thread(target=self._watch, name='model-server-monitor', daemon=True)
+            self._monitor.start()
+        return self
+
+    def _spawn(self):
+        self.state = 'loading'
+        # A fresh interpreter (CUDA can't survive fork) whose __main__ is
+        # model_worker.py, so no server module is re-imported in the child
+        parent_conn, child_conn = multiprocessing.Pipe()
+        process = subprocess.Popen(
+            [sys.executable, WORKER_SCRIPT, str(child_conn.fileno())],
+            pass_fds=(child_conn.fileno(),),
+            # Same import path as this process, so custom loaders resolve as before
+            env=dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path))
+        )
+        child_conn.close()
+        parent_conn.send({'loader': self.loader, 'loader_kwargs': self.loader_kwargs})
+
+        logger.info(f"Model server loading ({self.loader}, pid {process.pid})")
+        load_start = time.time()
+        if not parent_conn.poll(self.startup_timeout):
+            process.kill()
+            process.wait()
+            parent_conn.close()
+            self.state = 'failed'
+            self.last_error = f"Model load timed out after {self.startup_timeout}s"
+            raise ModelServerError(self.last_error)
+
+        try:
+            message = parent_conn.recv()
+        except EOFError:
+            message = {'ready': False, 'error': f"Worker exited with code {process.poll()}"}
+
+        if not message.get('ready'):
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+            parent_conn.close()
+            self.state = 'failed'
+            self.last_error = message.get('error')
+            raise ModelServerError(f"Model load failed: {self.last_error}")
+
+        self._process = process
+        self._conn = parent_conn
+        self.state = 'ready'
+        self.started_at = time.time()
+        logger.info(f"Model server ready in {time.time() - load_start:.1f}s")
+
+    def _alive(self):
+        return self._process is not None and self._process.poll() is None
+
+    def _kill(self):
+        if self._alive():
+            self._process.kill()
+            self._process.wait(timeout=10)
+        if self._conn is not None:
+            self._conn.close()
+        self._process = None
+        self._conn = None
+
+    def _respawn(self, reason):
+        logger.error(f"Model server respawning: {reason}")
+        self.last_error = reason
+        self.restarts += 1
+        self._kill()
+        self._spawn()
+
+    def _watch(self):
+        """Respawn the worker if it dies between requests"""
+        while not self._stopping:
+            time.sleep(self.monitor_interval)
+            with self._lock:
+                if self._stopping or self.state == 'stopped':
+                    return
+                if self._process is not None and not self._alive():
+                    try:
+                        self._respawn(f"Worker died (exit code {self._process.returncode})")
+                    except ModelServerError as e:
+                        logger.error(str(e))
+
+    def call(self, op, timeout=None, **kwargs):
+        """Run one request on the worker and return its result"""
+        timeout = timeout or self.request_timeout
+        with self._lock:
+            if not self._alive():
+                self._respawn("Worker not running")
+
+            start = time.time()
+            try:
+                self._conn.send({'op': op, 'kwargs': kwargs})
+                if not self._conn.poll(timeout):
+                    raise ModelServerError(f"{op} timed out after {timeout}s")
+                response = self._conn.recv()
+            except (EOFError, BrokenPipeError, OSError, ModelServerError) as e:
+                self.requests_failed += 1
+                reason = f"{op} failed: {str(e) or type(e).__name__}"
+                # The worker may still answer this request later - kill it and
+                # close the pipe now, while we hold the lock, so the next caller
+                # can't pick up that stale reply
+                self._kill()
+                self.state = 'restarting'
+                threading.Thread(target=self._respawn_async, args=(reason,), daemon=True).start()
+                raise ModelServerError(reason)
+
+            if not response.get('ok'):
+                self.requests_failed += 1
+                self.last_error = response.get('error')
+                raise ModelServerError(f"{op} failed: {response.get('error')}")
+
+            self.requests_served += 1
+            logger.info(f"Model server {op} done in {time.time() - start:.1f}s")
+            return response.get('result')
+
+    def _respawn_async(self, reason):
+        with self._lock:
+            if self._alive() or self._stopping:
+                return  # a caller already respawned it (or we're shutting down)
+            try:
+                self._respawn(reason)
+            except ModelServerError as e:
+                logger.error(str(e))
+
+    def preprocess(self, **kwargs):
+        return self.call('preprocess', **kwargs)
+
+    def generate(self, **kwargs):
+        return self.call('generate', **kwargs)
+
+    def is_ready(self):
+        return self.state == 'ready' and self._alive()
+
+    def health(self):
+        state = self.state
+        if state == 'ready' and not self.is_ready():
+            state = 'dead'
+        return {
+            'state': state,
+            'loader': self.loader,
+            'pid': self._process.pid if self._process is not None else None,
+            'uptime_seconds': round(time.time() - self.started_at, 1) if self.started_at else 0,
+            'restarts': self.restarts,
+            'requests_served': self.requests_served,
+            'requests_failed': self.requests_failed,
+            'last_error': self.last_error
+        }
+
+    def stop(self):
+        self._stopping = True
+        with self._lock:
+            if self._conn is not None:
+                try:
+                    self._conn.send({'op': 'shutdown'})
+                except (BrokenPipeError, OSError):
+                    pass
+            if self._process is not None:
+                try:
+                    self._process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    pass
+            self._kill()
+            self.state = 'stopped'
+
+
+# ============================================
+# PROCESS-WIDE SINGLETON
+# ============================================
+
+_server = None
+
+
+def start_model_server(model_config):
+    """
+    Start the shared model server if processing.model_server.enabled
+
+    Called once at container start; returns the server or None.
+    """
+    global _server
+    server_config = model_config.get('model_server') or {}
+    if not server_config.get('enabled'):
+        return None
+    if _server is not None:
+        return _server
+
+    loader_kwargs = {
+        'model_path': model_config.get('model_path'),
+        'wan_path': model_config.get('wan_path', '/app/Wan2.2')
+    }
+    loader_kwargs.update(server_config.get('loader_kwargs') or {})
+
+    server = ModelServer(
+        loader=server_config.get('loader', DEFAULT_LOADER),
+        loader_kwargs=loader_kwargs,
+        startup_timeout=server_config.get('startup_timeout', 900),
+        request_timeout=server_config.get('request_timeout', 900)
+    )
+    try:
+        server.start()
+    except ModelServerError as e:
+        logger.error(f"Model server unavailable, falling back to subprocesses: {e}")
+        return None
+
+    _server = server
+    return _server
+
+
+def get_model_server():
+    """Return the shared model server, or None if jobs should use subprocesses"""
+    return _server
+
+
+def model_server_health():
+    return _server.health() if _server is not None else {'state': 'disabled'}
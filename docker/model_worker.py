@@ -0,0 +1,68 @@
+"""
+UGC Face Swapper - Model Worker Entry Point
+Runs in its own interpreter, started by model_server.ModelServer as
+
+    python model_worker.py <fd>
+
+where <fd> is the worker end of a multiprocessing pipe. This module is the
+child's __main__ and imports nothing beyond the standard library, so no
+server module (and none of its queue, webhook or cache setup) is ever
+re-imported in the model process.
+"""
+
+import os
+import sys
+import importlib
+import traceback
+from multiprocessing.connection import Connection
+
+
+def resolve_loader(spec):
+    """Turn a "module:callable" spec into the loader function"""
+    module_name, _, attr = spec.partition(':')
+    if not attr:
+        raise ValueError(f"Model loader must be 'module:callable', got {spec!r}")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+def serve(conn):
+    """Load the model named in the first message, warm up, then serve requests until told to stop"""
+    try:
+        setup = conn.recv()
+    except EOFError:
+        return
+
+    try:
+        model = resolve_loader(setup['loader'])(**setup.get('loader_kwargs', {}))
+        if hasattr(model, 'warmup'):
+            model.warmup()
+    except Exception as e:
+        conn.send({'ready': False, 'error': f"{e}\n{traceback.format_exc()}"})
+        return
+
+    conn.send({'ready': True, 'pid': os.getpid()})
+
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            return
+
+        op = request.get('op')
+        if op == 'shutdown':
+            return
+        if op == 'ping':
+            conn.send({'ok': True, 'result': 'pong'})
+            continue
+
+        try:
+            if op not in ('preprocess', 'generate'):
+                raise ValueError(f"Unknown op: {op}")
+            result = getattr(model, op)(**request.get('kwargs', {}))
+            conn.send({'ok': True, 'result': result})
+        except Exception as e:
+            conn.send({'ok': False, 'error': f"{e}\n{traceback.format_exc()}"})
+
+
+if __name__ == '__main__':
+    serve(Connection(int(sys.argv[1])))
@@ -0,0 +1,146 @@
+"""
+UGC Face Swapper - Normalization Stage
+Brings a clip down to the model's working resolution and frame rate before
+Wan2.2 sees it, and brings the generated clip back afterwards: original
+size/aspect, original fps and the original audio remuxed. Each direction is
+a single ffmpeg filter graph using only portable software filters, so it
+runs the same on any GPU host.
+"""
+
+import math
+import logging
+import subprocess
+
+from media_probe import probe
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    'enabled': False,
+    'fps': 30,                      # model frame rate; lower = fewer frames to generate
+    'resolution_area': None,        # (w, h) pixel budget; default the preprocess resolution_area
+    'interpolate': False,           # motion-interpolate back up to the source fps (slow)
+    'crf': 18,
+    'preset': 'veryfast'
+}
+
+
+class NormalizeError(Exception):
+    pass
+
+
+def get_settings(processing_config, preprocess_params):
+    """Merge processing.normalize over the defaults"""
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update(processing_config.get('normalize') or {})
+    if not settings['resolution_area']:
+        settings['resolution_area'] = preprocess_params['resolution_area']
+    settings['resolution_area'] = tuple(settings['resolution_area'])
+    return settings
+
+
+def preprocess_params(base_params, settings):
+    """Wan2.2 preprocess params for normalized input (model runs at the normalized area)"""
+    if not settings['enabled']:
+        return base_params
+    return dict(base_params, resolution_area=settings['resolution_area'])
+
+
+def _even(value):
+    return max(2, int(round(value / 2)) * 2)
+
+
+def working_size(width, height, area):
+    """Largest even size with the same aspect that fits the pixel budget (never upscales)"""
+    budget = area[0] * area[1]
+    scale = min(1.0, math.sqrt(budget / float(width * height)))
+    return _even(width * scale), _even(height * scale)
+
+
+def _encode_args(settings):
+    return ['-c:v', 'libx264', '-preset', settings['preset'], '-crf', str(settings['crf']), '-pix_fmt', 'yuv420p']
+
+
+def _run(cmd, what):
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise NormalizeError(f"{what} failed: {result.stderr[-2000:]}")
+
+
+def prepare(video_path, output_path, settings):
+    """
+    Normalize video_path for the model
+
+    Returns a plan dict: 'input' is what to feed the model (video_path
+    itself when nothing needed changing), the rest is what restore() needs.
+    """
+    info = probe(video_path)
+    width, height = info.display_size
+    target_w, target_h = working_size(width, height, settings['resolution_area'])
+    target_fps = min(float(settings['fps']), info.fps) if settings['fps'] else info.fps
+
+    plan = {
+        'source': video_path,
+        'input': video_path,
+        'width': target_w,
+        'height': target_h,
+        'fps': target_fps,
+        'source_width': width,
+        'source_height': height,
+        'source_fps': info.fps,
+        'duration': info.duration,
+        'has_audio': info.has_audio
+    }
+
+    if (target_w, target_h) == (width, height) and abs(target_fps - info.fps) < 0.01 and not info.is_vfr:
+        logger.info(f"Normalize: {width}x{height}@{info.fps:.2f} already within model limits")
+        return plan
+
+    graph = f"[0:v]fps={target_fps:.6f},scale={target_w}:{target_h}:flags=area,setsar=1[v]"
+    _run(['ffmpeg', '-v', 'error', '-i', video_path, '-filter_complex', graph, '-map', '[v]', '-an']
+         + _encode_args(settings) + ['-y', output_path], "Normalization")
+
+    plan['input'] = output_path
+    pixels_before = width * height * info.fps
+    pixels_after = target_w * target_h * target_fps
+    logger.info(
+        f"Normalize: {width}x{height}@{info.fps:.2f} -> {target_w}x{target_h}@{target_fps:.2f} "
+        f"({100 * (1 - pixels_after / pixels_before):.0f}% fewer pixels/s for the model)"
+    )
+    return plan
+
+
+def restore(generated_path, plan, output_path, settings):
+    """
+    Return the model's output to the source geometry, fps and duration,
+    with the source's audio remuxed. Returns output_path.
+    """
+    # Re-time from frame index: the model saves at its own fps, but its
+    # frames correspond to the normalized input's frames
+    chain = [
+        f"setpts=N/({plan['fps']:.6f}*TB)",
+        f"scale={plan['source_width']}:{plan['source_height']}:flags=lanczos",
+        'setsar=1'
+    ]
+    if abs(plan['fps'] - plan['source_fps']) >= 0.01:
+        if settings['interpolate']:
+            chain.append(f"minterpolate=fps={plan['source_fps']:.6f}:mi_mode=mci")
+        else:
+            chain.append(f"fps={plan['source_fps']:.6f}")
+    # Hold the last frame if the model returned slightly fewer frames
+    chain.append('tpad=stop_mode=clone:stop_duration=1')
+    graph = f"[0:v]{','.join(chain)}[v]"
+
+    cmd = ['ffmpeg', '-v', 'error', '-i', generated_path, '-i', plan['source'],
+           '-filter_complex', graph, '-map', '[v]']
+    if plan['has_audio']:
+        cmd += ['-map', '1:a:0', '-c:a', 'copy']
+    cmd += _encode_args(settings) + ['-t', f"{plan['duration']:.6f}", '-y', output_path]
+    _run(cmd, "Restore")
+
+    logger.info(
+        f"Restored {plan['width']}x{plan['height']}@{plan['fps']:.2f} -> "
+        f"{plan['source_width']}x{plan['source_height']}@{plan['source_fps']:.2f}"
+        f"{' with original audio' if plan['has_audio'] else ''}"
+    )
+    return output_path
@@ -0,0 +1,201 @@
+"""
+UGC Face Swapper - Staged Pipeline Executor
+Runs jobs through a chain of stages (fetch -> prepare -> generate -> encode
+-> upload), each with its own worker threads and a bounded input queue, so
+job N+1 downloads and preprocesses while job N is on the GPU. A full queue
+blocks the stage feeding it, which keeps the number of jobs in flight (and
+their temp files) bounded. Per-stage busy/blocked time is tracked so worker
+counts can be sized from real utilization.
+"""
+
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class Stage:
+    """
+    One pipeline step
+
+    fn(job) gets the job's context dict and returns it (or a replacement)
+    for the next stage; raising fails the job. `workers` threads run fn,
+    fed from a queue holding at most `queue_size` waiting jobs.
+    """
+
+    def __init__(self, name, fn, workers=1, queue_size=2):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, int(workers))
+        self.queue_size = max(1, int(queue_size))
+        self.queue = queue.Queue(maxsize=self.queue_size)
+
+        self.processed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0      # inside fn
+        self.blocked_seconds = 0.0   # waiting for room in the next stage's queue
+        self.wait_seconds = 0.0      # jobs sitting in this stage's queue
+        self.active = 0
+
+
+class StagePipeline:
+    """
+    Thread-per-worker pipeline over a list of Stages
+
+    submit(job) returns a Future resolved with the last stage's result or
+    the exception of the stage that failed (later stages are skipped).
+    """
+
+    def __init__(self, stages, name='pipeline'):
+        if not stages:
+            raise ValueError("A pipeline needs at least one stage")
+        self.stages = list(stages)
+        self.name = name
+        self._lock = threading.Lock()
+        self._threads = []
+        self._started_at = None
+        self._in_flight = 0
+
+    # ============================================
+    # LIFECYCLE
+    # ============================================
+
+    def start(self):
+        self._started_at = time.time()
+        for index, stage in enumerate(self.stages):
+            for worker in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._work, args=(index,), name=f'{self.name}-{stage.name}-{worker}', daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+        logger.info(
+            f"Pipeline {self.name} started: "
+            + ', '.join(f"{s.name} x{s.workers} (queue {s.queue_size})" for s in self.stages)
+        )
+        return self
+
+    def stop(self, timeout=None):
+        """Finish queued jobs, then stop every worker"""
+        for stage in self.stages:
+            for _ in range(stage.workers):
+                stage.queue.put(_STOP)
+            for thread in self._threads:
+                if thread.name.startswith(f'{self.name}-{stage.name}-'):
+                    thread.join(timeout)
+
+    # ============================================
+    # SUBMISSION
+    # ============================================
+
+    def submit(self, job, timeout=None):
+        """
+        Queue a job context at the first stage; blocks while that queue is
+        full (raises queue.Full after `timeout` seconds)
+        """
+        future = Future()
+        # Counted before the put so a worker finishing it can't go below zero
+        with self._lock:
+            self._in_flight += 1
+        try:
+            self.stages[0].queue.put((job, future, time.time()), timeout=timeout)
+        except queue.Full:
+            with self._lock:
+                self._in_flight -= 1
+            raise
+        return future
+
+    def run(self, job):
+        """submit() and wait for the result"""
+        return self.submit(job).result()
+
+    # ============================================
+    # WORKERS
+    # ============================================
+
+    def _work(self, index):
+        stage = self.stages[index]
+        next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+
+        while True:
+            item = stage.queue.get()
+            if item is _STOP:
+                return
+            job, future, queued_at = item
+
+            started = time.time()
+            with self._lock:
+                stage.wait_seconds += started - queued_at
+                stage.active += 1
+            try:
+                result, error = stage.fn(job), None
+            except Exception as e:
+                result, error = None, e
+            finished = time.time()
+
+            with self._lock:
+                stage.active -= 1
+                stage.busy_seconds += finished - started
+                if error is None:
+                    stage.processed += 1
+                else:
+                    stage.failed += 1
+
+            if error is not None:
+                logger.error(f"Pipeline {self.name}: stage {stage.name} failed: {error}")
+                self._finish(future, error=error)
+            elif next_stage is None:
+                self._finish(future, result=result)
+            else:
+                next_stage.queue.put((result, future, time.time()))
+                with self._lock:
+                    stage.blocked_seconds += time.time() - finished
+
+    def _finish(self, future, result=None, error=None):
+        with self._lock:
+            self._in_flight -= 1
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    # ============================================
+    # STATS
+    # ============================================
+
+    def stats(self):
+        """
+        Per-stage counters and utilization
+
+        utilization is busy time over worker capacity since start: a stage
+        near 1.0 is the bottleneck (add workers there), one near 0 with
+        high blocked_seconds is waiting on the stage after it.
+        """
+        with self._lock:
+            uptime = time.time() - self._started_at if self._started_at else 0.0
+            stages = {}
+            for stage in self.stages:
+                done = stage.processed + stage.failed
+                stages[stage.name] = {
+                    'workers': stage.workers,
+                    'active': stage.active,
+                    'queued': stage.queue.qsize(),
+                    'queue_size': stage.queue_size,
+                    'processed': stage.processed,
+                    'failed': stage.failed,
+                    'busy_seconds': round(stage.busy_seconds, 2),
+                    'blocked_seconds': round(stage.blocked_seconds, 2),
+                    'avg_seconds': round(stage.busy_seconds / done, 2) if done else None,
+                    'avg_wait_seconds': round(stage.wait_seconds / done, 2) if done else None,
+                    'utilization': round(stage.busy_seconds / (stage.workers * uptime), 3) if uptime else 0.0
+                }
+            return {
+                'in_flight': self._in_flight,
+                'uptime_seconds': round(uptime, 1),
+                'stages': stages
+            }
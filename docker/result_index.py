@@ -0,0 +1,182 @@
+"""
+UGC Face Swapper - Result Index
+Makes jobs idempotent. Every finished output is recorded in SQLite under a
+key built from the source video's content hash, the avatar's content hash
+and everything else that shapes the output (processing mode, Wan2.2
+params, model, processing settings). A later job with the same key - the
+same record re-sent, or another record with the same inputs - gets the
+stored S3 object copied server-side to its own key instead of a GPU run.
+Jobs that arrive while one with their key is still running wait for it and
+share its output.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from concurrent.futures import Future
+
+
+logger = logging.getLogger(__name__)
+
+# Bump when a code change alters outputs for identical inputs/settings
+RESULT_VERSION = 1
+
+# processing settings that change the output (everything else is tuning)
+OUTPUT_SETTINGS = ('model_path', 'model_name', 'segments', 'timeline', 'normalize', 'chunking', 'face_scan')
+
+DEFAULT_PATH = '/runpod-volume/cache/results.sqlite3'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    job_id TEXT NOT NULL,
+    object_key TEXT NOT NULL,
+    url TEXT NOT NULL,
+    etag TEXT,
+    size INTEGER,
+    created_at REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    last_hit_at REAL
+);
+"""
+
+
+def result_key(video_path, avatar_path, mode, params, processing_config, options=None):
+    """Index key: input content hashes + mode + every setting that shapes the output"""
+    settings = {name: processing_config.get(name) for name in OUTPUT_SETTINGS}
+    blob = json.dumps({
+        'version': RESULT_VERSION,
+        'mode': mode,
+        'params': params,
+        'settings': settings,
+        'options': options or {}
+    }, sort_keys=True, default=list)
+    return hashlib.sha256(f"{file_sha256(video_path)}:{file_sha256(avatar_path)}:{blob}".encode()).hexdigest()
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultIndex:
+    """
+    SQLite-backed key -> output object map, plus in-process coalescing of
+    jobs that share a key
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._in_flight = {}    # key -> Future resolved when its leader finishes
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(SCHEMA)
+
+    # ============================================
+    # LOOKUPS
+    # ============================================
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT * FROM results WHERE key = ?", (key,)).fetchone()
+        return dict(row) if row else None
+
+    def hit(self, key):
+        with self._lock:
+            self.hits += 1
+            self._db.execute(
+                "UPDATE results SET hits = hits + 1, last_hit_at = ? WHERE key = ?", (time.time(), key)
+            )
+
+    def put(self, key, job_id, object_key, url, etag=None, size=None):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO results (key, job_id, object_key, url, etag, size, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, job_id, object_key, url, etag, size, time.time())
+            )
+
+    def forget(self, key):
+        """Drop an entry whose object is gone or was overwritten"""
+        with self._lock:
+            self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+
+    # ============================================
+    # COALESCING
+    # ============================================
+
+    def claim(self, key):
+        """
+        (True, future) if the caller now runs this key and must release()
+        it, else (False, future) for the running job's completion
+        """
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return False, future
+            self.misses += 1
+            future = self._in_flight[key] = Future()
+            return True, future
+
+    def release(self, key, succeeded):
+        with self._lock:
+            future = self._in_flight.pop(key, None)
+        if future is not None:
+            future.set_result(succeeded)
+
+    def stats(self):
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            return {
+                'enabled': True,
+                'entries': entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'in_flight': len(self._in_flight)
+            }
+
+
+# ============================================
+# PROCESS-WIDE INDEX
+# ============================================
+
+_index = None
+
+
+def configure_result_index(config):
+    """Open the shared index from the `cache` config section (cache.result_enabled)"""
+    global _index
+    cache_config = (config or {}).get('cache') or {}
+    if not cache_config.get('result_enabled') or _index is not None:
+        return _index
+    try:
+        _index = ResultIndex(cache_config.get('result_path', DEFAULT_PATH))
+        logger.info(f"Result index at {_index.db_path}")
+    except (OSError, sqlite3.Error) as e:
+        logger.error(f"Result index disabled: {e}")
+        _index = None
+    return _index
+
+
+def get_result_index():
+    return _index
+
+
+def result_index_stats():
+    return _index.stats() if _index is not None else {'enabled': False}
@@ -0,0 +1,246 @@
+"""
+UGC Face Swapper - Segmenter
+Cuts a video into named windows in a single demux pass. Keyframe positions
+come from the media probe; the file is split on the keyframes around each
+cut with the segment muxer (stream copy), then only the GOPs a cut falls
+inside are re-encoded so every window starts and ends on the exact
+requested time.
+"""
+
+import os
+import logging
+import subprocess
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
+
+from media_probe import probe
+
+logger = logging.getLogger(__name__)
+
+# Encoders used for boundary GOPs; they must produce the source codec so
+# re-encoded and copied pieces can be concatenated
+VIDEO_ENCODERS = {'h264': 'libx264', 'hevc': 'libx265'}
+AUDIO_ENCODERS = {'aac': 'aac', 'mp3': 'libmp3lame', 'opus': 'libopus'}
+
+# Intermediate chunks are MPEG-TS: parameter sets travel in-band, so copied
+# GOPs and re-encoded GOPs concatenate cleanly
+CHUNK_FORMAT, CHUNK_EXT = 'mpegts', '.ts'
+
+BOUNDARY_WORKERS = 4
+
+
+class SegmentationError(Exception):
+    pass
+
+
+def _run(cmd):
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise SegmentationError(f"{cmd[0]} failed: {result.stderr[-2000:]}")
+    return result.stdout
+
+
+def _audio_codec(info):
+    return info.audio.codec_name if info.audio else None
+
+
+def plan_cuts(windows, keyframes, duration, tolerance):
+    """
+    Work out split points and per-window pieces
+
+    A cut within `tolerance` of a keyframe is aligned to it; any other cut
+    splits on the keyframes either side of it, isolating the one GOP that
+    has to be re-encoded. Returns (split_times, plans) where each plan is
+    {'name', 'start', 'end', 'head', 'body', 'tail'}: head/tail are
+    (gop_start, from, to) re-encode ranges or None and body is the
+    (from, to) range that is stream-copied, or None.
+    """
+    def align(t):
+        i = bisect_left(keyframes, t - tolerance)
+        if i < len(keyframes) and abs(keyframes[i] - t) <= tolerance:
+            return keyframes[i]
+        return None
+
+    def gop(t):
+        """(keyframe at/before t, next keyframe or the end of the file)"""
+        i = bisect_right(keyframes, t) - 1
+        start = keyframes[max(i, 0)]
+        end = keyframes[i + 1] if i + 1 < len(keyframes) else duration
+        return start, end
+
+    splits = set()
+    plans = []
+    for name, start, end in windows:
+        end = min(end, duration)
+        plan = {'name': name, 'start': start, 'end': end, 'head': None, 'body': None, 'tail': None}
+
+        aligned_start, aligned_end = align(start), align(end)
+        if aligned_end is None and end >= duration - tolerance:
+            aligned_end = duration
+        body_start, body_end = aligned_start, aligned_end
+
+        if aligned_start is None:
+            gop_start, gop_end = gop(start)
+            splits.update((gop_start, gop_end))
+            if end <= gop_end:
+                # Whole window inside one GOP
+                plan['head'] = (gop_start, start, end)
+                plans.append(plan)
+                continue
+            plan['head'] = (gop_start, start, gop_end)
+            body_start = gop_end
+        else:
+            splits.add(aligned_start)
+
+        if aligned_end is None:
+            gop_start, gop_end = gop(end)
+            splits.update((gop_start, gop_end))
+            plan['tail'] = (gop_start, gop_start, end)
+            body_end = gop_start
+        else:
+            splits.add(aligned_end)
+
+        if body_end - body_start > tolerance:
+            plan['body'] = (body_start, body_end)
+        plans.append(plan)
+
+    split_times = sorted(t for t in splits if tolerance < t < duration - tolerance)
+    return split_times, plans
+
+
+def _split(video_path, split_times, work_dir, fps):
+    """One stream-copy pass: one chunk starting at 0 and at each split time"""
+    pattern = os.path.join(work_dir, f'chunk_%04d{CHUNK_EXT}')
+    cmd = ['ffmpeg', '-v', 'error', '-i', video_path, '-map', '0:v:0', '-map', '0:a:0?', '-c', 'copy',
+           '-f', 'segment', '-segment_format', CHUNK_FORMAT, '-reset_timestamps', '1',
+           '-segment_time_delta', f'{0.5 / fps:.6f}']
+    if split_times:
+        cmd += ['-segment_times', ','.join(f'{t:.6f}' for t in split_times)]
+    _run(cmd + ['-y', pattern])
+    return [0.0] + split_times, pattern
+
+
+def _encode_args(info):
+    args = ['-c:v', VIDEO_ENCODERS[info.video.codec_name], '-preset', 'veryfast', '-crf', '16',
+            '-pix_fmt', (info.video.pix_fmt or 'yuv420p')]
+    if _audio_codec(info):
+        args += ['-c:a', AUDIO_ENCODERS[_audio_codec(info)]]
+    return args
+
+
+def _reencode_gop(chunk_path, pieces, info):
+    """
+    Cut one GOP chunk into [(from, to, output)] pieces (chunk-relative
+    seconds) with a single decode and one mapped output per piece
+
+    Constant-rate video is trimmed by frame index, since chunk timestamps
+    start at the decoder delay rather than exactly 0. Frame index and time
+    drift apart in VFR video, so there the chunk is rebased to 0 and
+    trimmed by timestamp.
+    """
+    count = len(pieces)
+    has_audio = bool(_audio_codec(info))
+    graph = [f"[0:v]split={count}" + ''.join(f'[v{i}]' for i in range(count))]
+    if has_audio:
+        graph.append(f"[0:a]asplit={count}" + ''.join(f'[a{i}]' for i in range(count)))
+    for i, (cut_from, cut_to, _) in enumerate(pieces):
+        if info.is_vfr:
+            trim = f"setpts=PTS-STARTPTS,trim=start={cut_from:.6f}:end={cut_to:.6f}"
+        else:
+            trim = f"trim=start_frame={round(cut_from * info.fps)}:end_frame={round(cut_to * info.fps)}"
+        graph.append(f"[v{i}]{trim},setpts=PTS-STARTPTS[vo{i}]")
+        if has_audio:
+            graph.append(f"[a{i}]atrim=start={cut_from:.6f}:end={cut_to:.6f},asetpts=PTS-STARTPTS[ao{i}]")
+
+    cmd = ['ffmpeg', '-v', 'error', '-i', chunk_path, '-filter_complex', ';'.join(graph)]
+    for i, (_, _, output_path) in enumerate(pieces):
+        cmd += ['-map', f'[vo{i}]'] + (['-map', f'[ao{i}]'] if has_audio else [])
+        cmd += _encode_args(info) + ['-f', CHUNK_FORMAT, '-y', output_path]
+    _run(cmd)
+
+
+def _reencode_window(video_path, start, end, output_path):
+    """Fallback for codecs we can't match: frame-accurate re-encode of the whole window"""
+    cmd = ['ffmpeg', '-v', 'error', '-ss', f'{start:.6f}', '-i', video_path, '-t', f'{end - start:.6f}',
+           '-map', '0:v:0', '-map', '0:a:0?', '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '16',
+           '-c:a', 'aac', '-y', output_path]
+    _run(cmd)
+
+
+def _concat(pieces, output_path):
+    list_path = output_path + '.txt'
+    with open(list_path, 'w') as f:
+        for path in pieces:
+            f.write(f"file '{path}'\n")
+    _run(['ffmpeg', '-v', 'error', '-f', 'concat', '-safe', '0', '-i', list_path,
+          '-map', '0', '-c', 'copy', '-bsf:a', 'aac_adtstoasc', '-y', output_path])
+    os.remove(list_path)
+
+
+def cut_segments(video_path, windows, output_dir, work_dir=None):
+    """
+    Cut (name, start, end) windows out of video_path
+
+    Writes segment_<name>.mp4 per window into output_dir and returns
+    {name: path}. Intermediate chunks go to work_dir (default
+    output_dir/chunks); give concurrent cuts of one video their own.
+    Raises SegmentationError (or MediaProbeError).
+    """
+    info = probe(video_path)
+    work_dir = work_dir or os.path.join(output_dir, 'chunks')
+    os.makedirs(work_dir, exist_ok=True)
+
+    outputs = {name: os.path.join(output_dir, f'segment_{name}.mp4') for name, _, _ in windows}
+
+    if info.video.codec_name not in VIDEO_ENCODERS or (
+            _audio_codec(info) and _audio_codec(info) not in AUDIO_ENCODERS):
+        logger.warning(f"Can't smart-cut {info.video.codec_name}/{_audio_codec(info)}, re-encoding windows")
+        for name, start, end in windows:
+            _reencode_window(video_path, start, min(end, info.duration), outputs[name])
+        return outputs
+
+    tolerance = 0.5 / info.fps
+    split_times, plans = plan_cuts(windows, list(info.keyframes), info.duration, tolerance)
+    chunk_starts, pattern = _split(video_path, split_times, work_dir, info.fps)
+
+    def chunk_index(t):
+        """Chunk holding time t; split times that were dropped near 0 map to the first chunk"""
+        return max(bisect_right(chunk_starts, t + tolerance) - 1, 0)
+
+    def chunks_between(t0, t1):
+        return [pattern % i for i, t in enumerate(chunk_starts) if t0 - tolerance <= t < t1 - tolerance]
+
+    # Group boundary pieces by chunk so each GOP is decoded once
+    boundary = {}
+    pieces = {}
+    for plan in plans:
+        parts = []
+        for kind in ('head', 'body', 'tail'):
+            if plan[kind] is None:
+                continue
+            if kind == 'body':
+                parts += chunks_between(*plan['body'])
+                continue
+            gop_start, cut_from, cut_to = plan[kind]
+            index = chunk_index(gop_start)
+            piece = os.path.join(work_dir, f"{plan['name']}_{kind}{CHUNK_EXT}")
+            offset = chunk_starts[index]
+            boundary.setdefault(index, []).append((cut_from - offset, cut_to - offset, piece))
+            parts.append(piece)
+        pieces[plan['name']] = parts
+
+    with ThreadPoolExecutor(max_workers=BOUNDARY_WORKERS, thread_name_prefix='segment') as pool:
+        futures = [pool.submit(_reencode_gop, pattern % index, cuts, info) for index, cuts in boundary.items()]
+        for future in futures:
+            future.result()
+
+    for name, parts in pieces.items():
+        _concat(parts, outputs[name])
+
+    reencoded = sum(cut_to - cut_from for cuts in boundary.values() for cut_from, cut_to, _ in cuts)
+    total = sum(plan['end'] - plan['start'] for plan in plans)
+    logger.info(
+        f"Cut {len(windows)} windows in one pass: {len(split_times) + 1} chunks, "
+        f"re-encoded {reencoded:.2f}s of {total:.2f}s ({len(boundary)} boundary GOPs)"
+    )
+    return outputs
@@ -0,0 +1,179 @@
+"""
+UGC Face Swapper - Stitcher
+Joins the timeline's segments back into one video. Every segment is probed
+against the source video; segments that already match it (codec, size,
+pixel format, frame rate, length) are stream-copied and only the
+mismatched ones - typically the Wan2.2 outputs - are conformed, all in a
+single ffmpeg run. The segments' own audio is dropped and the source's
+audio track is remuxed across the whole timeline, so the picture can't
+drift against it.
+"""
+
+import os
+import time
+import logging
+import subprocess
+
+from media_probe import probe
+from segmenter import CHUNK_EXT, CHUNK_FORMAT, VIDEO_ENCODERS
+
+logger = logging.getLogger(__name__)
+
+COPY, CONFORM = 'copy', 'conform'
+
+# Reference codec when the source's can't be encoded here
+FALLBACK_CODEC = 'h264'
+
+
+class StitchError(Exception):
+    pass
+
+
+def _run(cmd):
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise StitchError(f"{cmd[0]} failed: {result.stderr[-2000:]}")
+
+
+def reference_params(info):
+    """What every segment has to look like, taken from the source video"""
+    video = info.video
+    codec = video.codec_name if video.codec_name in VIDEO_ENCODERS else FALLBACK_CODEC
+    width, height = info.display_size
+    return {
+        'codec': codec,
+        'width': width,
+        'height': height,
+        'pix_fmt': video.pix_fmt or 'yuv420p',
+        'fps': info.fps
+    }
+
+
+def mismatches(info, reference, expected_duration=None):
+    """Names of the parameters in which a segment differs from the reference"""
+    width, height = info.display_size
+    fps = reference['fps']
+    found = []
+    if info.video.codec_name != reference['codec']:
+        found.append('codec')
+    if (width, height) != (reference['width'], reference['height']):
+        found.append('size')
+    if info.rotation:
+        # Parts lose rotation metadata on the way through; render them upright
+        found.append('rotation')
+    if (info.video.pix_fmt or 'yuv420p') != reference['pix_fmt']:
+        found.append('pix_fmt')
+    if abs(info.fps - fps) >= 0.01 or info.is_vfr:
+        found.append('fps')
+    if expected_duration is not None and abs(info.duration - expected_duration) > 1.5 / fps:
+        found.append('duration')
+    return found
+
+
+def _conform_chain(reference, frames):
+    """Filter chain bringing one segment to the reference's geometry, rate and frame count"""
+    fps = reference['fps']
+    chain = [
+        f"fps={fps:.6f}",
+        f"scale={reference['width']}:{reference['height']}:flags=lanczos",
+        'setsar=1',
+        f"format={reference['pix_fmt']}"
+    ]
+    if frames:
+        # Hold the last frame if the model came back short, cut it if long
+        chain += ['tpad=stop_mode=clone:stop_duration=1', f"trim=end_frame={frames}"]
+    chain.append(f"setpts=N/({fps:.6f}*TB)")
+    return ','.join(chain)
+
+
+def _prepare_parts(segments, plan, reference, work_dir):
+    """
+    One ffmpeg run: copy matching segments, conform the rest via one
+    filter graph. Every part is written as an intermediate chunk (parameter
+    sets in-band) so parts from different encoders concatenate cleanly.
+    """
+    parts = [os.path.join(work_dir, f'stitch_{index:04d}{CHUNK_EXT}') for index in range(len(segments))]
+    graph = [
+        f"[{index}:v:0]{_conform_chain(reference, frames)}[v{index}]"
+        for index, (action, frames) in enumerate(plan) if action == CONFORM
+    ]
+
+    cmd = ['ffmpeg', '-v', 'error']
+    for path in segments:
+        cmd += ['-i', path]
+    if graph:
+        cmd += ['-filter_complex', ';'.join(graph)]
+    for index, ((action, _), part) in enumerate(zip(plan, parts)):
+        if action == CONFORM:
+            cmd += ['-map', f'[v{index}]', '-c:v', VIDEO_ENCODERS[reference['codec']],
+                    '-preset', 'veryfast', '-crf', '16', '-pix_fmt', reference['pix_fmt']]
+        else:
+            cmd += ['-map', f'{index}:v:0', '-c:v', 'copy']
+        cmd += ['-an', '-f', CHUNK_FORMAT, '-y', part]
+    _run(cmd)
+    return parts
+
+
+def stitch(segments, output_path, audio_source=None, durations=None, fragmented=False):
+    """
+    Join segments (in playback order) into output_path
+
+    audio_source is the original video: its parameters are the reference
+    and its first audio track is remuxed under the joined picture (without
+    it the reference is the first segment and the result is silent).
+    durations are the timeline lengths the segments must fill; a segment
+    whose length is off by more than a frame is conformed to it.
+    fragmented writes append-only fragmented MP4 for streaming upload.
+
+    Returns a report: {'path': 'copy' | 'conform', 'conformed': {index:
+    [mismatched params]}, 'seconds': wall time, ...}.
+    """
+    started = time.time()
+    source = probe(audio_source or segments[0])
+    reference = reference_params(source)
+    durations = durations or [None] * len(segments)
+
+    plan, conformed = [], {}
+    for index, (path, duration) in enumerate(zip(segments, durations)):
+        found = mismatches(probe(path), reference, duration)
+        if found:
+            conformed[index] = found
+            plan.append((CONFORM, round(duration * reference['fps']) if duration else None))
+        else:
+            plan.append((COPY, None))
+
+    work_dir = os.path.join(os.path.dirname(os.path.abspath(output_path)), 'stitch_parts')
+    os.makedirs(work_dir, exist_ok=True)
+    parts = _prepare_parts(segments, plan, reference, work_dir)
+
+    list_path = os.path.join(work_dir, 'concat.txt')
+    with open(list_path, 'w') as f:
+        for part in parts:
+            f.write(f"file '{part}'\n")
+
+    cmd = ['ffmpeg', '-v', 'error', '-f', 'concat', '-safe', '0', '-i', list_path]
+    if audio_source and source.has_audio:
+        cmd += ['-i', audio_source, '-map', '0:v', '-map', '1:a:0', '-t', f'{source.duration:.6f}']
+    else:
+        cmd += ['-map', '0:v']
+    cmd += ['-c', 'copy']
+    if fragmented:
+        cmd += ['-movflags', '+frag_keyframe+empty_moov+default_base_moof']
+    _run(cmd + ['-y', output_path])
+
+    for path in parts + [list_path]:
+        os.remove(path)
+    os.rmdir(work_dir)
+
+    report = {
+        'path': CONFORM if conformed else COPY,
+        'segments': len(segments),
+        'conformed': conformed,
+        'audio': 'source' if audio_source and source.has_audio else 'none',
+        'seconds': round(time.time() - started, 2)
+    }
+    logger.info(
+        f"Stitched {len(segments)} segments via {report['path']} path in {report['seconds']}s"
+        + (f", conformed {conformed}" if conformed else '')
+    )
+    return report
@@ -0,0 +1,361 @@
+"""
+UGC Face Swapper - S3 Storage
+Process-wide cached S3 client, tuned multipart uploads, progress metrics,
+ETag verification and streaming upload of a file that is still being written.
+"""
+
+import os
+import time
+import hashlib
+import logging
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+DEFAULT_TRANSFER = {
+    'multipart_threshold': 16 * MB,
+    'multipart_chunksize': 8 * MB,   # S3 minimum part size is 5 MB
+    'max_concurrency': 8,
+    'verify_checksum': False
+}
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+# ============================================
+# CLIENT + SETTINGS
+# ============================================
+
+def get_s3_client(s3_config):
+    """
+    Return a shared S3 client for these credentials/region/endpoint
+
+    Clients are thread-safe and expensive to build, so one per process.
+    """
+    key = (
+        s3_config.get('s3_access_key'),
+        s3_config.get('s3_region'),
+        s3_config.get('s3_endpoint_url')
+    )
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            settings = get_transfer_settings(s3_config)
+            session = boto3.session.Session(
+                aws_access_key_id=s3_config.get('s3_access_key'),
+                aws_secret_access_key=s3_config.get('s3_secret_key'),
+                region_name=s3_config.get('s3_region')
+            )
+            client = session.client(
+                's3',
+                endpoint_url=s3_config.get('s3_endpoint_url'),
+                config=Config(max_pool_connections=max(10, settings['max_concurrency'] * 2))
+            )
+            _clients[key] = client
+    return client
+
+
+def get_transfer_settings(s3_config):
+    """Transfer tuning from the storage config, falling back to defaults"""
+    settings = dict(DEFAULT_TRANSFER)
+    for name in DEFAULT_TRANSFER:
+        if s3_config.get(name) is not None:
+            settings[name] = s3_config[name]
+    settings['multipart_chunksize'] = max(5 * MB, int(settings['multipart_chunksize']))
+    return settings
+
+
+def get_transfer_config(s3_config):
+    settings = get_transfer_settings(s3_config)
+    return TransferConfig(
+        multipart_threshold=int(settings['multipart_threshold']),
+        multipart_chunksize=settings['multipart_chunksize'],
+        max_concurrency=int(settings['max_concurrency']),
+        use_threads=True
+    )
+
+
+def object_key(record_id, s3_config):
+    return f"{s3_config['s3_output_prefix']}{record_id}.mp4"
+
+
+def object_url(key, s3_config):
+    bucket = s3_config['s3_bucket']
+    endpoint = s3_config.get('s3_endpoint_url')
+    if endpoint:
+        return f"{endpoint.rstrip('/')}/{bucket}/{key}"
+    return f"https://{bucket}.s3.{s3_config['s3_region']}.amazonaws.com/{key}"
+
+
+# ============================================
+# PROGRESS + VERIFICATION
+# ============================================
+
+class UploadProgress:
+    """
+    boto3 Callback that tracks bytes sent and writes upload stats into metrics
+
+    boto3 calls this from its worker threads, hence the lock.
+    """
+
+    def __init__(self, total_bytes=None, metrics=None, label='upload'):
+        self.total_bytes = total_bytes
+        self.metrics = metrics if metrics is not None else {}
+        self.label = label
+        self.sent = 0
+        self.started = time.time()
+        self._next_log = 0.1
+        self._lock = threading.Lock()
+
+    def __call__(self, bytes_amount):
+        with self._lock:
+            self.sent += bytes_amount
+            self._update()
+            if self.total_bytes and self.sent / self.total_bytes >= self._next_log:
+                logger.info(f"Upload progress: {self.sent * 100 // self.total_bytes}% ({self.sent} bytes)")
+                self._next_log += 0.1
+
+    def _update(self):
+        elapsed = max(time.time() - self.started, 1e-6)
+        self.metrics[f'{self.label}_bytes'] = self.sent
+        self.metrics[f'{self.label}_seconds'] = round(elapsed, 3)
+        self.metrics[f'{self.label}_mbps'] = round(self.sent * 8 / elapsed / 1e6, 2)
+
+    def finish(self):
+        with self._lock:
+            self._update()
+        return self.metrics
+
+
+def expected_etag(part_digests, multipart=False):
+    """
+    S3 ETag for an upload made of these MD5 part digests (a multipart
+    upload of a single part still gets the "<md5>-1" form)
+    """
+    if len(part_digests) == 1 and not multipart:
+        return part_digests[0].hex()
+    combined = hashlib.md5(b''.join(part_digests)).hexdigest()
+    return f"{combined}-{len(part_digests)}"
+
+
+def file_part_digests(file_path, s3_config):
+    """MD5 digest per part, split the same way upload_file splits it"""
+    settings = get_transfer_settings(s3_config)
+    size = os.path.getsize(file_path)
+    chunk = size if size < settings['multipart_threshold'] else settings['multipart_chunksize']
+
+    digests = []
+    with open(file_path, 'rb') as f:
+        while True:
+            data = f.read(chunk or 1)
+            if not data:
+                break
+            digests.append(hashlib.md5(data).digest())
+    return digests or [hashlib.md5(b'').digest()]
+
+
+def verify_upload(client, bucket, key, part_digests, multipart=False):
+    """
+    Compare the stored object's ETag with the locally computed one
+
+    Valid for SSE-S3/unencrypted buckets (SSE-KMS ETags aren't MD5-based).
+    """
+    etag = client.head_object(Bucket=bucket, Key=key)['ETag'].strip('"')
+    expected = expected_etag(part_digests, multipart)
+    if etag != expected:
+        raise ValueError(f"Checksum mismatch for {key}: S3 has {etag}, expected {expected}")
+    logger.info(f"Checksum verified for {key} ({etag})")
+
+
+# ============================================
+# UPLOADS
+# ============================================
+
+def upload_to_s3(file_path, record_id, s3_config, metrics=None):
+    """Upload video to S3 and return public URL"""
+    try:
+        s3_client = get_s3_client(s3_config)
+        settings = get_transfer_settings(s3_config)
+
+        bucket = s3_config['s3_bucket']
+        key = object_key(record_id, s3_config)
+
+        logger.info(f"Uploading to S3: {bucket}/{key}")
+
+        progress = UploadProgress(os.path.getsize(file_path), metrics)
+        s3_client.upload_file(
+            file_path,
+            bucket,
+            key,
+            ExtraArgs={'ACL': 'public-read', 'ContentType': 'video/mp4'},
+            Config=get_transfer_config(s3_config),
+            Callback=progress
+        )
+        progress.finish()
+
+        if settings['verify_checksum']:
+            verify_upload(s3_client, bucket, key, file_part_digests(file_path, s3_config))
+
+        url = object_url(key, s3_config)
+        logger.info(f"Uploaded successfully: {url}")
+
+        return url
+
+    except (ClientError, ValueError) as e:
+        logger.error(f"S3 upload failed: {e}")
+        return None
+
+
+def upload_growing_file(file_path, record_id, s3_config, writer, metrics=None, poll_interval=0.25):
+    """
+    Multipart-upload file_path while another thread is still appending to it
+
+    writer is the concurrent.futures.Future producing the file; it must only
+    append (e.g. fragmented MP4), never seek back. Full parts are shipped as
+    soon as they exist on disk (at most max_concurrency of them in memory)
+    and the tail goes up once the writer is done.
+    Returns the public URL, or None if the writer or upload failed (the
+    multipart upload is aborted).
+    """
+    s3_client = get_s3_client(s3_config)
+    settings = get_transfer_settings(s3_config)
+    chunk = settings['multipart_chunksize']
+    bucket = s3_config['s3_bucket']
+    key = object_key(record_id, s3_config)
+
+    upload_id = None
+    progress = UploadProgress(None, metrics)
+
+    def upload_part(number, data):
+        response = s3_client.upload_part(
+            Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=data
+        )
+        progress(len(data))
+        return {'PartNumber': number, 'ETag': response['ETag']}
+
+    try:
+        logger.info(f"Streaming upload to S3: {bucket}/{key}")
+        upload_id = s3_client.create_multipart_upload(
+            Bucket=bucket, Key=key, ACL='public-read', ContentType='video/mp4'
+        )['UploadId']
+
+        futures = []
+        pending = set()
+        digests = []
+        offset = 0
+        max_pending = int(settings['max_concurrency'])
+
+        with ThreadPoolExecutor(max_workers=max_pending, thread_name_prefix='s3-part') as pool:
+            while not os.path.exists(file_path) and not writer.done():
+                time.sleep(poll_interval)
+
+            with open(file_path, 'rb') as f:
+                while True:
+                    finished = writer.done()
+                    available = os.path.getsize(file_path) - offset
+
+                    if available >= chunk or (finished and available > 0):
+                        if len(pending) >= max_pending:
+                            # S3 is behind the writer: wait rather than hold more parts in memory
+                            _, pending = wait(pending, return_when=FIRST_COMPLETED)
+                            continue
+                        # Every part but the last must be >= 5 MB, so a short
+                        # tail is folded into the final part
+                        size = available if finished and available < 2 * chunk else chunk
+                        f.seek(offset)
+                        data = f.read(size)
+                        offset += len(data)
+                        digests.append(hashlib.md5(data).digest())
+                        futures.append(pool.submit(upload_part, len(futures) + 1, data))
+                        pending.add(futures[-1])
+                        continue
+
+                    if finished:
+                        break
+                    time.sleep(poll_interval)
+
+            parts = [future.result() for future in futures]
+
+        if not writer.result():
+            raise ValueError(f"Writer for {file_path} failed")
+        if not parts:
+            raise ValueError(f"Nothing was written to {file_path}")
+
+        s3_client.complete_multipart_upload(
+            Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={'Parts': parts}
+        )
+        progress.finish()
+
+        if settings['verify_checksum']:
+            verify_upload(s3_client, bucket, key, digests, multipart=True)
+
+        url = object_url(key, s3_config)
+        logger.info(f"Uploaded successfully ({len(parts)} parts streamed): {url}")
+        return url
+
+    except Exception as e:
+        logger.error(f"S3 streaming upload failed: {e}")
+        if upload_id:
+            try:
+                s3_client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+            except ClientError:
+                pass
+        return None
+
+
+# ============================================
+# SERVER-SIDE COPIES
+# ============================================
+
+def object_info(key, s3_config):
+    """{'etag', 'size'} of an object in the output bucket, or None if it doesn't exist"""
+    try:
+        head = get_s3_client(s3_config).head_object(Bucket=s3_config['s3_bucket'], Key=key)
+    except ClientError as e:
+        logger.info(f"No object at {key}: {e}")
+        return None
+    return {'etag': head['ETag'].strip('"'), 'size': head['ContentLength']}
+
+
+def copy_object(source_key, record_id, s3_config, etag=None):
+    """
+    Server-side copy of an existing output object to record_id's key
+
+    Nothing goes through this machine; large objects are copied part by
+    part. With etag the copy only happens if the source still has that
+    ETag (so an overwritten source is never handed out). Returns the
+    public URL, or None if the source is gone/changed or the copy failed.
+    """
+    s3_client = get_s3_client(s3_config)
+    bucket = s3_config['s3_bucket']
+    key = object_key(record_id, s3_config)
+
+    if key == source_key:
+        # Same record re-sent: the object is already in place
+        info = object_info(key, s3_config)
+        if info is None or (etag and info['etag'] != etag):
+            return None
+        return object_url(key, s3_config)
+
+    extra_args = {'ACL': 'public-read', 'ContentType': 'video/mp4', 'MetadataDirective': 'REPLACE'}
+    if etag:
+        extra_args['CopySourceIfMatch'] = f'"{etag}"'
+    try:
+        logger.info(f"Server-side copy {bucket}/{source_key} -> {bucket}/{key}")
+        s3_client.copy(
+            {'Bucket': bucket, 'Key': source_key}, bucket, key,
+            ExtraArgs=extra_args, Config=get_transfer_config(s3_config)
+        )
+    except ClientError as e:
+        logger.warning(f"S3 copy of {source_key} failed: {e}")
+        return None
+    return object_url(key, s3_config)
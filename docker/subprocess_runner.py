@@ -0,0 +1,178 @@
+"""
+UGC Face Swapper - Streaming Subprocess Runner
+Runs the model CLIs without buffering their output: stdout and stderr are
+read as they arrive, logged line by line (tqdm's carriage-return redraws
+included), parsed for step/percent progress, and only the last N lines are
+kept for error reports. A soft timeout asks the process to stop with
+SIGTERM; if it is still running at the hard timeout it gets SIGKILL.
+"""
+
+import os
+import re
+import time
+import signal
+import logging
+import threading
+import subprocess
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+TAIL_LINES = 200
+
+# Grace between SIGTERM (soft timeout) and SIGKILL when no hard timeout is given
+KILL_GRACE = 15
+
+# "45%|####      | 9/20 [00:31<00:38, ...]" (tqdm), "step 9/20", "[9/20]"
+PERCENT_RE = re.compile(r'(\d{1,3}(?:\.\d+)?)%')
+STEP_RE = re.compile(r'(?:step\s*|\[|\|\s*)(\d+)\s*/\s*(\d+)', re.IGNORECASE)
+
+# Percent change that gets a log line (redraws in between are only parsed)
+LOG_EVERY_PERCENT = 10
+
+
+class SubprocessFailed(Exception):
+    def __init__(self, label, returncode, tail):
+        self.label = label
+        self.returncode = returncode
+        self.tail = tail
+        super().__init__(f"{label} failed with code {returncode}: {tail[-4000:]}")
+
+
+class SubprocessTimeout(subprocess.TimeoutExpired):
+    """Raised after the soft/hard timeout; still a subprocess.TimeoutExpired"""
+
+    def __init__(self, cmd, timeout, tail, killed):
+        super().__init__(cmd, timeout, output=tail)
+        self.tail = tail
+        self.killed = killed
+
+
+def parse_progress(line):
+    """{'percent', 'step', 'total'} found in one output line, or None"""
+    progress = {}
+    step = STEP_RE.search(line)
+    if step and 0 < int(step.group(2)):
+        progress['step'], progress['total'] = int(step.group(1)), int(step.group(2))
+    percent = PERCENT_RE.search(line)
+    if percent and float(percent.group(1)) <= 100:
+        progress['percent'] = float(percent.group(1))
+    elif 'step' in progress:
+        progress['percent'] = round(100.0 * progress['step'] / progress['total'], 1)
+    return progress or None
+
+
+class RunResult:
+    def __init__(self, returncode, tail, elapsed, progress):
+        self.returncode = returncode
+        self.tail = tail            # last TAIL_LINES lines, stdout and stderr interleaved
+        self.elapsed = elapsed
+        self.progress = progress    # last parsed progress dict (or None)
+
+
+def _lines(pipe):
+    """Decoded lines from a binary pipe, splitting on \\n and tqdm's \\r"""
+    pending = b''
+    for chunk in iter(lambda: pipe.read1(65536), b''):
+        parts = re.split(rb'[\r\n]', pending + chunk)
+        pending = parts.pop()
+        for part in parts:
+            if part.strip():
+                yield part.decode(errors='replace').rstrip()
+    if pending.strip():
+        yield pending.decode(errors='replace').rstrip()
+
+
+def run_streaming(cmd, label=None, env=None, cwd=None, soft_timeout=None, hard_timeout=None,
+                  progress=None, tail_lines=TAIL_LINES, check=True):
+    """
+    Run cmd, streaming its output into the log
+
+    progress(**fields) is called with {'stage': label, 'percent', 'step',
+    'total'} as they are parsed. After soft_timeout seconds the process gets
+    SIGTERM, after hard_timeout (default soft + KILL_GRACE) SIGKILL; either
+    raises SubprocessTimeout. With check, a non-zero exit raises
+    SubprocessFailed carrying the output tail. Returns a RunResult.
+    """
+    label = label or os.path.basename(str(cmd[0]))
+    if soft_timeout is not None and hard_timeout is None:
+        hard_timeout = soft_timeout + KILL_GRACE
+
+    started = time.time()
+    process = subprocess.Popen(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, cwd=cwd,
+        start_new_session=True  # signals reach the CLI's own children too
+    )
+    tail = deque(maxlen=tail_lines)
+    state = {'progress': None, 'logged_percent': -LOG_EVERY_PERCENT}
+    lock = threading.Lock()
+
+    def pump(pipe, stream):
+        for line in _lines(pipe):
+            parsed = parse_progress(line)
+            with lock:
+                tail.append(line)
+                if parsed:
+                    state['progress'] = parsed
+                    percent = parsed.get('percent')
+                    if percent is not None and (percent - state['logged_percent'] >= LOG_EVERY_PERCENT
+                                                or percent >= 100 > state['logged_percent']):
+                        state['logged_percent'] = percent
+                        logger.info(f"[{label}] {line}")
+                else:
+                    logger.info(f"[{label}:{stream}] {line}")
+            if parsed and progress:
+                try:
+                    progress(stage=label, **parsed)
+                except Exception as e:
+                    logger.debug(f"Progress callback failed: {e}")
+        pipe.close()
+
+    readers = [
+        threading.Thread(target=pump, args=(process.stdout, 'out'), name=f'{label}-stdout', daemon=True),
+        threading.Thread(target=pump, args=(process.stderr, 'err'), name=f'{label}-stderr', daemon=True)
+    ]
+    for reader in readers:
+        reader.start()
+
+    timed_out = killed = False
+    try:
+        process.wait(timeout=soft_timeout)
+    except subprocess.TimeoutExpired:
+        timed_out = True
+        logger.warning(f"[{label}] soft timeout after {soft_timeout}s, sending SIGTERM")
+        _signal(process, signal.SIGTERM)
+        try:
+            process.wait(timeout=max(0.0, hard_timeout - (time.time() - started)))
+        except subprocess.TimeoutExpired:
+            logger.error(f"[{label}] hard timeout after {hard_timeout}s, sending SIGKILL")
+            _signal(process, signal.SIGKILL)
+            process.wait()
+            killed = True
+    finally:
+        if process.poll() is None:
+            # Interrupted while waiting (e.g. KeyboardInterrupt) - don't leave it running
+            _signal(process, signal.SIGKILL)
+            process.wait()
+        for reader in readers:
+            reader.join(5)
+
+    with lock:
+        result = RunResult(process.returncode, '\n'.join(tail), time.time() - started, state['progress'])
+    logger.info(f"[{label}] exited with code {result.returncode} after {result.elapsed:.1f}s")
+
+    if timed_out:
+        raise SubprocessTimeout(cmd, soft_timeout, result.tail, killed)
+    if check and result.returncode != 0:
+        raise SubprocessFailed(label, result.returncode, result.tail)
+    return result
+
+
+def _signal(process, sig):
+    try:
+        os.killpg(process.pid, sig)
+    except (ProcessLookupError, PermissionError):
+        try:
+            process.send_signal(sig)
+        except ProcessLookupError:
+            pass
@@ -0,0 +1,149 @@
+"""
+UGC Face Swapper - Timeline
+A timeline is a list of {start, end, mode} windows (mode 'swap' or
+'passthrough'). Only swap windows go to the model; passthrough windows are
+stream-copied. Gaps are filled with passthrough and adjacent windows of the
+same mode are merged, so the model runs once per contiguous swap span.
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+SWAP = 'swap'
+PASSTHROUGH = 'passthrough'
+MODES = (SWAP, PASSTHROUGH)
+
+# Legacy processing.segments layout (swap_1/original_1/swap_2/original_2)
+LEGACY_SEGMENTS = (('swap_1', SWAP), ('original_1', PASSTHROUGH), ('swap_2', SWAP), ('original_2', PASSTHROUGH))
+
+# Gaps/overlaps smaller than this (seconds) are rounding, not intent
+EPSILON = 0.001
+
+
+class TimelineError(ValueError):
+    pass
+
+
+def legacy_timeline(segments_config):
+    """Timeline equivalent of the old processing.segments keys"""
+    return [
+        {'start': segments_config[f'{name}_start'], 'end': segments_config[f'{name}_end'], 'mode': mode}
+        for name, mode in LEGACY_SEGMENTS
+    ]
+
+
+def get_timeline(processing_config, timeline=None):
+    """Per-job timeline, else processing.timeline, else the legacy segments"""
+    if timeline:
+        return timeline
+    if processing_config.get('timeline'):
+        return processing_config['timeline']
+    return legacy_timeline(processing_config['segments'])
+
+
+def job_timeline(processing_config, timeline, duration):
+    """
+    build_timeline over get_timeline(processing_config, timeline)
+
+    A timeline someone wrote (per job or processing.timeline) must fit the
+    video; the legacy segment layout is a fixed default, so on a shorter
+    clip its windows past the end are dropped instead.
+    """
+    legacy = not timeline and not processing_config.get('timeline')
+    return build_timeline(get_timeline(processing_config, timeline), duration, strict=not legacy)
+
+
+def parse_windows(spec):
+    """
+    Check the shape of a timeline spec and return sorted (start, end, mode)
+
+    Doesn't need the video, so it can run when a job is submitted.
+    Raises TimelineError.
+    """
+    if not isinstance(spec, list) or not spec:
+        raise TimelineError("Timeline must be a non-empty list of {start, end, mode} windows")
+
+    windows = []
+    for index, window in enumerate(spec):
+        try:
+            start, end = float(window['start']), float(window['end'])
+        except (KeyError, TypeError, ValueError):
+            raise TimelineError(f"Window {index}: start and end must be numbers")
+        mode = window.get('mode', SWAP)
+        if mode not in MODES:
+            raise TimelineError(f"Window {index}: mode must be one of {', '.join(MODES)}, got {mode!r}")
+        if start < 0 or end <= start:
+            raise TimelineError(f"Window {index}: need 0 <= start < end, got {start}-{end}")
+        windows.append((start, end, mode))
+
+    windows.sort()
+    for (_, prev_end, _), (start, _, _) in zip(windows, windows[1:]):
+        if start < prev_end - EPSILON:
+            raise TimelineError(f"Windows overlap at {start}s")
+    return windows
+
+
+def build_timeline(spec, duration, strict=True):
+    """
+    Validate spec against the video duration and return the cut list
+
+    Windows are clamped to the duration (a window starting past the end is
+    an error, or just dropped when not strict), gaps become passthrough,
+    and touching windows of the same mode are merged. Returns
+    [(name, start, end, mode)] in playback order, covering 0..duration.
+    """
+    windows = parse_windows(spec)
+
+    clamped = []
+    for start, end, mode in windows:
+        if start >= duration - EPSILON:
+            if strict:
+                raise TimelineError(f"Window {start}-{end}s starts after the video ends ({duration:.2f}s)")
+            continue
+        clamped.append((start, min(end, duration), mode))
+
+    # Fill gaps (including before the first and after the last window)
+    filled = []
+    position = 0.0
+    for start, end, mode in clamped:
+        if start > position + EPSILON:
+            filled.append((position, start, PASSTHROUGH))
+        filled.append((max(start, position), end, mode))
+        position = end
+    if duration > position + EPSILON:
+        filled.append((position, duration, PASSTHROUGH))
+
+    merged = []
+    for start, end, mode in filled:
+        if merged and merged[-1][2] == mode:
+            merged[-1] = (merged[-1][0], end, mode)
+        else:
+            merged.append((start, end, mode))
+
+    counts = {SWAP: 0, PASSTHROUGH: 0}
+    result = []
+    for start, end, mode in merged:
+        counts[mode] += 1
+        result.append((f'{mode}_{counts[mode]}', start, end, mode))
+    return result
+
+
+def swap_seconds(timeline):
+    return sum(end - start for _, start, end, mode in timeline if mode == SWAP)
+
+
+def intersect_swaps(timeline, ranges, duration):
+    """
+    Timeline spec whose swap windows are the timeline's swap windows
+    intersected with `ranges` [(start, end)]; everything else passes through
+    """
+    spec = []
+    for _, start, end, mode in timeline:
+        if mode != SWAP:
+            continue
+        for range_start, range_end in ranges:
+            lo, hi = max(start, range_start), min(end, range_end)
+            if hi - lo > EPSILON:
+                spec.append({'start': lo, 'end': hi, 'mode': SWAP})
+    return spec or [{'start': 0.0, 'end': duration, 'mode': PASSTHROUGH}]
@@ -7,6 +7,8 @@ import cv2
 import numpy as np
 from pathlib import Path
 import logging
+from face_detector import get_face_detector
+from media_probe import probe, MediaProbeError
 
 logger = logging.getLogger(__name__)
 
@@ -22,21 +24,8 @@ def detect_face_in_image(image_path, confidence_threshold=0.6):
             logger.error(f"Failed to load image: {image_path}")
             return False
 
-        # Load pre-trained face detection model
-        face_cascade = cv2.CascadeClassifier(
-            cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
-        )
-
-        # Convert to grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-
-        # Detect faces
-        faces = face_cascade.detectMultiScale(
-            gray,
-            scaleFactor=1.1,
-            minNeighbors=5,
-            minSize=(100, 100)
-        )
+        # Shared detector - the cascade is loaded once, not per call
+        faces, _ = get_face_detector(min_neighbors=5, min_size=(100, 100)).detect(img)
 
         if len(faces) == 0:
             logger.warning(f"No face detected in {image_path}")
@@ -59,21 +48,19 @@ def validate_video_format(video_path):
     Returns (is_valid, error_message)
     """
     try:
-        cap = cv2.VideoCapture(str(video_path))
-
-        if not cap.isOpened():
+        try:
+            info = probe(video_path)
+        except MediaProbeError:
             return False, "Cannot open video file"
+        if info.video is None:
+            return False, "No video stream"
 
-        # Get video properties
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        duration = frame_count / fps if fps > 0 else 0
-        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        # Get video properties (as displayed, i.e. after rotation)
+        fps = info.fps
+        duration = info.duration
+        width, height = info.display_size
 
-        cap.release()
-
-        logger.info(f"Video properties: {width}x{height}, {fps}fps, {duration:.1f}s")
+        logger.info(f"Video properties: {width}x{height}, {fps:.2f}fps, {duration:.1f}s")
 
         # Validate duration (should be ~30 seconds)
         if duration < 25 or duration > 35:
@@ -89,25 +76,24 @@ def validate_video_format(video_path):
         return False, str(e)
 
 def get_video_info(video_path):
-    """Get detailed video information"""
+    """Get detailed video information (the full probe is media_probe.probe)"""
     try:
-        cap = cv2.VideoCapture(str(video_path))
-
-        if not cap.isOpened():
+        info = probe(video_path)
+        if info.video is None:
             return None
 
-        info = {
-            'fps': cap.get(cv2.CAP_PROP_FPS),
-            'frame_count': int(cap.get(cv2.CAP_PROP_FRAME_COUNT)),
-            'width': int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
-            'height': int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
-            'codec': int(cap.get(cv2.CAP_PROP_FOURCC)),
-            'duration': int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) / cap.get(cv2.CAP_PROP_FPS)
+        return {
+            'fps': info.fps,
+            'frame_count': info.frame_count,
+            'width': info.width,
+            'height': info.height,
+            'codec': info.video.codec_name,
+            'duration': info.duration,
+            'rotation': info.rotation,
+            'is_vfr': info.is_vfr,
+            'has_audio': info.has_audio
         }
 
-        cap.release()
-        return info
-
     except Exception as e:
         logger.error(f"Failed to get video info: {e}")
         return None
@@ -118,17 +104,19 @@ def downscale_video_if_needed(video_path, max_height=1080):
     Returns path to processed video (original or downscaled)
     """
     try:
-        info = get_video_info(video_path)
-        if not info:
+        info = probe(video_path)
+        if info.video is None:
             return video_path
 
-        if info['height'] <= max_height:
-            logger.info(f"Video height {info['height']}p is within limit")
+        # ffmpeg applies the rotation, so work in displayed dimensions
+        width, height = info.display_size
+        if height <= max_height:
+            logger.info(f"Video height {height}p is within limit")
             return video_path
 
         # Calculate new dimensions maintaining aspect ratio
-        scale_factor = max_height / info['height']
-        new_width = int(info['width'] * scale_factor)
+        scale_factor = max_height / height
+        new_width = int(width * scale_factor)
         new_height = max_height
 
         # Ensure width is even (required for some codecs)
@@ -137,7 +125,7 @@ def downscale_video_if_needed(video_path, max_height=1080):
 
         output_path = video_path.replace('.mp4', '_downscaled.mp4')
 
-        logger.info(f"Downscaling video from {info['height']}p to {new_height}p")
+        logger.info(f"Downscaling video from {height}p to {new_height}p")
 
         import subprocess
         cmd = [
@@ -0,0 +1,316 @@
+"""
+UGC Face Swapper - Webhook Dispatcher
+Delivers completion webhooks over a pooled HTTP session with exponential
+backoff. Undelivered webhooks sit in a SQLite outbox and are redelivered
+after a crash/restart. Optionally coalesces completions for the same URL:
+the first one opens a window of coalesce_interval and everything queued
+for that URL by the time it closes goes out as one batched POST (for
+batch runs).
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+SENDING = 'sending'   # claimed by one delivery attempt; nobody else posts it
+DEAD = 'dead'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    url TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    next_attempt_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at);
+"""
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Process-wide pooled session; POSTs from many threads share its connections"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=32)
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+    return _session
+
+
+def post_json(url, payload, timeout=10):
+    response = get_session().post(url, json=payload, timeout=timeout)
+    response.raise_for_status()
+
+
+class WebhookDispatcher:
+    """
+    Outbox-backed webhook delivery
+
+    send() persists first, then (unless coalescing) tries delivery right
+    away so the happy path isn't delayed; failures are retried by the
+    background thread with exponential backoff until max_attempts, after
+    which the row is kept as 'dead' for inspection. A row is claimed
+    ('sending') for the duration of each POST, however long it takes, so
+    inline and background delivery never post the same webhook twice.
+    """
+
+    def __init__(self, outbox_path, max_attempts=8, backoff=2.0, max_backoff=300,
+                 coalesce_interval=0, timeout=10, poll_interval=1.0):
+        self.outbox_path = outbox_path
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.coalesce_interval = coalesce_interval
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+
+        self.delivered = 0
+        self.failed_attempts = 0
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+        os.makedirs(os.path.dirname(os.path.abspath(outbox_path)), exist_ok=True)
+        self._db = sqlite3.connect(outbox_path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(SCHEMA)
+
+        # Rows claimed when the process died were never confirmed - send again
+        self._db.execute("UPDATE outbox SET status = ? WHERE status = ?", (PENDING, SENDING))
+        pending = self._db.execute("SELECT COUNT(*) FROM outbox WHERE status = ?", (PENDING,)).fetchone()[0]
+        if pending:
+            logger.info(f"Webhook outbox {outbox_path}: {pending} undelivered webhooks will be retried")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='webhook-dispatcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    # ============================================
+    # PUBLIC API
+    # ============================================
+
+    def send(self, url, payload):
+        """Persist a webhook and deliver it as soon as possible; returns True once queued"""
+        now = time.time()
+        # Inline delivery inserts the row already claimed, so the background
+        # thread leaves it alone until the POST has failed
+        status = PENDING if self.coalesce_interval else SENDING
+        with self._lock:
+            due_at = now
+            if self.coalesce_interval:
+                # Join the URL's open window; the first completion opens it
+                window = self._db.execute(
+                    "SELECT MIN(next_attempt_at) FROM outbox WHERE url = ? AND status = ? AND attempts = 0",
+                    (url, PENDING)
+                ).fetchone()[0]
+                due_at = window if window is not None else now + self.coalesce_interval
+            row_id = self._db.execute(
+                "INSERT INTO outbox (url, payload, status, created_at, next_attempt_at) VALUES (?, ?, ?, ?, ?)",
+                (url, json.dumps(payload), status, now, due_at)
+            ).lastrowid
+
+        if not self.coalesce_interval:
+            self._deliver([row_id], url, payload)
+        else:
+            self._wakeup.set()
+        return True
+
+    def flush(self, timeout=30):
+        """Wait until nothing deliverable is left in the outbox; returns True if drained"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self._pending_count() == 0:
+                return True
+            with self._lock:
+                # Don't wait out backoff/coalescing - make everything due now
+                self._db.execute("UPDATE outbox SET next_attempt_at = ? WHERE status = ?", (time.time(), PENDING))
+            self._wakeup.set()
+            time.sleep(min(self.poll_interval, 0.2))
+        return self._pending_count() == 0
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._db.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+        return {
+            'pending': counts.get(PENDING, 0),
+            'sending': counts.get(SENDING, 0),
+            'dead': counts.get(DEAD, 0),
+            'delivered': self.delivered,
+            'failed_attempts': self.failed_attempts,
+            'coalesce_interval': self.coalesce_interval
+        }
+
+    # ============================================
+    # DELIVERY
+    # ============================================
+
+    def _pending_count(self):
+        """Rows still to be delivered, including those being posted right now"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM outbox WHERE status IN (?, ?)", (PENDING, SENDING)
+            ).fetchone()[0]
+
+    def _deliver(self, row_ids, url, body):
+        try:
+            post_json(url, body, timeout=self.timeout)
+        except Exception as e:
+            self._failed(row_ids, e)
+            return False
+
+        with self._lock:
+            self._db.execute(
+                f"DELETE FROM outbox WHERE id IN ({','.join('?' * len(row_ids))})", tuple(row_ids)
+            )
+            self.delivered += len(row_ids)
+        logger.info(f"Webhook delivered to {url} ({len(row_ids)} completion(s))")
+        return True
+
+    def _failed(self, row_ids, error):
+        now = time.time()
+        with self._lock:
+            self.failed_attempts += 1
+            for row_id in row_ids:
+                row = self._db.execute("SELECT attempts FROM outbox WHERE id = ?", (row_id,)).fetchone()
+                if row is None:
+                    continue
+                attempts = row['attempts'] + 1
+                if attempts >= self.max_attempts:
+                    self._db.execute(
+                        "UPDATE outbox SET status = ?, attempts = ?, last_error = ? WHERE id = ?",
+                        (DEAD, attempts, str(error), row_id)
+                    )
+                    logger.error(f"Webhook {row_id} gave up after {attempts} attempts: {error}")
+                else:
+                    delay = min(self.backoff * (2 ** (attempts - 1)), self.max_backoff)
+                    self._db.execute(
+                        "UPDATE outbox SET status = ?, attempts = ?, last_error = ?, next_attempt_at = ? "
+                        "WHERE id = ?",
+                        (PENDING, attempts, str(error), now + delay, row_id)
+                    )
+                    logger.warning(f"Webhook {row_id} failed ({error}), retry {attempts} in {delay:.1f}s")
+        self._wakeup.set()
+
+    def _due(self):
+        """
+        Claim the due rows; returns them grouped by URL, oldest first
+
+        When coalescing, a URL with anything due takes all of its pending
+        rows along (retries still in backoff included), so one POST
+        carries everything queued for it.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, url, payload FROM outbox WHERE status = ? AND next_attempt_at <= ? ORDER BY id",
+                (PENDING, time.time())
+            ).fetchall()
+            if rows and self.coalesce_interval:
+                urls = sorted({row['url'] for row in rows})
+                rows = self._db.execute(
+                    f"SELECT id, url, payload FROM outbox WHERE status = ? AND url IN ({','.join('?' * len(urls))}) "
+                    "ORDER BY id",
+                    (PENDING, *urls)
+                ).fetchall()
+            if rows:
+                self._db.execute(
+                    f"UPDATE outbox SET status = ? WHERE id IN ({','.join('?' * len(rows))})",
+                    (SENDING, *(row['id'] for row in rows))
+                )
+        groups = {}
+        for row in rows:
+            groups.setdefault(row['url'], []).append((row['id'], json.loads(row['payload'])))
+        return groups
+
+    def _run(self):
+        while not self._stopping:
+            for url, entries in self._due().items():
+                if self.coalesce_interval and len(entries) > 1:
+                    body = {'batched': True, 'count': len(entries), 'items': [payload for _, payload in entries]}
+                    self._deliver([row_id for row_id, _ in entries], url, body)
+                else:
+                    for row_id, payload in entries:
+                        self._deliver([row_id], url, payload)
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+
+# ============================================
+# PROCESS-WIDE DISPATCHER
+# ============================================
+
+_dispatcher = None
+
+
+def configure_webhooks(config):
+    """
+    Start the shared dispatcher from the `webhook` config section
+
+    Without webhook.outbox_path, send_webhook posts directly (with retries).
+    """
+    global _dispatcher
+    webhook_config = (config or {}).get('webhook') or {}
+    outbox_path = webhook_config.get('outbox_path')
+    if not outbox_path or _dispatcher is not None:
+        return _dispatcher
+    try:
+        _dispatcher = WebhookDispatcher(
+            outbox_path,
+            max_attempts=webhook_config.get('max_attempts', 8),
+            backoff=webhook_config.get('backoff', 2.0),
+            coalesce_interval=webhook_config.get('coalesce_interval', 0),
+            timeout=webhook_config.get('timeout', 10)
+        ).start()
+    except sqlite3.Error as e:
+        logger.error(f"Webhook outbox unavailable, sending directly: {e}")
+        _dispatcher = None
+    return _dispatcher
+
+
+def webhook_stats():
+    return _dispatcher.stats() if _dispatcher is not None else {'outbox': False}
+
+
+def send_webhook(webhook_url, payload, attempts=3, backoff=1.0):
+    """Send completion webhook to Make.com"""
+    if _dispatcher is not None:
+        logger.info(f"Queueing webhook to {webhook_url}")
+        return _dispatcher.send(webhook_url, payload)
+
+    for attempt in range(1, attempts + 1):
+        try:
+            logger.info(f"Sending webhook to {webhook_url}")
+            post_json(webhook_url, payload)
+            logger.info("Webhook sent successfully")
+            return True
+        except Exception as e:
+            logger.error(f"Webhook failed (attempt {attempt}/{attempts}): {e}")
+            if attempt < attempts:
+                time.sleep(backoff * (2 ** (attempt - 1)))
+    return False
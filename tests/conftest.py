@@ -0,0 +1,68 @@
+"""
+Shared fixtures; the service modules live flat in docker/ and import each
+other by bare name, so that directory goes on sys.path
+"""
+
+import os
+import sys
+import time
+import threading
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'docker'))
+
+
+@pytest.fixture
+def http_server():
+    """Start a handler class on a local port; yields start(handler) -> base URL"""
+    servers = []
+
+    def start(handler):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+class Concurrency:
+    """(start, end) intervals of work that may run at once; peak is the most that overlapped"""
+
+    def __init__(self):
+        self.intervals = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def track(self):
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.add(started, time.time())
+
+    def add(self, started, ended):
+        with self._lock:
+            self.intervals.append((started, ended))
+
+    @property
+    def peak(self):
+        # ends sort before starts at the same instant, so back-to-back work doesn't count as overlap
+        events = sorted([(started, 1) for started, _ in self.intervals] + [(ended, -1) for _, ended in self.intervals])
+        active = peak = 0
+        for _, change in events:
+            active += change
+            peak = max(peak, active)
+        return peak
+
+
+@pytest.fixture
+def concurrency():
+    return Concurrency()
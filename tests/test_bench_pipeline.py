@@ -0,0 +1,322 @@
+"""
+End-to-end pipeline benchmarks (pytest-benchmark)
+
+Runs process_single_video (pod/serverless path) and process_video_job
+(segmented Flask path) against local stand-ins for everything outside the
+box: an HTTP file server for the inputs, moto for the output bucket, a
+webhook receiver and a stub Wan2.2 CLI that sleeps and copies (or
+re-encodes) the frames instead of running the model.
+
+    pytest tests/test_bench_pipeline.py --benchmark-only --benchmark-save=<name>
+    pytest tests/test_bench_pipeline.py --benchmark-only --benchmark-compare \\
+        --benchmark-compare-fail=mean:10%
+
+Each (pipeline, duration, size, concurrency) cell is one benchmark round
+of BENCH_JOBS jobs; jobs/hour and per-stage totals from the job metrics go
+into the benchmark's extra_info. The grid is small by default and widened
+with BENCH_DURATIONS (seconds), BENCH_SIZES (WxH), BENCH_CONCURRENCY
+(comma-separated), BENCH_JOBS, BENCH_STUB_SECONDS, BENCH_STUB_MODE
+(copy | reencode) and BENCH_S3_ENDPOINT (an S3-compatible endpoint with an
+existing bucket instead of moto).
+"""
+
+import os
+import sys
+import time
+import shutil
+import threading
+import statistics
+import subprocess
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler, BaseHTTPRequestHandler
+from functools import partial
+
+import cv2
+import numpy as np
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+pytestmark = pytest.mark.skipif(
+    shutil.which('ffmpeg') is None or shutil.which('ffprobe') is None, reason="ffmpeg/ffprobe not installed"
+)
+
+BUCKET = 'faceswap-bench'
+FPS = 30
+
+
+def _env_list(name, default, cast):
+    value = os.environ.get(name)
+    return [cast(item) for item in value.split(',')] if value else default
+
+
+def parse_size(text):
+    width, height = (int(v) for v in text.lower().split('x'))
+    return width, height
+
+
+PIPELINES = ['simple', 'segmented']
+DURATIONS = _env_list('BENCH_DURATIONS', [5.0], float)
+SIZES = _env_list('BENCH_SIZES', [(640, 360)], parse_size)
+CONCURRENCY = _env_list('BENCH_CONCURRENCY', [1, 2], int)
+JOBS = int(os.environ.get('BENCH_JOBS', 2))
+
+# Stands in for both preprocess_data.py and generate.py. Preprocess copies
+# the input video into the process dir, generate turns that into output.mp4.
+STUB_CLI = r'''
+import os, sys, time, shutil, argparse, subprocess
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--video_path')
+parser.add_argument('--save_path')
+parser.add_argument('--src_root_path')
+args, _ = parser.parse_known_args()
+
+seconds = float(os.environ.get('BENCH_STUB_SECONDS', '0'))
+steps = 10
+for step in range(1, steps + 1):
+    time.sleep(seconds / steps)
+    sys.stderr.write(f"\r{step * 100 // steps:3d}%| {step}/{steps}")
+    sys.stderr.flush()
+sys.stderr.write("\n")
+
+if args.video_path:
+    source, target = args.video_path, os.path.join(args.save_path, 'src_pose.mp4')
+else:
+    source, target = os.path.join(args.src_root_path, 'src_pose.mp4'), os.path.join(args.src_root_path, 'output.mp4')
+
+if os.environ.get('BENCH_STUB_MODE') == 'reencode':
+    subprocess.run(['ffmpeg', '-v', 'error', '-i', source, '-an', '-c:v', 'libx264', '-preset', 'ultrafast',
+                    '-pix_fmt', 'yuv420p', '-y', target], check=True)
+else:
+    shutil.copyfile(source, target)
+'''
+
+
+# ============================================
+# LOCAL STAND-INS
+# ============================================
+
+class _QuietFiles(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class _Webhooks(BaseHTTPRequestHandler):
+    received = 0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        type(self).received += 1
+        self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up early (probe requests, aborted ranges) are expected
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def serve(handler):
+    """Start an HTTP server on a free local port; returns (server, base_url)"""
+    server = _Server(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, name='bench-http', daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def install_stub_wan(root):
+    """Fake Wan2.2 checkout with the two CLI entry points"""
+    preprocess = os.path.join(root, 'wan', 'modules', 'animate', 'preprocess', 'preprocess_data.py')
+    os.makedirs(os.path.dirname(preprocess), exist_ok=True)
+    for path in (preprocess, os.path.join(root, 'generate.py')):
+        with open(path, 'w') as f:
+            f.write(STUB_CLI)
+    return root
+
+
+def make_video(path, duration, size, fps=FPS):
+    """Moving test pattern with a tone, encoded like typical UGC uploads"""
+    width, height = size
+    subprocess.run([
+        'ffmpeg', '-v', 'error',
+        '-f', 'lavfi', '-i', f'testsrc2=size={width}x{height}:rate={fps}:duration={duration}',
+        '-f', 'lavfi', '-i', f'sine=frequency=440:sample_rate=44100:duration={duration}',
+        '-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p', '-g', str(fps * 2),
+        '-c:a', 'aac', '-shortest', '-movflags', '+faststart', '-y', path
+    ], check=True)
+    return path
+
+
+def make_avatar(path):
+    rng = np.random.default_rng(0)
+    image = cv2.GaussianBlur(rng.integers(0, 255, (512, 512, 3), dtype=np.uint8), (15, 15), 0)
+    cv2.imwrite(path, image)
+    return path
+
+
+@pytest.fixture(scope='module')
+def s3_storage():
+    """Storage config for the output bucket: moto in-process, or BENCH_S3_ENDPOINT"""
+    import boto3
+    import storage
+
+    endpoint = os.environ.get('BENCH_S3_ENDPOINT')
+    config = {
+        'provider': 's3',
+        's3_bucket': BUCKET,
+        's3_region': 'us-east-1',
+        's3_access_key': 'bench',
+        's3_secret_key': 'bench',
+        's3_output_prefix': 'outputs/',
+        's3_endpoint_url': endpoint
+    }
+    mock = None
+    if not endpoint:
+        from moto import mock_aws
+        mock = mock_aws()
+        mock.start()
+        storage._clients.clear()
+        client = boto3.client('s3', region_name='us-east-1', aws_access_key_id='bench',
+                              aws_secret_access_key='bench')
+        client.create_bucket(Bucket=BUCKET)
+    yield config
+    if mock is not None:
+        mock.stop()
+        storage._clients.clear()
+
+
+@pytest.fixture(scope='module')
+def stand_ins(tmp_path_factory, s3_storage):
+    """Stub Wan2.2, input file server and webhook receiver shared by every cell"""
+    work_dir = tmp_path_factory.mktemp('bench')
+    files_dir = work_dir / 'files'
+    files_dir.mkdir()
+    wan_path = install_stub_wan(str(work_dir / 'Wan2.2'))
+    make_avatar(str(files_dir / 'avatar.jpg'))
+
+    file_server, files_url = serve(partial(_QuietFiles, directory=str(files_dir)))
+    webhook_server, webhook_url = serve(_Webhooks)
+    videos = {}
+
+    def video_url(duration, size):
+        name = f'src_{duration:g}s_{size[0]}x{size[1]}.mp4'
+        if name not in videos:
+            videos[name] = make_video(str(files_dir / name), duration, size)
+        return f'{files_url}/{name}'
+
+    config = {
+        'storage': s3_storage,
+        'processing': {
+            'model_path': os.path.join(wan_path, 'checkpoints'),
+            'wan_path': wan_path,
+            'wan_python': sys.executable,
+            'swap_workers': 2,
+            'gpu_slots': 1,
+            'preprocess_timeout': 600,
+            'generate_timeout': 600
+        },
+        'download': {}
+    }
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setenv('WAN_PATH', wan_path)   # process_simple's Wan2.2 lookup
+        patch.setenv('BENCH_STUB_SECONDS', os.environ.get('BENCH_STUB_SECONDS', '0.5'))
+        patch.setenv('BENCH_STUB_MODE', os.environ.get('BENCH_STUB_MODE', 'copy'))
+        yield SimpleNamespace(config=config, video_url=video_url, avatar_url=f'{files_url}/avatar.jpg',
+                              webhook_url=f'{webhook_url}/done')
+    file_server.shutdown()
+    webhook_server.shutdown()
+
+
+# ============================================
+# RUNS
+# ============================================
+
+def segmented_timeline(duration):
+    """Two swap windows with passthrough around them, like the default layout"""
+    return [
+        {'start': 0, 'end': duration * 0.25, 'mode': 'swap'},
+        {'start': duration * 0.5, 'end': duration * 0.75, 'mode': 'swap'}
+    ]
+
+
+def run_job(pipeline, index, video_url, stand_ins, duration):
+    record_id = f'bench-{pipeline}-{index}-{time.time_ns()}'
+    started = time.perf_counter()
+    if pipeline == 'simple':
+        from process_simple import process_single_video
+        result = process_single_video(record_id, video_url, stand_ins.avatar_url, stand_ins.config,
+                                      stand_ins.webhook_url)
+    else:
+        from process import process_video_job
+        result = process_video_job(record_id, video_url, stand_ins.avatar_url, stand_ins.config,
+                                   stand_ins.webhook_url, timeline=segmented_timeline(duration))
+    return time.perf_counter() - started, result
+
+
+def summarize_stages(results, video_seconds):
+    """Per-stage totals over all jobs of one cell"""
+    stages = {}
+    for result in results:
+        for name, entry in ((result.get('metrics') or {}).get('stages') or {}).items():
+            total = stages.setdefault(name, {'runs': 0, 'seconds': 0.0, 'bytes': 0, 'jobs': 0})
+            total['runs'] += entry.get('runs', 0)
+            total['seconds'] += entry.get('seconds') or 0
+            total['bytes'] += entry.get('bytes') or 0
+            total['jobs'] += 1
+
+    for total in stages.values():
+        seconds = total['seconds']
+        total['seconds'] = round(seconds, 3)
+        total['mean_seconds'] = round(seconds / total['runs'], 3) if total['runs'] else None
+        total['mb_per_s'] = round(total['bytes'] / seconds / 1e6, 2) if seconds and total['bytes'] else None
+        total['video_seconds_per_second'] = round(video_seconds * total['jobs'] / seconds, 2) if seconds else None
+    return stages
+
+
+def run_cell(pipeline, duration, concurrency, video_url, stand_ins, jobs):
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='bench-job') as pool:
+        futures = [pool.submit(run_job, pipeline, index, video_url, stand_ins, duration) for index in range(jobs)]
+        outcomes = [future.result() for future in futures]
+    wall = time.perf_counter() - started
+
+    results = [result for _, result in outcomes]
+    failed = [result.get('error') for result in results if result.get('status') != 'success']
+    latencies = [elapsed for elapsed, _ in outcomes]
+    completed = jobs - len(failed)
+    return {
+        'jobs': jobs,
+        'failed': len(failed),
+        'errors': failed[:3],
+        'jobs_per_hour': round(completed / wall * 3600, 1) if wall else None,
+        'video_seconds_per_second': round(completed * duration / wall, 3) if wall else None,
+        'latency': {
+            'mean': round(statistics.mean(latencies), 3),
+            'p50': round(statistics.median(latencies), 3),
+            'max': round(max(latencies), 3)
+        },
+        'stages': summarize_stages(results, duration)
+    }
+
+
+@pytest.mark.parametrize('concurrency', CONCURRENCY)
+@pytest.mark.parametrize('size', SIZES, ids=lambda size: f'{size[0]}x{size[1]}')
+@pytest.mark.parametrize('duration', DURATIONS, ids=lambda duration: f'{duration:g}s')
+@pytest.mark.parametrize('pipeline', PIPELINES)
+def test_pipeline_throughput(benchmark, stand_ins, pipeline, duration, size, concurrency):
+    video_url = stand_ins.video_url(duration, size)
+    benchmark.group = f'{pipeline} {duration:g}s {size[0]}x{size[1]}'
+
+    cell = benchmark.pedantic(run_cell, args=(pipeline, duration, concurrency, video_url, stand_ins, JOBS),
+                              rounds=1, iterations=1)
+
+    benchmark.extra_info.update(cell)
+    assert cell['failed'] == 0, cell['errors']
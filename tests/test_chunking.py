@@ -0,0 +1,149 @@
+import shutil
+import subprocess
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+import pytest
+
+import chunking
+from chunking import ChunkingError, plan_chunks
+
+FPS = 30
+BITS = 8
+SIZE = (BITS * 16, 32)   # each frame shows its index as black/white bars, which survive encoding
+
+needs_ffmpeg = pytest.mark.skipif(shutil.which('ffmpeg') is None, reason="ffmpeg not installed")
+
+
+@pytest.mark.parametrize('total, chunk, overlap', [
+    (300, 100, 8), (301, 100, 8), (340, 100, 8), (99, 100, 8), (1000, 240, 12)
+])
+def test_plan_covers_every_frame_once_plus_overlap(total, chunk, overlap):
+    chunks = plan_chunks(total, chunk, overlap)
+
+    assert chunks[0][0] == 0
+    assert chunks[-1][1] == total
+    for (_, end), (start, _) in zip(chunks, chunks[1:]):
+        assert end - start == overlap
+    # no tiny chunk at the end
+    assert all(end - start >= chunk // 2 for start, end in chunks)
+    assert sum(end - start for start, end in chunks) - overlap * (len(chunks) - 1) == total
+
+
+def test_plan_folds_short_remainder_into_last_chunk():
+    assert plan_chunks(310, 100, 8) == [(0, 100), (92, 192), (184, 310)]
+
+
+def test_plan_rejects_overlap_longer_than_half_a_chunk():
+    with pytest.raises(ChunkingError):
+        plan_chunks(300, 16, 8)
+
+
+def make_clip(path, frames):
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*'mp4v'), FPS, SIZE)
+    for index in range(frames):
+        frame = np.zeros((SIZE[1], SIZE[0], 3), dtype=np.uint8)
+        for bit in range(BITS):
+            if index >> bit & 1:
+                frame[:, bit * 16:(bit + 1) * 16] = 255
+        writer.write(frame)
+    writer.release()
+    return SimpleNamespace(
+        path=str(path), fps=float(FPS), frame_count=frames, duration=frames / FPS,
+        display_size=SIZE, has_audio=False
+    )
+
+
+def read_indexes(path):
+    """Frame index shown in each frame of path"""
+    cap = cv2.VideoCapture(str(path))
+    indexes = []
+    while True:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        bars = frame.reshape(SIZE[1], BITS, 16, 3).mean(axis=(0, 2, 3))
+        indexes.append(sum(1 << bit for bit in range(BITS) if bars[bit] > 128))
+    cap.release()
+    return indexes
+
+
+def run(tmp_path, monkeypatch, generator, frames=75):
+    source = make_clip(tmp_path / 'in.mp4', frames)
+    monkeypatch.setattr(chunking, 'probe', lambda path: source)
+    settings = dict(chunking.DEFAULT_SETTINGS, enabled=True, chunk_seconds=1, overlap_frames=4, retries=0)
+    output = tmp_path / 'out.mp4'
+    report = chunking.run_chunked(str(source.path), str(output), generator, str(tmp_path / 'chunks'), settings)
+    return report, read_indexes(output)
+
+
+@needs_ffmpeg
+def test_stitched_output_keeps_every_frame_in_place(tmp_path, monkeypatch):
+    report, indexes = run(tmp_path, monkeypatch, chunking.copy_generator)
+
+    assert report['chunks'] == 3
+    # identical overlaps crossfade into the same frame, so nothing is lost, doubled or shifted
+    assert indexes == list(range(75))
+
+
+@needs_ffmpeg
+def test_generator_dropping_frames_is_padded(tmp_path, monkeypatch):
+    def drops_two(chunk_path, output_path):
+        count = len(read_indexes(chunk_path))
+        subprocess.run(['ffmpeg', '-v', 'error', '-i', chunk_path, '-frames:v', str(count - 2), '-y', output_path],
+                       check=True)
+        return output_path
+
+    report, indexes = run(tmp_path, monkeypatch, drops_two)
+
+    assert len(indexes) == 75
+    # the last chunk's missing frames repeat its last good one
+    assert indexes[-3:] == [72, 72, 72]
+
+
+def flat_clip(path, frames, level):
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*'mp4v'), FPS, SIZE)
+    for _ in range(frames):
+        writer.write(np.full((SIZE[1], SIZE[0], 3), level, dtype=np.uint8))
+    writer.release()
+    return str(path)
+
+
+@needs_ffmpeg
+def test_overlap_is_crossfaded_from_one_chunk_into_the_next(tmp_path):
+    chunks = [(0, 10), (7, 17)]
+    outputs = [flat_clip(tmp_path / 'a.mp4', 10, 40), flat_clip(tmp_path / 'b.mp4', 10, 200)]
+    source = SimpleNamespace(path=str(tmp_path / 'in.mp4'), fps=float(FPS), duration=17 / FPS,
+                             display_size=SIZE, has_audio=False)
+
+    chunking.stitch(outputs, chunks, source, str(tmp_path / 'out.mp4'), chunking.DEFAULT_SETTINGS)
+
+    cap = cv2.VideoCapture(str(tmp_path / 'out.mp4'))
+    levels = []
+    while True:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        levels.append(frame.mean())
+    cap.release()
+    # 3 shared frames ramp 1/4, 2/4, 3/4 of the way; frames either side are untouched
+    ramp = [round((level - levels[0]) / (levels[-1] - levels[0]), 2) for level in levels]
+    assert len(ramp) == 17
+    assert ramp == pytest.approx([0] * 7 + [0.25, 0.5, 0.75] + [1] * 7, abs=0.03)
+
+
+def test_chunks_are_generated_at_the_source_frame_rate(tmp_path, monkeypatch):
+    import engine
+
+    calls = []
+    monkeypatch.setattr(engine, 'prepare_model_input', lambda *args: ('input.mp4', None, {}, {}))
+    monkeypatch.setattr(engine, 'generate_on_model', lambda *args, **kwargs: calls.append(kwargs) or 'out.mp4')
+    monkeypatch.setattr(engine.shutil, 'move', lambda *args: None)
+    monkeypatch.setattr(engine.chunking, 'run_chunked', lambda video, output, generate, work_dir, settings: generate(
+        str(tmp_path / 'chunk_0000.mp4'), str(tmp_path / 'chunk_0000_out.mp4')
+    ))
+
+    engine.swap_chunked('in.mp4', 'avatar.png', str(tmp_path), 'model', {}, {})
+
+    assert calls[0]['keep_fps'] is True
@@ -0,0 +1,37 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import engine
+from engine import DeviceSlots, get_device_slots
+
+
+@pytest.fixture(autouse=True)
+def fresh_slots(monkeypatch):
+    monkeypatch.setattr(engine, '_device_slots', {})
+
+
+def test_same_setting_shares_one_budget():
+    assert get_device_slots({'gpu_slots': 2}) is get_device_slots({'gpu_slots': 2, 'swap_workers': 4})
+    assert get_device_slots({'gpu_devices': [0, 1]}) is get_device_slots({'gpu_devices': ['0', '1']})
+    assert get_device_slots({'gpu_slots': 2}) is not get_device_slots({'gpu_slots': 1})
+    assert get_device_slots({}) is get_device_slots({'gpu_slots': 1})
+
+
+def test_devices_are_handed_out_one_per_slot():
+    slots = DeviceSlots.from_config({'gpu_devices': ['0', '1']})
+    with slots.acquire() as first, slots.acquire() as second:
+        assert {first, second} == {'0', '1'}
+    assert slots.size == 2
+
+
+def test_concurrent_jobs_never_exceed_the_slots(concurrency):
+    def job(_):
+        with get_device_slots({'gpu_slots': 2}).acquire(), concurrency.track():
+            time.sleep(0.02)
+
+    with ThreadPoolExecutor(6) as pool:
+        list(pool.map(job, range(12)))
+
+    assert concurrency.peak == 2
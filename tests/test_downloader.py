@@ -0,0 +1,243 @@
+import re
+import threading
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+from botocore.exceptions import ClientError
+from moto import mock_aws
+
+import storage
+import downloader
+from downloader import DownloadError
+
+BODY = bytes(range(256)) * 1024   # 256 KiB, every offset distinguishable
+
+FAST = {'retries': 3, 'backoff': 0, 'chunk_size': 4096}
+
+
+def make_handler(body=BODY, ranges=True, drops=0, status=200):
+    """
+    Serves body, honouring Range if ranges; the first `drops` body requests
+    are cut off halfway through (the 1-byte probe never is)
+    """
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        seen = []
+        clients = set()
+        lock = threading.Lock()
+        remaining_drops = drops
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            range_header = self.headers.get('Range')
+            with Handler.lock:
+                Handler.seen.append(range_header)
+                Handler.clients.add(self.client_address)
+
+            if status != 200:
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+            start, end = 0, len(body) - 1
+            match = re.match(r'bytes=(\d+)-(\d*)$', range_header or '')
+            if ranges and match:
+                start = int(match.group(1))
+                end = min(int(match.group(2)), end) if match.group(2) else end
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes {start}-{end}/{len(body)}')
+                self.send_header('Accept-Ranges', 'bytes')
+            else:
+                self.send_response(200)
+            payload = body[start:end + 1]
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+
+            with Handler.lock:
+                drop = range_header != 'bytes=0-0' and Handler.remaining_drops > 0
+                if drop:
+                    Handler.remaining_drops -= 1
+            if drop:
+                self.wfile.write(payload[:len(payload) // 2])
+                self.wfile.flush()
+                self.close_connection = True
+                return
+            self.wfile.write(payload)
+
+    return Handler
+
+
+def fetch(url, tmp_path, **settings):
+    path = str(tmp_path / 'out.bin')
+    stats = downloader.fetch(url, path, {'download': dict(FAST, **settings)})
+    with open(path, 'rb') as f:
+        return stats, f.read()
+
+
+def test_small_file_streams_in_one_request(http_server, tmp_path):
+    handler = make_handler()
+    stats, data = fetch(http_server(handler) + '/v.mp4', tmp_path)
+
+    assert data == BODY
+    assert stats['mode'] == 'stream'
+    assert handler.seen == ['bytes=0-0', None]
+
+
+def test_connections_are_reused_across_downloads(http_server, tmp_path):
+    handler = make_handler()
+    url = http_server(handler)
+    for name in ('a.mp4', 'b.mp4', 'c.mp4'):
+        fetch(f'{url}/{name}', tmp_path)
+
+    # 3 probes + 3 bodies over one keep-alive connection
+    assert len(handler.seen) == 6
+    assert len(handler.clients) == 1
+
+
+def test_session_pool_is_sized_from_connections():
+    session = downloader.get_session(dict(downloader.DEFAULT_SETTINGS, connections=12))
+
+    assert session is downloader.get_session(dict(downloader.DEFAULT_SETTINGS, connections=12))
+    assert session.get_adapter('https://example.com')._pool_maxsize == 12
+
+
+def test_large_file_splits_into_ranges(http_server, tmp_path):
+    handler = make_handler()
+    stats, data = fetch(http_server(handler) + '/v.mp4', tmp_path,
+                        range_threshold=64 * 1024, part_size=64 * 1024, connections=4)
+
+    assert data == BODY
+    assert stats['mode'] == 'ranged'
+    assert stats['connections'] == 4
+    assert sorted(handler.seen[1:]) == sorted(
+        f'bytes={start}-{start + 64 * 1024 - 1}' for start in range(0, len(BODY), 64 * 1024)
+    )
+
+
+def test_ranged_parts_resume_where_they_stopped(http_server, tmp_path):
+    handler = make_handler(drops=2)
+    stats, data = fetch(http_server(handler) + '/v.mp4', tmp_path,
+                        range_threshold=64 * 1024, part_size=64 * 1024, connections=4)
+
+    assert data == BODY
+    # 1 probe + 4 parts + 2 resumes, each resume starting mid-part
+    assert len(handler.seen) == 7
+    resumed = [r for r in handler.seen[1:] if int(r.split('=')[1].split('-')[0]) % (64 * 1024)]
+    assert len(resumed) == 2
+
+
+def test_stream_resumes_with_range(http_server, tmp_path):
+    handler = make_handler(drops=1)
+    stats, data = fetch(http_server(handler) + '/v.mp4', tmp_path)
+
+    assert data == BODY
+    assert handler.seen[:2] == ['bytes=0-0', None]
+    assert handler.seen[2].startswith('bytes=') and handler.seen[2] != 'bytes=0-'
+    assert len(handler.seen) == 3
+
+
+def test_stream_restarts_when_ranges_unsupported(http_server, tmp_path):
+    handler = make_handler(ranges=False, drops=1)
+    stats, data = fetch(http_server(handler) + '/v.mp4', tmp_path)
+
+    assert data == BODY
+    assert stats['bytes'] == len(BODY)
+    assert handler.seen == ['bytes=0-0', None, None]
+
+
+@pytest.mark.parametrize('status', [403, 404])
+def test_client_errors_fail_without_retrying(http_server, tmp_path, status):
+    handler = make_handler(status=status)
+    with pytest.raises(DownloadError):
+        fetch(http_server(handler) + '/gone.mp4', tmp_path)
+    assert len(handler.seen) == 1
+
+
+def test_retries_are_bounded(http_server, tmp_path):
+    handler = make_handler(drops=100)
+    with pytest.raises(DownloadError, match='after 3 retries'):
+        fetch(http_server(handler) + '/v.mp4', tmp_path)
+    # probe + first attempt + 3 retries
+    assert len(handler.seen) == 5
+
+
+@pytest.fixture
+def s3_config():
+    config = {
+        's3_access_key': 'testing',
+        's3_secret_key': 'testing',
+        's3_region': 'us-east-1',
+        's3_bucket': 'inputs',
+        's3_output_prefix': 'outputs/'
+    }
+    with mock_aws():
+        storage._clients.clear()
+        client = storage.get_s3_client(config)
+        client.create_bucket(Bucket='inputs')
+        client.put_object(Bucket='inputs', Key='videos/v.mp4', Body=BODY)
+        yield config
+    storage._clients.clear()
+
+
+def fail_get_object(s3_config, monkeypatch, code, status, times):
+    """The first `times` GetObject calls raise an S3 error; returns the list of calls made"""
+    client = storage.get_s3_client(s3_config)
+    get_object = client.get_object
+    calls = []
+
+    def flaky(**kwargs):
+        calls.append(kwargs['Range'])
+        if len(calls) <= times:
+            raise ClientError({'Error': {'Code': code, 'Message': code},
+                               'ResponseMetadata': {'HTTPStatusCode': status}}, 'GetObject')
+        return get_object(**kwargs)
+
+    monkeypatch.setattr(client, 'get_object', flaky)
+    return calls
+
+
+def fetch_s3(url, s3_config, tmp_path, **settings):
+    path = str(tmp_path / 'out.bin')
+    stats = downloader.fetch(url, path, {'storage': s3_config, 'download': dict(FAST, **settings)})
+    with open(path, 'rb') as f:
+        return stats, f.read()
+
+
+def test_our_bucket_is_read_with_ranged_get_object(s3_config, tmp_path):
+    stats, data = fetch_s3('s3://inputs/videos/v.mp4', s3_config, tmp_path,
+                           range_threshold=64 * 1024, part_size=64 * 1024, connections=2)
+
+    assert data == BODY
+    assert stats['mode'] == 's3-ranged'
+    assert stats['connections'] == 2
+
+
+@pytest.mark.parametrize('code, status', [('SlowDown', 503), ('InternalError', 500)])
+def test_s3_server_errors_are_retried(s3_config, tmp_path, monkeypatch, code, status):
+    calls = fail_get_object(s3_config, monkeypatch, code, status, times=2)
+
+    stats, data = fetch_s3('s3://inputs/videos/v.mp4', s3_config, tmp_path)
+
+    assert data == BODY
+    assert stats['mode'] == 's3-stream'
+    assert calls == [f'bytes=0-{len(BODY) - 1}'] * 3
+
+
+@pytest.mark.parametrize('code, status', [('AccessDenied', 403), ('NoSuchKey', 404)])
+def test_s3_client_errors_fail_without_retrying(s3_config, tmp_path, monkeypatch, code, status):
+    calls = fail_get_object(s3_config, monkeypatch, code, status, times=100)
+
+    with pytest.raises(DownloadError, match=code):
+        fetch_s3('s3://inputs/videos/v.mp4', s3_config, tmp_path)
+    assert len(calls) == 1
+
+
+def test_s3_retries_are_bounded(s3_config, tmp_path, monkeypatch):
+    calls = fail_get_object(s3_config, monkeypatch, 'SlowDown', 503, times=100)
+
+    with pytest.raises(DownloadError, match='after 3 retries'):
+        fetch_s3('s3://inputs/videos/v.mp4', s3_config, tmp_path)
+    assert len(calls) == 4
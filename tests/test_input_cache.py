@@ -0,0 +1,111 @@
+import threading
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+from input_cache import InputCache
+
+
+def make_handler(versions, honour_conditional=True, validators=True):
+    """
+    Serves versions[-1] with ETag "v<n>"; answers 304 to a matching
+    If-None-Match unless honour_conditional is off. Records (If-None-Match, status).
+    """
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        seen = []
+        lock = threading.Lock()
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            etag = f'"v{len(versions)}"'
+            conditional = self.headers.get('If-None-Match')
+            status = 304 if honour_conditional and conditional == etag else 200
+            with Handler.lock:
+                Handler.seen.append((conditional, status))
+
+            self.send_response(status)
+            if validators:
+                self.send_header('ETag', etag)
+            if status == 304:
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            body = versions[-1]
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return InputCache(str(tmp_path / 'cache'), 10 * 1024 * 1024)
+
+
+def fetch(cache, url, tmp_path, name):
+    path = tmp_path / name
+    stats = cache.fetch(url, str(path))
+    return stats, path.read_bytes()
+
+
+def test_unchanged_input_is_revalidated_with_a_304(http_server, cache, tmp_path):
+    handler = make_handler([b'video-v1' * 1000])
+    url = http_server(handler) + '/video.mp4'
+
+    first, first_data = fetch(cache, url, tmp_path, 'job1.mp4')
+    second, second_data = fetch(cache, url, tmp_path, 'job2.mp4')
+
+    assert first['cache'] == 'miss'
+    assert second['cache'] == 'hit'
+    assert second_data == first_data == b'video-v1' * 1000
+    # one download, then one conditional GET answered without a body
+    assert handler.seen == [(None, 200), ('"v1"', 304)]
+    assert (cache.hits, cache.misses, cache.stale) == (1, 1, 0)
+
+
+def test_changed_input_is_downloaded_from_the_revalidating_get(http_server, cache, tmp_path):
+    versions = [b'video-v1' * 1000]
+    handler = make_handler(versions)
+    url = http_server(handler) + '/video.mp4'
+    fetch(cache, url, tmp_path, 'job1.mp4')
+
+    versions.append(b'video-v2' * 1000)
+    stats, data = fetch(cache, url, tmp_path, 'job2.mp4')
+
+    assert stats['cache'] == 'miss'
+    assert data == b'video-v2' * 1000
+    # the 200 to the conditional GET is the download, no second request
+    assert handler.seen == [(None, 200), ('"v1"', 200)]
+    assert cache.stale == 1
+
+    stats, data = fetch(cache, url, tmp_path, 'job3.mp4')
+    assert stats['cache'] == 'hit'
+    assert data == b'video-v2' * 1000
+
+
+def test_same_etag_on_a_200_is_still_a_hit(http_server, cache, tmp_path):
+    handler = make_handler([b'avatar' * 100], honour_conditional=False)
+    url = http_server(handler) + '/avatar.png'
+    fetch(cache, url, tmp_path, 'job1.png')
+
+    stats, data = fetch(cache, url, tmp_path, 'job2.png')
+
+    assert stats['cache'] == 'hit'
+    assert data == b'avatar' * 100
+    assert handler.seen == [(None, 200), ('"v1"', 200)]
+
+
+def test_input_without_validators_is_not_cached(http_server, cache, tmp_path):
+    handler = make_handler([b'avatar' * 100], validators=False)
+    url = http_server(handler) + '/avatar.png'
+
+    first, _ = fetch(cache, url, tmp_path, 'job1.png')
+    second, data = fetch(cache, url, tmp_path, 'job2.png')
+
+    assert first['cache'] == second['cache'] == 'uncacheable'
+    assert data == b'avatar' * 100
+    assert [status for _, status in handler.seen] == [200, 200]
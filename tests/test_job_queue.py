@@ -0,0 +1,180 @@
+import time
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import job_queue
+from job_queue import JobQueue, QUEUED, RUNNING, SUCCESS, FAILED, CANCELLED, get_progress, update_progress
+
+
+@pytest.fixture
+def queues(tmp_path):
+    """make(runner=None, **kwargs) -> JobQueue on a shared journal; started only if runner is given"""
+    made = []
+
+    def make(runner=None, **kwargs):
+        queue = JobQueue(str(tmp_path / 'jobs.sqlite3'), runner or (lambda job_id, payload: None), **kwargs)
+        made.append(queue)
+        return queue.start() if runner else queue
+
+    yield make
+    for queue in made:
+        queue.stop(timeout=5)
+
+
+def succeed(job_id, payload):
+    return {'status': SUCCESS, 'job_id': job_id, 'echo': payload}
+
+
+def test_submitted_job_runs_and_duplicates_are_not_queued(queues):
+    release = threading.Event()
+
+    def runner(job_id, payload):
+        release.wait(10)
+        return succeed(job_id, payload)
+
+    queue = queues(runner)
+    job, created = queue.submit('rec1', {'video_url': 'v'})
+    assert created
+    assert job['status'] in (QUEUED, RUNNING)
+
+    again, created = queue.submit('rec1', {'video_url': 'other'})
+    assert not created
+    assert again['job_id'] == 'rec1'
+
+    release.set()
+    done = queue.wait('rec1', timeout=10)
+    assert done['status'] == SUCCESS
+    assert done['result']['echo'] == {'video_url': 'v'}
+    assert done['attempts'] == 1
+    assert queue.stats()['succeeded'] == 1
+
+
+def test_higher_priority_runs_first_then_fifo(queues):
+    order = []
+    queue = queues()
+    for job_id, priority in [('a', 0), ('b', 5), ('c', 0), ('d', 5)]:
+        queue.submit(job_id, {}, priority=priority)
+
+    assert [(job['job_id'], job['position']) for job in queue.list()] == [('b', 0), ('d', 1), ('a', 2), ('c', 3)]
+    assert queue.get('c')['position'] == 3
+
+    def runner(job_id, payload):
+        order.append(job_id)
+        return succeed(job_id, payload)
+
+    queue.runner = runner
+    queue.start()
+    for job_id in 'abcd':
+        queue.wait(job_id, timeout=10)
+    assert order == ['b', 'd', 'a', 'c']
+
+
+def test_list_does_not_query_per_job(queues):
+    queue = queues()
+    for index in range(20):
+        queue.submit(f'rec{index}', {}, priority=index % 3)
+    statements = []
+    queue._db.set_trace_callback(statements.append)
+
+    jobs = queue.list()
+
+    queue._db.set_trace_callback(None)
+    assert len(jobs) == 20
+    assert [job['position'] for job in jobs] == list(range(20))
+    assert all(job['eta_seconds'] == queue.get(job['job_id'])['eta_seconds'] for job in jobs)
+    assert len(statements) <= 3
+
+
+def test_jobs_interrupted_by_a_restart_are_recovered(queues):
+    crashed = queues(max_attempts=2)
+    crashed.submit('running', {'n': 1})
+    crashed.submit('waiting', {'n': 2})
+    with crashed._lock:
+        crashed._claim()   # 'running' starts, then the process dies
+    crashed._db.close()
+
+    ran = []
+
+    def runner(job_id, payload):
+        ran.append(job_id)
+        return succeed(job_id, payload)
+
+    restarted = queues(runner, max_attempts=2)
+    assert restarted.wait('running', timeout=10)['status'] == SUCCESS
+    assert restarted.wait('waiting', timeout=10)['status'] == SUCCESS
+    assert restarted.get('running')['attempts'] == 2
+    assert sorted(ran) == ['running', 'waiting']
+
+
+def test_job_that_keeps_killing_the_process_is_failed(queues):
+    queue = queues(max_attempts=1)
+    queue.submit('poison', {})
+    with queue._lock:
+        queue._claim()
+    queue._db.close()
+
+    restarted = queues(max_attempts=1)
+
+    job = restarted.get('poison')
+    assert job['status'] == FAILED
+    assert 'not retried' in job['error']
+
+
+def test_cancel_takes_a_queued_job_out_of_line(queues):
+    started = threading.Event()
+    release = threading.Event()
+    ran = []
+
+    def runner(job_id, payload):
+        ran.append(job_id)
+        started.set()
+        release.wait(10)
+        return succeed(job_id, payload)
+
+    queue = queues(runner)
+    queue.submit('first', {})
+    assert started.wait(10)
+    queue.submit('second', {})
+    queue.submit('third', {})
+
+    job, cancelled = queue.cancel('second')
+    assert cancelled
+    assert job['status'] == CANCELLED
+    assert queue.get('third')['position'] == 0
+
+    # the running job is left to finish
+    job, cancelled = queue.cancel('first')
+    assert not cancelled
+    assert job['status'] == RUNNING
+    assert queue.cancel('unknown') == (None, False)
+
+    release.set()
+    queue.wait('third', timeout=10)
+    time.sleep(0.05)
+    assert ran == ['first', 'third']
+    assert queue.stats()['cancelled'] == 1
+
+    # a cancelled record_id can be submitted again
+    _, created = queue.submit('second', {})
+    assert created
+    assert queue.wait('second', timeout=10)['status'] == SUCCESS
+
+
+def test_progress_of_jobs_nobody_clears_is_bounded(monkeypatch):
+    """Serverless and batch-item progress is never cleared by a queue; it expires instead"""
+    clock = [1000.0]
+    monkeypatch.setattr(job_queue, '_progress', job_queue.OrderedDict())
+    monkeypatch.setattr(job_queue, 'PROGRESS_MAX_ENTRIES', 3)
+    monkeypatch.setattr(job_queue, 'time', SimpleNamespace(time=lambda: clock[0]))
+
+    for index in range(5):
+        update_progress(f'item{index}', stage='generate', percent=index)
+    assert [get_progress(f'item{index}') is not None for index in range(5)] == [False, False, True, True, True]
+
+    clock[0] += job_queue.PROGRESS_TTL - 1
+    update_progress('item4', percent=90)
+    clock[0] += 2
+    assert get_progress('item2') is None
+    assert get_progress('item4') == {'stage': 'generate', 'percent': 90, 'updated_at': 4599.0}
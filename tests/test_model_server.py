@@ -0,0 +1,108 @@
+import os
+import time
+import textwrap
+
+import pytest
+
+from model_server import ModelServer, ModelServerError
+
+FAKE_MODEL = textwrap.dedent('''
+    import os
+    import sys
+    import time
+
+
+    class FakeModel:
+        def preprocess(self, tag=None, sleep=0, **kwargs):
+            time.sleep(sleep)
+            return {'tag': tag, 'pid': os.getpid(), 'kwargs': kwargs}
+
+        def generate(self, crash=False, modules=(), **kwargs):
+            if crash:
+                os._exit(3)
+            return [name for name in modules if name in sys.modules]
+
+
+    def load(fail=False, **kwargs):
+        if fail:
+            raise RuntimeError("checkpoint missing")
+        return FakeModel()
+''')
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    (tmp_path / 'fake_model.py').write_text(FAKE_MODEL)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    servers = []
+
+    def start(**loader_kwargs):
+        instance = ModelServer(loader='fake_model:load', loader_kwargs=loader_kwargs,
+                               startup_timeout=30, monitor_interval=0.2)
+        servers.append(instance)
+        return instance.start()
+
+    yield start
+    for instance in servers:
+        instance.stop()
+
+
+def test_requests_run_in_the_worker(server):
+    model = server()
+
+    result = model.preprocess(tag='a', keep_fps=True)
+
+    assert result['tag'] == 'a'
+    assert result['kwargs'] == {'keep_fps': True}
+    assert result['pid'] == model.health()['pid'] != os.getpid()
+    assert model.health()['requests_served'] == 1
+
+
+def test_worker_imports_no_server_module(server):
+    model = server()
+
+    loaded = model.generate(modules=['app', 'handler_pod', 'engine', 'model_server', 'job_queue', 'webhooks'])
+
+    assert loaded == []
+
+
+def test_timed_out_reply_never_reaches_the_next_caller(server):
+    model = server()
+
+    with pytest.raises(ModelServerError, match='timed out'):
+        model.call('preprocess', timeout=0.3, tag='slow', sleep=2)
+
+    assert model.preprocess(tag='next')['tag'] == 'next'
+    assert model.health()['requests_failed'] == 1
+    assert model.health()['restarts'] == 1
+
+
+def test_crashed_worker_is_respawned(server):
+    model = server()
+    first_pid = model.health()['pid']
+
+    with pytest.raises(ModelServerError):
+        model.generate(crash=True)
+
+    assert model.preprocess(tag='again')['pid'] != first_pid
+    time.sleep(0.5)
+    health = model.health()
+    assert health['state'] == 'ready'
+    assert health['restarts'] == 1
+
+
+def test_worker_dying_between_requests_is_respawned_by_the_monitor(server):
+    model = server()
+    os.kill(model.health()['pid'], 9)
+
+    deadline = time.time() + 10
+    while time.time() < deadline and not (model.is_ready() and model.health()['restarts']):
+        time.sleep(0.1)
+
+    assert model.is_ready()
+    assert model.health()['restarts'] == 1
+
+
+def test_load_failure_is_reported(server):
+    with pytest.raises(ModelServerError, match='checkpoint missing'):
+        server(fail=True)
@@ -0,0 +1,136 @@
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from pipeline import Stage, StagePipeline
+
+
+def step(name, delay=0.0):
+    def fn(job):
+        time.sleep(delay)
+        job['trail'].append(name)
+        return job
+    return fn
+
+
+@pytest.fixture
+def pipelines():
+    started = []
+
+    def start(stages):
+        pipeline = StagePipeline(stages, name='test').start()
+        started.append(pipeline)
+        return pipeline
+
+    yield start
+    for pipeline in started:
+        pipeline.stop(timeout=5)
+
+
+def test_every_job_passes_the_stages_in_order(pipelines):
+    pipeline = pipelines([
+        Stage('fetch', step('fetch', 0.01), workers=3),
+        Stage('generate', step('generate', 0.01)),
+        Stage('upload', step('upload'), workers=2)
+    ])
+
+    futures = [pipeline.submit({'id': index, 'trail': []}) for index in range(10)]
+    results = [future.result(timeout=10) for future in futures]
+
+    assert [job['id'] for job in results] == list(range(10))
+    assert all(job['trail'] == ['fetch', 'generate', 'upload'] for job in results)
+    assert pipeline.stats()['stages']['generate']['processed'] == 10
+    assert pipeline.stats()['in_flight'] == 0
+
+
+def test_single_worker_stages_keep_submission_order(pipelines):
+    finished = []
+
+    def record(job):
+        finished.append(job['id'])
+        return job
+
+    pipeline = pipelines([Stage('a', step('a', 0.005)), Stage('b', record)])
+    for future in [pipeline.submit({'id': index, 'trail': []}) for index in range(8)]:
+        future.result(timeout=10)
+
+    assert finished == list(range(8))
+
+
+def test_a_failing_stage_fails_only_that_job(pipelines):
+    def generate(job):
+        if job['id'] == 1:
+            raise RuntimeError("model crashed")
+        return step('generate')(job)
+
+    pipeline = pipelines([Stage('generate', generate), Stage('upload', step('upload'))])
+    futures = [pipeline.submit({'id': index, 'trail': []}) for index in range(3)]
+
+    with pytest.raises(RuntimeError, match='model crashed'):
+        futures[1].result(timeout=10)
+    assert futures[0].result(timeout=10)['trail'] == ['generate', 'upload']
+    assert futures[2].result(timeout=10)['trail'] == ['generate', 'upload']
+    stats = pipeline.stats()['stages']
+    assert stats['generate']['failed'] == 1
+    assert stats['upload']['processed'] == 2
+
+
+def test_full_queues_block_submission(pipelines):
+    release = threading.Event()
+
+    def generate(job):
+        release.wait(10)
+        return job
+
+    pipeline = pipelines([
+        Stage('fetch', step('fetch'), queue_size=1),
+        Stage('generate', generate, queue_size=1)
+    ])
+
+    # generate busy + its queue + fetch holding one for it + fetch's queue
+    accepted = [pipeline.submit({'trail': []}, timeout=1) for _ in range(4)]
+    with pytest.raises(queue.Full):
+        pipeline.submit({'trail': []}, timeout=0.2)
+
+    # the rejected job was never queued, so it isn't counted as in flight
+    assert pipeline.stats()['in_flight'] == 4
+
+    release.set()
+    for future in accepted:
+        future.result(timeout=10)
+    assert pipeline.stats()['stages']['fetch']['blocked_seconds'] > 0
+    assert pipeline.stats()['in_flight'] == 0
+
+
+def test_generate_steps_share_the_gpu_slots(monkeypatch, concurrency):
+    """Pipeline generate workers and a batch loop never run more models than gpu_slots"""
+    import engine
+
+    def generate_on_model(*args, **kwargs):
+        with concurrency.track():
+            time.sleep(0.02)
+        return 'out.mp4'
+
+    monkeypatch.setattr(engine, '_device_slots', {})
+    monkeypatch.setattr(engine, 'generate_on_model', generate_on_model)
+    monkeypatch.setattr(engine, 'resolve_job_config', lambda config: (None, 'model'))
+
+    def job(index):
+        return {'job_id': str(index), 'config': {}, 'processing': {'gpu_slots': 2}, 'chunked': False,
+                'video_path': 'in.mp4', 'model_input': 'in.mp4', 'avatar_path': 'avatar.png',
+                'process_dir': '/tmp', 'params': {}, 'plan': None}
+
+    pipeline = StagePipeline([Stage('generate', engine.generate_full, workers=3)]).start()
+    try:
+        futures = [pipeline.submit(job(index)) for index in range(6)]
+        with ThreadPoolExecutor(1) as batch:
+            list(batch.map(engine.generate_full, [job(index) for index in range(6, 9)]))
+        for future in futures:
+            future.result(timeout=10)
+    finally:
+        pipeline.stop(timeout=5)
+
+    assert concurrency.peak == 2
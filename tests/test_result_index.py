@@ -0,0 +1,160 @@
+import pytest
+from moto import mock_aws
+
+import engine
+import storage
+import result_index
+from result_index import ResultIndex, result_key
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    video = tmp_path / 'video.mp4'
+    avatar = tmp_path / 'avatar.png'
+    video.write_bytes(b'video' * 1000)
+    avatar.write_bytes(b'avatar')
+    return str(video), str(avatar)
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    index = ResultIndex(str(tmp_path / 'results.sqlite3'))
+    monkeypatch.setattr(engine, 'get_result_index', lambda: index)
+    return index
+
+
+@pytest.fixture
+def config():
+    storage_config = {
+        's3_access_key': 'testing',
+        's3_secret_key': 'testing',
+        's3_region': 'us-east-1',
+        's3_bucket': 'outputs',
+        's3_output_prefix': 'outputs/'
+    }
+    with mock_aws():
+        storage._clients.clear()
+        storage.get_s3_client(storage_config).create_bucket(Bucket='outputs')
+        yield {'storage': storage_config, 'processing': {'swap_workers': 2}}
+    storage._clients.clear()
+
+
+def put_output(config, record_id, body):
+    s3_config = config['storage']
+    storage.get_s3_client(s3_config).put_object(Bucket='outputs', Key=storage.object_key(record_id, s3_config),
+                                                Body=body)
+
+
+def job(record_id, inputs, config):
+    job = engine.new_job('full', record_id, 'http://videos/v.mp4', 'http://avatars/a.png', config)
+    job['video_path'], job['avatar_path'] = inputs
+    return job
+
+
+def test_key_covers_inputs_and_output_settings_only(inputs, tmp_path):
+    video, avatar = inputs
+    key = result_key(video, avatar, 'full', {'k': 7}, {'swap_workers': 2, 'normalize': {'fps': 30}})
+
+    assert result_key(video, avatar, 'full', {'k': 7}, {'swap_workers': 8, 'normalize': {'fps': 30}}) == key
+    assert result_key(video, avatar, 'full', {'k': 7}, {'normalize': {'fps': 25}}) != key
+    assert result_key(video, avatar, 'segmented', {'k': 7}, {'normalize': {'fps': 30}}) != key
+    assert result_key(video, avatar, 'full', {'k': 5}, {'normalize': {'fps': 30}}) != key
+    assert result_key(video, avatar, 'full', {'k': 7}, {'normalize': {'fps': 30}},
+                      {'timeline': [{'start': 0, 'end': 1}]}) != key
+
+    other = tmp_path / 'other.mp4'
+    other.write_bytes(b'video' * 999 + b'VIDEO')
+    assert result_key(str(other), avatar, 'full', {'k': 7}, {'normalize': {'fps': 30}}) != key
+
+
+def test_entries_survive_a_reopen(tmp_path):
+    index = ResultIndex(str(tmp_path / 'results.sqlite3'))
+    index.put('k', 'rec1', 'outputs/rec1.mp4', 'https://x/rec1.mp4', etag='e1', size=10)
+    index.hit('k')
+
+    reopened = ResultIndex(str(tmp_path / 'results.sqlite3'))
+
+    entry = reopened.get('k')
+    assert (entry['job_id'], entry['object_key'], entry['etag'], entry['hits']) == ('rec1', 'outputs/rec1.mp4', 'e1', 1)
+    reopened.forget('k')
+    assert reopened.get('k') is None
+
+
+def test_miss_claims_the_key_and_records_the_output(inputs, index, config):
+    first = engine.reuse_result(job('rec1', inputs, config))
+
+    assert not first.get('reused')
+    assert first['result_key'] in index._in_flight
+    put_output(config, 'rec1', b'swapped')
+    first['output_url'] = 'https://outputs/rec1.mp4'
+    key = first['result_key']
+    engine.release_result(first, True)
+
+    entry = index.get(key)
+    assert (entry['job_id'], entry['object_key'], entry['size']) == ('rec1', 'outputs/rec1.mp4', 7)
+    assert index.stats() == {'enabled': True, 'entries': 1, 'hits': 0, 'misses': 1, 'coalesced': 0, 'in_flight': 0}
+
+
+def test_hit_copies_the_stored_output_to_the_new_record(inputs, index, config):
+    first = engine.reuse_result(job('rec1', inputs, config))
+    put_output(config, 'rec1', b'swapped')
+    first['output_url'] = 'https://outputs/rec1.mp4'
+    engine.release_result(first, True)
+
+    second = engine.reuse_result(job('rec2', inputs, config))
+
+    assert second['reused']
+    assert second['output_url'].endswith('/outputs/rec2.mp4')
+    assert second['metrics']['reused'] == {'job_id': 'rec1', 'object_key': 'outputs/rec1.mp4'}
+    assert 'result_key' not in second
+    client = storage.get_s3_client(config['storage'])
+    assert client.get_object(Bucket='outputs', Key='outputs/rec2.mp4')['Body'].read() == b'swapped'
+    assert index.stats()['hits'] == 1
+
+
+@pytest.mark.parametrize('change', ['overwritten', 'deleted'])
+def test_entry_whose_object_changed_is_dropped_and_rerun(inputs, index, config, change):
+    first = engine.reuse_result(job('rec1', inputs, config))
+    put_output(config, 'rec1', b'swapped')
+    first['output_url'] = 'https://outputs/rec1.mp4'
+    key = first['result_key']
+    engine.release_result(first, True)
+
+    client = storage.get_s3_client(config['storage'])
+    if change == 'overwritten':
+        put_output(config, 'rec1', b'another job for rec1')
+    else:
+        client.delete_object(Bucket='outputs', Key='outputs/rec1.mp4')
+
+    second = engine.reuse_result(job('rec2', inputs, config))
+
+    assert not second.get('reused')
+    assert second['result_key'] == key
+    assert index.get(key) is None
+    assert 'Contents' not in client.list_objects_v2(Bucket='outputs', Prefix='outputs/rec2')
+    assert index.stats()['hits'] == 0
+
+
+def test_failed_leader_does_not_record_a_result(inputs, index, config):
+    first = engine.reuse_result(job('rec1', inputs, config))
+    key = first['result_key']
+    leader, future = index.claim(key)
+    assert not leader
+
+    engine.release_result(first, False)
+
+    assert future.result(timeout=1) is False
+    assert index.get(key) is None
+
+
+def test_index_is_off_unless_enabled(monkeypatch, tmp_path):
+    monkeypatch.setattr(result_index, '_index', None)
+
+    assert result_index.configure_result_index({'cache': {}}) is None
+    assert result_index.result_index_stats() == {'enabled': False}
+
+    index = result_index.configure_result_index(
+        {'cache': {'result_enabled': True, 'result_path': str(tmp_path / 'cache' / 'results.sqlite3')}}
+    )
+    assert result_index.get_result_index() is index
+    assert result_index.result_index_stats()['entries'] == 0
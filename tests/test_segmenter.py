@@ -0,0 +1,138 @@
+import os
+import shutil
+import subprocess
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+import pytest
+
+import segmenter
+from segmenter import plan_cuts
+
+FPS = 20
+BITS = 8
+SIZE = (BITS * 16, 32)   # each frame shows its index as black/white bars, which survive encoding
+
+# VFR timing: per second, frames 0-9 are 60ms apart and frames 10-19 40ms
+# apart, so the average is FPS but frame index and time drift by up to 2 frames
+VFR_PTS = "(floor(N/20)+if(lt(mod(N,20),10),mod(N,20)*0.06,0.6+(mod(N,20)-10)*0.04))/TB"
+
+needs_ffmpeg = pytest.mark.skipif(shutil.which('ffmpeg') is None, reason="ffmpeg not installed")
+
+
+def vfr_time(index):
+    second, n = divmod(index, FPS)
+    return second + (n * 0.06 if n < 10 else 0.6 + (n - 10) * 0.04)
+
+
+def make_clip(path, seconds, vfr=False):
+    """H.264 clip with a keyframe at every whole second"""
+    frames = seconds * FPS
+    cmd = ['ffmpeg', '-v', 'error', '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{SIZE[0]}x{SIZE[1]}',
+           '-r', str(FPS), '-i', '-']
+    if vfr:
+        cmd += ['-vf', f"settb=1/1000,setpts='{VFR_PTS}'", '-fps_mode', 'passthrough']
+    cmd += ['-c:v', 'libx264', '-g', str(FPS), '-keyint_min', str(FPS), '-sc_threshold', '0', '-bf', '0',
+            '-pix_fmt', 'yuv420p', '-y', str(path)]
+    raw = bytearray()
+    for index in range(frames):
+        frame = np.zeros((SIZE[1], SIZE[0], 3), dtype=np.uint8)
+        for bit in range(BITS):
+            if index >> bit & 1:
+                frame[:, bit * 16:(bit + 1) * 16] = 255
+        raw += frame.tobytes()
+    subprocess.run(cmd, input=bytes(raw), check=True)
+    return SimpleNamespace(
+        path=str(path), video=SimpleNamespace(codec_name='h264', pix_fmt='yuv420p'), audio=None,
+        fps=float(FPS), duration=float(seconds), keyframes=tuple(float(t) for t in range(seconds)), is_vfr=vfr
+    )
+
+
+def read_indexes(path):
+    """Frame index shown in each frame of path"""
+    cap = cv2.VideoCapture(str(path))
+    indexes = []
+    while True:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        bars = frame.reshape(SIZE[1], BITS, 16, 3).mean(axis=(0, 2, 3))
+        indexes.append(sum(1 << bit for bit in range(BITS) if bars[bit] > 128))
+    cap.release()
+    return indexes
+
+
+@pytest.fixture
+def cut(tmp_path, monkeypatch):
+    """cut(source, windows) -> ({name: frame indexes}, [(chunk, pieces) re-encoded])"""
+    def run(source, windows):
+        monkeypatch.setattr(segmenter, 'probe', lambda path: source)
+        reencoded = []
+        reencode_gop = segmenter._reencode_gop
+
+        def spy(chunk_path, pieces, info):
+            reencoded.append((chunk_path, [(round(a, 3), round(b, 3)) for a, b, _ in pieces]))
+            return reencode_gop(chunk_path, pieces, info)
+
+        monkeypatch.setattr(segmenter, '_reencode_gop', spy)
+        outputs = segmenter.cut_segments(source.path, windows, str(tmp_path / 'out'))
+        return {name: read_indexes(path) for name, path in outputs.items()}, reencoded
+
+    (tmp_path / 'out').mkdir()
+    return run
+
+
+def test_plan_aligns_cuts_near_keyframes():
+    splits, plans = plan_cuts([('a', 1.01, 2.0), ('b', 2.5, 4.0)], [0.0, 1.0, 2.0, 3.0, 4.0], 5.0, 0.025)
+
+    assert plans[0] == {'name': 'a', 'start': 1.01, 'end': 2.0, 'head': None, 'body': (1.0, 2.0), 'tail': None}
+    assert plans[1]['head'] == (2.0, 2.5, 3.0)
+    assert plans[1]['body'] == (3.0, 4.0)
+    assert splits == [1.0, 2.0, 3.0, 4.0]
+
+
+@needs_ffmpeg
+def test_keyframe_aligned_windows_are_only_copied(tmp_path, cut):
+    source = make_clip(tmp_path / 'in.mp4', 5)
+
+    frames, reencoded = cut(source, [('a', 1.0, 2.0), ('b', 2.0, 4.0)])
+
+    assert reencoded == []
+    assert frames['a'] == list(range(20, 40))
+    assert frames['b'] == list(range(40, 80))
+
+
+@needs_ffmpeg
+def test_partial_gops_are_reencoded_once_each(tmp_path, cut):
+    source = make_clip(tmp_path / 'in.mp4', 5)
+
+    frames, reencoded = cut(source, [('a', 0.5, 1.5), ('b', 1.5, 3.25)])
+
+    assert frames['a'] == list(range(10, 30))
+    assert frames['b'] == list(range(30, 65))
+    # GOP 1 holds a's tail and b's head and is decoded once for both
+    assert sorted((os.path.splitext(os.path.basename(path))[0], pieces) for path, pieces in reencoded) == [
+        ('chunk_0000', [(0.5, 1.0)]), ('chunk_0001', [(0.0, 0.5), (0.5, 1.0)]), ('chunk_0003', [(0.0, 0.25)])
+    ]
+
+
+@needs_ffmpeg
+def test_first_keyframe_just_after_zero_maps_to_the_first_chunk(tmp_path, cut):
+    source = make_clip(tmp_path / 'in.mp4', 3)
+    source.keyframes = (0.01, 1.0, 2.0)   # e.g. video starting a hair after the audio
+
+    frames, _ = cut(source, [('a', 0.5, 1.5)])
+
+    assert frames['a'] == list(range(10, 30))
+
+
+@needs_ffmpeg
+def test_vfr_partial_gops_are_cut_by_timestamp(tmp_path, cut):
+    source = make_clip(tmp_path / 'in.mp4', 3, vfr=True)
+
+    frames, _ = cut(source, [('a', 0.6, 1.6)])
+
+    expected = [index for index in range(3 * FPS) if 0.6 - 1e-6 <= vfr_time(index) < 1.6 - 1e-6]
+    assert expected == list(range(10, 30))
+    assert frames['a'] == expected
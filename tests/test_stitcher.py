@@ -0,0 +1,103 @@
+import shutil
+import subprocess
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+import pytest
+
+import stitcher
+from stitcher import COPY, CONFORM
+
+FPS = 20
+BITS = 8
+SIZE = (BITS * 16, 32)   # each frame shows its index as black/white bars, which survive encoding
+
+needs_ffmpeg = pytest.mark.skipif(shutil.which('ffmpeg') is None, reason="ffmpeg not installed")
+
+
+def encode(path, indexes, size=SIZE, codec='libx264'):
+    """Clip showing the given frame indexes; returns the MediaInfo-like probe result for it"""
+    raw = bytearray()
+    for index in indexes:
+        frame = np.zeros((SIZE[1], SIZE[0], 3), dtype=np.uint8)
+        for bit in range(BITS):
+            if index >> bit & 1:
+                frame[:, bit * 16:(bit + 1) * 16] = 255
+        raw += cv2.resize(frame, size, interpolation=cv2.INTER_NEAREST).tobytes()
+    subprocess.run(['ffmpeg', '-v', 'error', '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{size[0]}x{size[1]}',
+                    '-r', str(FPS), '-i', '-', '-c:v', codec, '-pix_fmt', 'yuv420p', '-y', str(path)],
+                   input=bytes(raw), check=True)
+    return SimpleNamespace(
+        path=str(path), video=SimpleNamespace(codec_name={'libx264': 'h264'}.get(codec, codec), pix_fmt='yuv420p'),
+        display_size=size, rotation=0, fps=float(FPS), is_vfr=False, duration=len(indexes) / FPS, has_audio=False
+    )
+
+
+def read_indexes(path):
+    cap = cv2.VideoCapture(str(path))
+    indexes = []
+    while True:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        bars = frame.reshape(SIZE[1], BITS, 16, 3).mean(axis=(0, 2, 3))
+        indexes.append(sum(1 << bit for bit in range(BITS) if bars[bit] > 128))
+    cap.release()
+    return indexes
+
+
+@pytest.fixture
+def probed(monkeypatch):
+    """Register clips made by encode(); stitcher.probe answers from them"""
+    infos = {}
+    monkeypatch.setattr(stitcher, 'probe', lambda path: infos[str(path)])
+
+    def add(info):
+        infos[info.path] = info
+        return info.path
+
+    return add
+
+
+def test_segments_matching_the_source_are_copied():
+    source = SimpleNamespace(video=SimpleNamespace(codec_name='h264', pix_fmt='yuv420p'), display_size=(640, 360),
+                             rotation=0, fps=30.0, is_vfr=False, duration=1.0)
+    reference = stitcher.reference_params(source)
+
+    assert stitcher.mismatches(source, reference, 1.0) == []
+    # a frame of slack on length is rounding, more than that is a short model output
+    assert stitcher.mismatches(source, reference, 1.0 + 1 / 30) == []
+    assert stitcher.mismatches(source, reference, 1.1) == ['duration']
+    rotated = SimpleNamespace(**dict(vars(source), rotation=90, display_size=(360, 640)))
+    assert stitcher.mismatches(rotated, reference) == ['size', 'rotation']
+
+
+@needs_ffmpeg
+def test_matching_segments_join_on_the_stream_copy_path(tmp_path, probed):
+    source = probed(encode(tmp_path / 'source.mp4', range(60)))
+    segments = [probed(encode(tmp_path / f'seg{n}.mp4', range(n * 20, n * 20 + 20))) for n in range(3)]
+
+    report = stitcher.stitch(segments, str(tmp_path / 'out.mp4'), audio_source=source, durations=[1.0] * 3)
+
+    assert report['path'] == COPY
+    assert report['conformed'] == {}
+    assert read_indexes(tmp_path / 'out.mp4') == list(range(60))
+
+
+@needs_ffmpeg
+def test_only_the_mismatched_segment_is_conformed_to_its_window(tmp_path, probed):
+    source = probed(encode(tmp_path / 'source.mp4', range(60)))
+    before = probed(encode(tmp_path / 'before.mp4', range(0, 20)))
+    # the "model output": another codec, twice the size, two frames short
+    swapped = probed(encode(tmp_path / 'swapped.mp4', range(20, 38), size=(SIZE[0] * 2, SIZE[1] * 2), codec='mpeg4'))
+    after = probed(encode(tmp_path / 'after.mp4', range(40, 60)))
+
+    report = stitcher.stitch([before, swapped, after], str(tmp_path / 'out.mp4'), audio_source=source,
+                             durations=[1.0, 1.0, 1.0])
+
+    assert report['path'] == CONFORM
+    assert report['conformed'] == {1: ['codec', 'size', 'duration']}
+    indexes = read_indexes(tmp_path / 'out.mp4')
+    # copied neighbours keep every frame; the short segment holds its last frame to fill its window
+    assert indexes == list(range(0, 38)) + [37, 37] + list(range(40, 60))
@@ -0,0 +1,150 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from moto import mock_aws
+
+import storage
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def s3_config():
+    config = {
+        's3_access_key': 'testing',
+        's3_secret_key': 'testing',
+        's3_region': 'us-east-1',
+        's3_bucket': 'outputs',
+        's3_output_prefix': 'outputs/',
+        'multipart_chunksize': 5 * MB,
+        'verify_checksum': True
+    }
+    with mock_aws():
+        storage._clients.clear()
+        storage.get_s3_client(config).create_bucket(Bucket='outputs')
+        yield config
+    storage._clients.clear()
+
+
+def stored(config, record_id):
+    client = storage.get_s3_client(config)
+    return client.get_object(Bucket='outputs', Key=f'outputs/{record_id}.mp4')['Body'].read()
+
+
+def write_slowly(path, data, step=MB, fail=False, hold=None):
+    """
+    Append data to path a step at a time, like an encoder would; hold() is
+    polled before writing past the first 6 MB
+    """
+    with open(path, 'wb') as f:
+        for offset in range(0, len(data), step):
+            if offset == 6 * MB and hold:
+                hold()
+            f.write(data[offset:offset + step])
+            f.flush()
+            time.sleep(0.01)
+    if fail:
+        raise RuntimeError("encoder died")
+    return True
+
+
+def test_growing_file_streams_parts_while_written(s3_config, tmp_path, monkeypatch):
+    path = str(tmp_path / 'out.mp4')
+    data = os.urandom(12 * MB + 12345)
+    metrics = {}
+    client = storage.get_s3_client(s3_config)
+    part_uploaded = threading.Event()
+    upload_part = client.upload_part
+
+    def recording_upload_part(**kwargs):
+        response = upload_part(**kwargs)
+        part_uploaded.set()
+        return response
+
+    def first_part_uploaded():
+        assert part_uploaded.wait(10), "No part was uploaded while the file was still being written"
+
+    monkeypatch.setattr(client, 'upload_part', recording_upload_part)
+    with ThreadPoolExecutor(1) as pool:
+        writer = pool.submit(write_slowly, path, data, hold=first_part_uploaded)
+        url = storage.upload_growing_file(path, 'rec1', s3_config, writer, metrics, poll_interval=0.01)
+        assert writer.result()
+
+    assert url.endswith('/outputs/rec1.mp4')
+    assert stored(s3_config, 'rec1') == data
+    assert metrics['upload_bytes'] == len(data)
+
+
+def test_small_growing_file_is_one_part(s3_config, tmp_path):
+    path = str(tmp_path / 'out.mp4')
+    data = os.urandom(MB // 2)
+
+    with ThreadPoolExecutor(1) as pool:
+        writer = pool.submit(write_slowly, path, data, step=64 * 1024)
+        url = storage.upload_growing_file(path, 'rec2', s3_config, writer, poll_interval=0.01)
+
+    assert url is not None
+    assert stored(s3_config, 'rec2') == data
+
+
+def test_failed_writer_aborts_the_upload(s3_config, tmp_path):
+    path = str(tmp_path / 'out.mp4')
+
+    with ThreadPoolExecutor(1) as pool:
+        writer = pool.submit(write_slowly, path, os.urandom(6 * MB), fail=True)
+        url = storage.upload_growing_file(path, 'rec3', s3_config, writer, poll_interval=0.01)
+
+    client = storage.get_s3_client(s3_config)
+    assert url is None
+    assert 'Contents' not in client.list_objects_v2(Bucket='outputs')
+    assert not client.list_multipart_uploads(Bucket='outputs').get('Uploads')
+
+
+def test_upload_matches_expected_etag(s3_config, tmp_path):
+    path = tmp_path / 'out.mp4'
+    path.write_bytes(os.urandom(3 * MB))
+
+    url = storage.upload_to_s3(str(path), 'rec4', s3_config)
+
+    assert url is not None
+    assert stored(s3_config, 'rec4') == path.read_bytes()
+
+
+def test_outstanding_parts_are_capped(s3_config, tmp_path, monkeypatch, concurrency):
+    """A slow S3 makes the uploader wait instead of reading every part into memory"""
+    path = tmp_path / 'out.mp4'
+    data = os.urandom(30 * MB)
+    path.write_bytes(data)
+    client = storage.get_s3_client(s3_config)
+    upload_part = client.upload_part
+    parts_read = []
+
+    def slow_upload_part(**kwargs):
+        with concurrency.track():
+            time.sleep(0.1)
+            return upload_part(**kwargs)
+
+    class CountingPool(ThreadPoolExecutor):
+        """Parts submitted and not yet uploaded, sampled at each submit"""
+
+        def submit(self, fn, *args):
+            future = super().submit(fn, *args)
+            parts_read.append(future)
+            outstanding = sum(1 for part in parts_read if not part.done())
+            assert outstanding <= 2, f"{outstanding} parts held in memory"
+            return future
+
+    monkeypatch.setattr(client, 'upload_part', slow_upload_part)
+    monkeypatch.setattr(storage, 'ThreadPoolExecutor', CountingPool)
+    with ThreadPoolExecutor(1) as pool:
+        writer = pool.submit(lambda: True)
+        url = storage.upload_growing_file(str(path), 'rec5', dict(s3_config, max_concurrency=2), writer,
+                                          poll_interval=0.01)
+
+    assert url is not None
+    assert stored(s3_config, 'rec5') == data
+    assert len(parts_read) == 6
+    assert concurrency.peak == 2
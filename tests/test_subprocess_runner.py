@@ -0,0 +1,78 @@
+import sys
+
+import pytest
+
+from subprocess_runner import SubprocessFailed, SubprocessTimeout, parse_progress, run_streaming
+
+
+@pytest.mark.parametrize('line, expected', [
+    (' 45%|####      | 9/20 [00:31<00:38,  3.51s/it]', {'percent': 45.0, 'step': 9, 'total': 20}),
+    ('100%|##########| 20/20 [01:10<00:00,  3.50s/it]', {'percent': 100.0, 'step': 20, 'total': 20}),
+    ('sampling step 5/20', {'percent': 25.0, 'step': 5, 'total': 20}),
+    ('[3/4] decoding', {'percent': 75.0, 'step': 3, 'total': 4}),
+    ('Preprocess 37.5%', {'percent': 37.5}),
+])
+def test_parse_progress(line, expected):
+    assert parse_progress(line) == expected
+
+
+@pytest.mark.parametrize('line', [
+    'Loading checkpoint shards from /models/Wan2.2',
+    'saved to 2024/10/01/output.mp4',
+    'CFG scale 250%',
+    'step 0/0',
+])
+def test_lines_without_progress(line):
+    assert parse_progress(line) is None
+
+
+def python(code):
+    return [sys.executable, '-u', '-c', code]
+
+
+def test_tqdm_redraws_reach_the_callback():
+    updates = []
+    code = (
+        "import sys, time\n"
+        "for step in range(1, 5):\n"
+        "    sys.stderr.write(f'\\r{step * 25}%|##| {step}/4 [00:01<00:01]'); sys.stderr.flush()\n"
+        "    time.sleep(0.01)\n"
+        "print('done')\n"
+    )
+    result = run_streaming(python(code), label='generate', progress=lambda **fields: updates.append(fields))
+
+    assert result.returncode == 0
+    assert [update['step'] for update in updates] == [1, 2, 3, 4]
+    assert updates[-1] == {'stage': 'generate', 'percent': 100.0, 'step': 4, 'total': 4}
+    assert result.progress == {'percent': 100.0, 'step': 4, 'total': 4}
+    assert result.tail.splitlines()[-1] in ('done', '100%|##| 4/4 [00:01<00:01]')
+
+
+def test_failure_carries_the_output_tail():
+    code = "import sys\nfor i in range(50): print(f'line {i}')\nsys.exit(3)\n"
+    with pytest.raises(SubprocessFailed) as failure:
+        run_streaming(python(code), label='preprocess', tail_lines=5)
+
+    assert failure.value.returncode == 3
+    assert failure.value.tail.splitlines() == [f'line {i}' for i in range(45, 50)]
+
+
+def test_soft_timeout_terminates():
+    with pytest.raises(SubprocessTimeout) as timeout:
+        run_streaming(python("import time\nprint('started')\ntime.sleep(30)\n"), soft_timeout=0.5)
+
+    assert not timeout.value.killed
+    assert 'started' in timeout.value.tail
+
+
+def test_hard_timeout_kills_a_process_ignoring_sigterm():
+    code = (
+        "import signal, time\n"
+        "signal.signal(signal.SIGTERM, signal.SIG_IGN)\n"
+        "print('ignoring', flush=True)\n"
+        "time.sleep(30)\n"
+    )
+    with pytest.raises(SubprocessTimeout) as timeout:
+        run_streaming(python(code), soft_timeout=0.5, hard_timeout=1.0)
+
+    assert timeout.value.killed
@@ -0,0 +1,117 @@
+import os
+import sys
+import time
+import textwrap
+
+import pytest
+
+import engine
+from timeline import PASSTHROUGH, SWAP
+
+# Wan2.2 CLI stand-ins: preprocess copies the clip, generate sleeps and
+# copies it to the output, logging when it ran
+STUB_PREPROCESS = textwrap.dedent('''
+    import os, shutil, argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--video_path')
+    parser.add_argument('--save_path')
+    args, _ = parser.parse_known_args()
+    shutil.copyfile(args.video_path, os.path.join(args.save_path, 'src_pose.mp4'))
+''')
+
+STUB_GENERATE = textwrap.dedent('''
+    import os, time, shutil, argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--src_root_path')
+    args, _ = parser.parse_known_args()
+    started = time.time()
+    time.sleep(float(os.environ['STUB_SECONDS']))
+    shutil.copyfile(os.path.join(args.src_root_path, 'src_pose.mp4'), os.path.join(args.src_root_path, 'output.mp4'))
+    with open(os.environ['STUB_LOG'], 'a') as log:
+        log.write(f"{started} {time.time()}\\n")
+''')
+
+WINDOWS = [
+    ('swap_1', 0.0, 5.0, SWAP),
+    ('passthrough_1', 5.0, 15.0, PASSTHROUGH),
+    ('swap_2', 15.0, 20.0, SWAP),
+    ('passthrough_2', 20.0, 25.0, PASSTHROUGH),
+    ('swap_3', 25.0, 30.0, SWAP)
+]
+
+
+@pytest.fixture
+def stub_wan(tmp_path, monkeypatch):
+    root = tmp_path / 'Wan2.2'
+    preprocess = root / 'wan' / 'modules' / 'animate' / 'preprocess' / 'preprocess_data.py'
+    preprocess.parent.mkdir(parents=True)
+    preprocess.write_text(STUB_PREPROCESS)
+    (root / 'generate.py').write_text(STUB_GENERATE)
+    monkeypatch.setenv('STUB_SECONDS', '0.4')
+    monkeypatch.setenv('STUB_LOG', str(tmp_path / 'generate.log'))
+    monkeypatch.setattr(engine, '_device_slots', {})
+    return root
+
+
+def segmented_job(tmp_path, stub_wan, gpu_slots):
+    video = tmp_path / 'input_video.mp4'
+    video.write_bytes(b'source')
+    (tmp_path / 'avatar.png').write_bytes(b'avatar')
+    segments = []
+    for name, _, _, mode in WINDOWS:
+        path = None
+        if mode == SWAP:
+            path = tmp_path / f'segment_{name}.mp4'
+            path.write_bytes(name.encode())
+        segments.append(str(path) if path else None)
+    processing = {'wan_path': str(stub_wan), 'wan_python': sys.executable, 'model_path': str(tmp_path / 'model'),
+                  'gpu_slots': gpu_slots, 'swap_workers': 3}
+    return {'job_id': 'job', 'config': {'processing': processing}, 'processing': processing, 'metrics': {},
+            'video_path': str(video), 'avatar_path': str(tmp_path / 'avatar.png'),
+            'windows': list(WINDOWS), 'segments': segments}
+
+
+def generate_runs(tmp_path):
+    with open(tmp_path / 'generate.log') as log:
+        return [tuple(float(v) for v in line.split()) for line in log]
+
+
+@pytest.mark.parametrize('gpu_slots', [1, 2])
+def test_swaps_overlap_within_the_slot_budget(tmp_path, stub_wan, monkeypatch, concurrency, gpu_slots):
+    cuts = []
+
+    def segment_video(video_path, timeline, work_name='chunks'):
+        started = time.time()
+        time.sleep(0.2)
+        paths = []
+        for name, _, _, _ in timeline:
+            path = os.path.join(os.path.dirname(video_path), f'segment_{name}.mp4')
+            with open(path, 'wb') as f:
+                f.write(name.encode())
+            paths.append(path)
+        cuts.append((started, [name for name, _, _, _ in timeline]))
+        return paths
+
+    monkeypatch.setattr(engine, 'segment_video', segment_video)
+    monkeypatch.setattr(engine, 'probe', lambda path: None)
+
+    job = engine.swap_segments(segmented_job(tmp_path, stub_wan, gpu_slots))
+
+    # every window filled in, swaps replaced by the model's output, in playback order
+    assert [os.path.basename(path) for path in job['segments']] == [
+        'segment_swap_1_swapped.mp4', 'segment_passthrough_1.mp4', 'segment_swap_2_swapped.mp4',
+        'segment_passthrough_2.mp4', 'segment_swap_3_swapped.mp4'
+    ]
+    with open(job['segments'][2], 'rb') as f:
+        assert f.read() == b'swap_2'
+
+    runs = generate_runs(tmp_path)
+    assert len(runs) == 3
+    for started, ended in runs:
+        concurrency.add(started, ended)
+    assert concurrency.peak == gpu_slots
+
+    # the passthrough cut ran while the first swaps were on the GPU
+    (cut_start, names), = cuts
+    assert names == ['passthrough_1', 'passthrough_2']
+    assert cut_start < min(ended for _, ended in runs)
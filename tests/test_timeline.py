@@ -0,0 +1,95 @@
+import pytest
+
+from timeline import (PASSTHROUGH, SWAP, TimelineError, build_timeline, intersect_swaps, job_timeline,
+                      parse_windows, swap_seconds)
+
+SEGMENTS = {
+    'swap_1_start': 0, 'swap_1_end': 5,
+    'original_1_start': 5, 'original_1_end': 15,
+    'swap_2_start': 15, 'swap_2_end': 20,
+    'original_2_start': 20, 'original_2_end': 30
+}
+
+
+def test_gaps_become_passthrough_and_cover_the_video():
+    timeline = build_timeline([{'start': 2, 'end': 4}, {'start': 6, 'end': 8}], 10)
+
+    assert timeline == [
+        ('passthrough_1', 0.0, 2.0, PASSTHROUGH),
+        ('swap_1', 2.0, 4.0, SWAP),
+        ('passthrough_2', 4.0, 6.0, PASSTHROUGH),
+        ('swap_2', 6.0, 8.0, SWAP),
+        ('passthrough_3', 8.0, 10.0, PASSTHROUGH)
+    ]
+    assert swap_seconds(timeline) == 4.0
+
+
+def test_touching_windows_of_one_mode_are_merged():
+    timeline = build_timeline([
+        {'start': 0, 'end': 3}, {'start': 3, 'end': 5}, {'start': 5, 'end': 7, 'mode': PASSTHROUGH}
+    ], 7)
+
+    assert timeline == [('swap_1', 0.0, 5.0, SWAP), ('passthrough_1', 5.0, 7.0, PASSTHROUGH)]
+
+
+def test_legacy_layout_maps_to_alternating_windows():
+    timeline = job_timeline({'segments': SEGMENTS}, None, 30)
+
+    assert [(name, start, end) for name, start, end, _ in timeline] == [
+        ('swap_1', 0, 5), ('passthrough_1', 5, 15), ('swap_2', 15, 20), ('passthrough_2', 20, 30)
+    ]
+
+
+def test_legacy_layout_on_a_short_clip_drops_windows_past_the_end():
+    timeline = job_timeline({'segments': SEGMENTS}, None, 12)
+
+    assert timeline == [('swap_1', 0, 5, SWAP), ('passthrough_1', 5, 12.0, PASSTHROUGH)]
+
+
+def test_legacy_layout_on_a_clip_shorter_than_the_first_swap():
+    assert job_timeline({'segments': SEGMENTS}, None, 3.5) == [('swap_1', 0, 3.5, SWAP)]
+
+
+def test_requested_timeline_must_fit_the_video():
+    spec = [{'start': 0, 'end': 5}, {'start': 15, 'end': 20}]
+
+    with pytest.raises(TimelineError, match='starts after the video ends'):
+        job_timeline({'segments': SEGMENTS}, spec, 12)
+
+    # a window running past the end is clamped, not rejected
+    assert job_timeline({}, [{'start': 8, 'end': 20}], 12)[-1] == ('swap_1', 8.0, 12, SWAP)
+
+
+def test_processing_timeline_is_used_without_a_job_timeline():
+    processing = {'timeline': [{'start': 1, 'end': 2}], 'segments': SEGMENTS}
+
+    assert job_timeline(processing, None, 3) == [
+        ('passthrough_1', 0.0, 1.0, PASSTHROUGH), ('swap_1', 1.0, 2.0, SWAP), ('passthrough_2', 2.0, 3, PASSTHROUGH)
+    ]
+
+
+@pytest.mark.parametrize('spec, message', [
+    ([], 'non-empty'),
+    ([{'start': 'x', 'end': 2}], 'must be numbers'),
+    ([{'start': 1, 'end': 2, 'mode': 'blur'}], 'mode must be'),
+    ([{'start': 2, 'end': 1}], 'start < end'),
+    ([{'start': 0, 'end': 3}, {'start': 2, 'end': 4}], 'overlap')
+])
+def test_bad_specs_are_rejected(spec, message):
+    with pytest.raises(TimelineError, match=message):
+        parse_windows(spec)
+
+
+def test_rounding_gaps_are_not_turned_into_windows():
+    timeline = build_timeline([{'start': 0, 'end': 4.9995}, {'start': 5, 'end': 10}], 10.0004)
+
+    assert timeline == [('swap_1', 0.0, 10.0, SWAP)]
+
+
+def test_intersect_swaps_keeps_only_swaps_inside_the_ranges():
+    timeline = build_timeline([{'start': 0, 'end': 5}, {'start': 15, 'end': 20}], 30)
+
+    spec = intersect_swaps(timeline, [(3, 17)], 30)
+
+    assert spec == [{'start': 3, 'end': 5, 'mode': SWAP}, {'start': 15, 'end': 17, 'mode': SWAP}]
+    assert intersect_swaps(timeline, [(6, 14)], 30) == [{'start': 0.0, 'end': 30, 'mode': PASSTHROUGH}]
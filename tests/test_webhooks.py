@@ -0,0 +1,116 @@
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+from webhooks import WebhookDispatcher
+
+
+def make_handler(initial_status=200):
+    """Records every accepted JSON body with the time it arrived; answers Handler.status"""
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        posts = []
+        status = initial_status
+        lock = threading.Lock()
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            if Handler.status == 200:
+                with Handler.lock:
+                    Handler.posts.append((time.time(), body))
+            self.send_response(Handler.status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+    return Handler
+
+
+@pytest.fixture
+def dispatchers(tmp_path):
+    started = []
+
+    def start(**kwargs):
+        dispatcher = WebhookDispatcher(str(tmp_path / 'outbox.sqlite3'), poll_interval=0.02, **kwargs).start()
+        started.append(dispatcher)
+        return dispatcher
+
+    yield start
+    for dispatcher in started:
+        dispatcher.stop(timeout=5)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline and not condition():
+        time.sleep(0.02)
+    return condition()
+
+
+def test_without_coalescing_each_completion_is_posted_inline(http_server, dispatchers):
+    handler = make_handler()
+    url = http_server(handler) + '/hook'
+    dispatcher = dispatchers()
+
+    for index in range(3):
+        dispatcher.send(url, {'record_id': index})
+
+    assert [body for _, body in handler.posts] == [{'record_id': 0}, {'record_id': 1}, {'record_id': 2}]
+    assert dispatcher.stats()['delivered'] == 3
+
+
+def test_staggered_completions_share_one_window(http_server, dispatchers):
+    handler = make_handler()
+    url = http_server(handler) + '/hook'
+    other_url = http_server(make_handler()) + '/other'
+    dispatcher = dispatchers(coalesce_interval=0.6)
+
+    opened = time.time()
+    for index in range(4):
+        dispatcher.send(url, {'record_id': index})
+        time.sleep(0.1)
+    dispatcher.send(other_url, {'record_id': 'elsewhere'})
+
+    assert wait_for(lambda: dispatcher.stats()['delivered'] == 5)
+    (posted_at, body), = handler.posts
+    assert body['batched'] is True
+    assert [item['record_id'] for item in body['items']] == [0, 1, 2, 3]
+    # the window closed interval after the first completion, not the last
+    assert posted_at - opened < 0.6 + 0.3
+
+
+def test_completions_after_a_window_closes_open_a_new_one(http_server, dispatchers):
+    handler = make_handler()
+    url = http_server(handler) + '/hook'
+    dispatcher = dispatchers(coalesce_interval=0.2)
+
+    dispatcher.send(url, {'record_id': 'a'})
+    dispatcher.send(url, {'record_id': 'b'})
+    assert wait_for(lambda: len(handler.posts) == 1)
+    dispatcher.send(url, {'record_id': 'c'})
+    assert wait_for(lambda: len(handler.posts) == 2)
+
+    assert [item['record_id'] for item in handler.posts[0][1]['items']] == ['a', 'b']
+    assert handler.posts[1][1] == {'record_id': 'c'}
+
+
+def test_undelivered_webhooks_survive_a_restart(http_server, tmp_path):
+    handler = make_handler(initial_status=503)
+    url = http_server(handler) + '/hook'
+    crashed = WebhookDispatcher(str(tmp_path / 'outbox.sqlite3'), max_attempts=5, backoff=60)
+    crashed.send(url, {'record_id': 'r1'})
+    assert crashed.stats()['pending'] == 1
+    crashed._db.close()
+
+    handler.status = 200
+    restarted = WebhookDispatcher(str(tmp_path / 'outbox.sqlite3'), poll_interval=0.02).start()
+    try:
+        assert restarted.flush(timeout=5)
+    finally:
+        restarted.stop(timeout=5)
+    assert [body for _, body in handler.posts] == [{'record_id': 'r1'}]